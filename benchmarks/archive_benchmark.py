@@ -0,0 +1,110 @@
+"""
+History queries and retention on a large synthetic image_history
+
+Run from the repository root:
+    python benchmarks/archive_benchmark.py [rows]    (default 10,000,000)
+
+Builds a database of `rows` image history rows spread over USERS users
+and the last year, then times the history queries with and without the
+indexes, the total from the statistics table against COUNT(*), and one
+retention pass archiving the older half. While the pass runs, a second
+thread keeps creating users through AsyncBotDatabase and reports the
+slowest of those writes.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Callable, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from database import AsyncBotDatabase, BotDatabase  # noqa: E402
+
+USERS = 50000
+BATCH = 100000
+
+def populate(db_path: str, rows: int):
+    """Create the schema and insert rows of history spread over the last year"""
+    BotDatabase(db_path, activity_flush_interval=0).close()
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    now = time.time()
+    random.seed(1)
+    for start in range(0, rows, BATCH):
+        conn.executemany(
+            "INSERT INTO image_history (user_id, prompt, image_url, created_at) "
+            "VALUES (?, ?, ?, datetime(?, 'unixepoch'))",
+            [
+                (random.randrange(USERS), f"a synthetic prompt number {start + index}",
+                 "https://example.com/image.png", now - random.random() * 365 * 24 * 60 * 60)
+                for index in range(min(BATCH, rows - start))
+            ]
+        )
+        conn.commit()
+    conn.close()
+
+def timed(query: Callable[[], object], repeat: int = 20) -> float:
+    """Return the median milliseconds of query()"""
+    samples: List[float] = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        query()
+        samples.append((time.perf_counter() - started) * 1000)
+    return sorted(samples)[len(samples) // 2]
+
+LATEST_SQL = "SELECT * FROM image_history {} WHERE user_id = ? ORDER BY created_at DESC LIMIT 20"
+LAST_HOUR_SQL = "SELECT COUNT(*) FROM image_history WHERE created_at >= datetime('now', '-1 hour')"
+COUNT_SQL = "SELECT COUNT(*) FROM image_history"
+TOTAL_SQL = "SELECT value FROM stats WHERE name = 'total_images'"
+
+def query_latencies(db_path: str):
+    """Print history query times, indexed and forced to scan"""
+    conn = sqlite3.connect(db_path)
+    scan = timed(lambda: conn.execute(LATEST_SQL.format("NOT INDEXED"), (7,)).fetchall(), 3)
+    indexed = timed(lambda: conn.execute(LATEST_SQL.format(""), (7,)).fetchall())
+    print(f"per-user latest 20 rows   {scan:.2f} ms (full scan) -> {indexed:.3f} ms (index)")
+    last_hour = timed(lambda: conn.execute(LAST_HOUR_SQL).fetchone())
+    print(f"last-hour image count     {last_hour:.3f} ms (index)")
+    count = timed(lambda: conn.execute(COUNT_SQL).fetchone(), 3)
+    total = timed(lambda: conn.execute(TOTAL_SQL).fetchone())
+    print(f"total images              {count:.2f} ms (COUNT(*)) -> {total:.3f} ms (stats table)")
+    conn.close()
+
+async def archive_with_writes(db_path: str, archive_dir: str):
+    """Archive rows older than half a year while timing concurrent writes"""
+    db = AsyncBotDatabase(db_path)
+    archive = asyncio.ensure_future(db.archive_image_history(182, archive_dir))
+    started = time.perf_counter()
+    slowest = 0.0
+    user_id = 10 ** 9
+    while not archive.done():
+        write_started = time.perf_counter()
+        await db.create_user(user_id)
+        slowest = max(slowest, time.perf_counter() - write_started)
+        user_id += 1
+        await asyncio.sleep(0.01)
+    archived = await archive
+    elapsed = time.perf_counter() - started
+    await db.close()
+    print(f"archive pass              {archived:,} rows in {elapsed:.0f} s ({archived / elapsed:,.0f} rows/s)")
+    print(f"writes during the pass    {user_id - 10 ** 9:,}, slowest {slowest * 1000:.0f} ms")
+
+if __name__ == "__main__":
+    logging.disable(logging.WARNING)
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "bench.db")
+        started = time.perf_counter()
+        populate(db_path, rows)
+        print(f"populated {rows:,} rows in {time.perf_counter() - started:.0f} s, "
+              f"{os.path.getsize(db_path) / 1024 ** 2:,.0f} MB")
+        query_latencies(db_path)
+        asyncio.run(archive_with_writes(db_path, os.path.join(directory, "archive")))
+        print(f"database after the pass   {os.path.getsize(db_path) / 1024 ** 2:,.0f} MB")
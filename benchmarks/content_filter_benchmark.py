@@ -0,0 +1,41 @@
+"""
+Throughput of the image prompt content filter
+
+Run from the repository root: python benchmarks/content_filter_benchmark.py
+"""
+
+import logging
+import os
+import sys
+import time
+from typing import Iterable
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from content_filter import ContentFilter  # noqa: E402
+
+# A mix of typical prompts, including ones rejected by the term and form checks
+SAMPLE_PROMPTS = [
+    "a beautiful sunset over mountains with purple clouds",
+    "رسم لقطة تجلس على سطح القمر وتنظر إلى الأرض",
+    "a cozy cabin in a snowy forest, warm light in the windows, oil painting style " * 3,
+    "a knight holding a sword in front of a castle",
+    "this image is not safe for work",
+    "visit https://example.com for more",
+]
+
+def benchmark(prompts: Iterable[str], seconds: float = 2.0) -> float:
+    """Return how many prompts per second ContentFilter.check_prompt handles"""
+    content_filter = ContentFilter()
+    prompts = list(prompts)
+    checked = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        for prompt in prompts:
+            content_filter.check_prompt(prompt)
+        checked += len(prompts)
+    return checked / (time.perf_counter() - started)
+
+if __name__ == "__main__":
+    logging.disable(logging.WARNING)
+    print(f"{benchmark(SAMPLE_PROMPTS):,.0f} prompts/sec")
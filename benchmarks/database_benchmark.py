@@ -0,0 +1,53 @@
+"""
+Operations per second of the BotDatabase methods the bot calls per update
+
+Run from the repository root: python benchmarks/database_benchmark.py
+Each method is timed on a fresh temporary database with USERS users, from
+a single thread. save_image_generation only queues the row for the group
+commit writer, so its figure is the enqueue rate.
+"""
+
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Dict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from database import BotDatabase  # noqa: E402
+
+USERS = 1000
+
+def benchmark(operation: Callable[[BotDatabase, int], object], seconds: float = 1.0) -> float:
+    """Return how many times per second operation(db, user_id) runs, cycling over the users"""
+    with tempfile.TemporaryDirectory() as directory:
+        db = BotDatabase(os.path.join(directory, "bench.db"), activity_flush_interval=0)
+        for user_id in range(USERS):
+            db.create_user(user_id, f"user{user_id}")
+        calls = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            for user_id in range(0, USERS, 10):
+                operation(db, user_id)
+            calls += USERS // 10
+        elapsed = time.perf_counter() - started
+        db.close()
+    return calls / elapsed
+
+OPERATIONS: Dict[str, Callable[[BotDatabase, int], object]] = {
+    "get_user": lambda db, user_id: db.get_user(user_id),
+    "is_user_subscribed": lambda db, user_id: db.is_user_subscribed(user_id),
+    "update_user_activity": lambda db, user_id: db.update_user_activity(user_id),
+    "add_credits": lambda db, user_id: db.add_credits(user_id, 1),
+    "deduct_credit": lambda db, user_id: db.deduct_credit(user_id),
+    "save_image_generation": lambda db, user_id: db.save_image_generation(user_id, "a cat", "url"),
+    "get_user_stats": lambda db, user_id: db.get_user_stats(),
+}
+
+if __name__ == "__main__":
+    logging.disable(logging.WARNING)
+    print(f"{'method':<24}{'ops/sec':>10}")
+    for name, operation in OPERATIONS.items():
+        print(f"{name:<24}{benchmark(operation):>10,.0f}")
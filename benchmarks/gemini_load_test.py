@@ -0,0 +1,153 @@
+"""
+Load test of the async Gemini client against a local fake Gemini server
+
+Run from the repository root:
+    python benchmarks/gemini_load_test.py [requests] [mode]
+
+mode is "async" (GeminiClient.generate, the default), "stream"
+(GeminiClient.open_stream) or "thread" (the old asyncio.to_thread path).
+A fake GenerativeService is started in a subprocess: a grpc.aio server
+that answers every request after DELAY seconds, over TLS with a
+throwaway self-signed certificate (the SDK only speaks TLS). All requests
+are started at once, with scheduler limits high enough not to queue them.
+Needs the openssl command line tool.
+"""
+
+import asyncio
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+PORT = 50551
+DELAY = 0.5
+SERVICE = "google.ai.generativelanguage.v1beta.GenerativeService"
+
+def serve(cert_dir: str):
+    """Run the fake Gemini server until killed"""
+    import grpc
+    from google.ai import generativelanguage_v1beta as glm
+
+    def response(text: str) -> glm.GenerateContentResponse:
+        content = glm.Content(role="model", parts=[glm.Part(text=text)])
+        return glm.GenerateContentResponse(candidates=[glm.Candidate(content=content, finish_reason=1)])
+
+    async def generate(request, context):
+        await asyncio.sleep(DELAY)
+        return response("مرحبا")
+
+    async def stream(request, context):
+        await asyncio.sleep(DELAY)
+        for word in ("مرحبا ", "بك ", "!"):
+            yield response(word)
+            await asyncio.sleep(0.01)
+
+    handler = grpc.method_handlers_generic_handler(SERVICE, {
+        "GenerateContent": grpc.unary_unary_rpc_method_handler(
+            generate, request_deserializer=glm.GenerateContentRequest.deserialize,
+            response_serializer=glm.GenerateContentResponse.serialize
+        ),
+        "StreamGenerateContent": grpc.unary_stream_rpc_method_handler(
+            stream, request_deserializer=glm.GenerateContentRequest.deserialize,
+            response_serializer=glm.GenerateContentResponse.serialize
+        ),
+    })
+
+    async def run():
+        server = grpc.aio.server(options=[("grpc.max_concurrent_streams", 100000)])
+        server.add_generic_rpc_handlers((handler,))
+        with open(os.path.join(cert_dir, "key.pem"), "rb") as key, \
+                open(os.path.join(cert_dir, "cert.pem"), "rb") as cert:
+            credentials = grpc.ssl_server_credentials([(key.read(), cert.read())])
+        server.add_secure_port(f"localhost:{PORT}", credentials)
+        await server.start()
+        print("ready", flush=True)
+        await server.wait_for_termination()
+
+    asyncio.run(run())
+
+async def load(requests: int, mode: str):
+    """Send requests concurrent calls through GeminiClient and print the outcome"""
+    import google.generativeai as genai
+    from gemini_scheduler import GeminiScheduler
+    from model_client import GeminiClient
+    from resilience import Resilience
+
+    genai.configure(api_key="fake", client_options={"api_endpoint": f"localhost:{PORT}"})
+    model = genai.GenerativeModel("gemini-1.5-flash")
+    scheduler = GeminiScheduler(max_concurrency=100000)
+    scheduler.add_model("load", 100000, 10 ** 9)
+    client = GeminiClient(model, "load", Resilience("load", timeout=60), scheduler)
+
+    async def generate():
+        return (await client.generate("hi")).text
+
+    async def in_thread():
+        return (await asyncio.to_thread(model.generate_content, "hi")).text
+
+    async def stream():
+        async with client.slot():
+            first, rest = await client.open_stream([], "hi")
+            text = first.text
+            async for chunk in rest:
+                text += chunk.text
+        return text
+
+    call = {"async": generate, "thread": in_thread, "stream": stream}[mode]
+    # Open the channel before the clock starts
+    await call()
+
+    peak_threads = threading.active_count()
+
+    async def sample_threads():
+        nonlocal peak_threads
+        while True:
+            peak_threads = max(peak_threads, threading.active_count())
+            await asyncio.sleep(0.05)
+
+    sampler = asyncio.create_task(sample_threads())
+    started = time.perf_counter()
+    results = await asyncio.gather(*(call() for _ in range(requests)), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+
+    errors = [result for result in results if isinstance(result, BaseException)]
+    print(
+        f"{mode}: {requests} requests in {elapsed:.2f} s ({requests / elapsed:,.0f} req/s), "
+        f"{len(errors)} errors, peak {peak_threads} threads, "
+        f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB"
+    )
+    if errors:
+        print(f"first error: {errors[0]!r}")
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--serve"]:
+        serve(sys.argv[2])
+        sys.exit()
+
+    logging.disable(logging.WARNING)
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    mode = sys.argv[2] if len(sys.argv) > 2 else "async"
+    with tempfile.TemporaryDirectory() as cert_dir:
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+             "-keyout", os.path.join(cert_dir, "key.pem"), "-out", os.path.join(cert_dir, "cert.pem"),
+             "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost"],
+            check=True, capture_output=True
+        )
+        # The client trusts the throwaway certificate through gRPC's root store
+        os.environ["GRPC_DEFAULT_SSL_ROOTS_FILE_PATH"] = os.path.join(cert_dir, "cert.pem")
+        server = subprocess.Popen([sys.executable, __file__, "--serve", cert_dir], stdout=subprocess.PIPE, text=True)
+        try:
+            if server.stdout.readline().strip() != "ready":
+                sys.exit("fake Gemini server did not start")
+            asyncio.run(load(requests, mode))
+        finally:
+            server.kill()
+            server.wait()
@@ -0,0 +1,151 @@
+"""
+Audio encoder module for Telegram AI Bot
+Encodes synthesized PCM to OGG/Opus voice notes in worker processes
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import subprocess
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from typing import Deque, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Before Python 3.13, attaching to a segment registers it with the
+# resource tracker, which may then unlink it when the worker exits
+_ATTACH_REGISTERS = sys.version_info < (3, 13)
+
+# Workers must not be forked from the bot, whose event loop, executor and
+# SQLite threads may hold locks at fork time; forkserver forks them from a
+# clean single-threaded server instead (spawn where it is unavailable)
+_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+def _encode_opus(shm_name: str, length: int, sample_rate: int, channels: int, bitrate: str) -> bytes:
+    """
+    Encode 16-bit PCM held in shared memory to OGG/Opus (runs in a worker)
+
+    The PCM is piped to ffmpeg straight from the shared memory buffer, so
+    it is never pickled or copied into the worker's heap.
+    """
+    if _ATTACH_REGISTERS:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        # The parent owns the segment
+        resource_tracker.unregister(shm._name, "shared_memory")
+    else:
+        shm = shared_memory.SharedMemory(name=shm_name, track=False)
+    try:
+        pcm = shm.buf[:length]
+        try:
+            result = subprocess.run(
+                [
+                    "ffmpeg", "-hide_banner", "-loglevel", "error",
+                    "-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels), "-i", "pipe:0",
+                    "-c:a", "libopus", "-b:a", bitrate, "-application", "voip",
+                    "-f", "ogg", "pipe:1"
+                ],
+                input=pcm,
+                capture_output=True,
+                check=True
+            )
+        finally:
+            pcm.release()
+        return result.stdout
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg failed: {e.stderr.decode(errors='replace').strip()}") from None
+    finally:
+        shm.close()
+
+class OpusEncoder:
+    """
+    PCM to OGG/Opus encoder backed by a process pool
+
+    Encoding is CPU bound, so it runs in worker processes instead of on
+    the event loop. At most max_pending encodes are queued or running at
+    once; further callers wait for a slot, which keeps a burst of voice
+    replies from piling up PCM buffers in memory. Each buffer is handed
+    to the worker through shared memory rather than pickled.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 8, bitrate: str = "32k"):
+        """Initialize the encoder; worker processes start on first use"""
+        self.bitrate = bitrate
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(_START_METHOD))
+        self._max_pending = max_pending
+        # Created on first use, inside the loop that will await it
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def encode(self, pcm: bytes, sample_rate: int = 24000, channels: int = 1) -> bytes:
+        """Encode 16-bit little-endian PCM, returning the OGG/Opus bytes"""
+        if not pcm:
+            raise ValueError("No audio to encode")
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._max_pending)
+        async with self._slots:
+            shm = shared_memory.SharedMemory(create=True, size=len(pcm))
+            try:
+                shm.buf[:len(pcm)] = pcm
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    self._pool, _encode_opus, shm.name, len(pcm), sample_rate, channels, self.bitrate
+                )
+            finally:
+                shm.close()
+                if _ATTACH_REGISTERS:
+                    # A worker sharing our resource tracker dropped the
+                    # registration that unlink() is about to remove
+                    resource_tracker.register(shm._name, "shared_memory")
+                shm.unlink()
+
+    def close(self):
+        """Stop the worker processes"""
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+class LoopLagMonitor:
+    """
+    Measures how long the event loop is blocked
+
+    A background task sleeps for interval seconds at a time and records
+    how late it wakes up. Any lateness is time the loop spent running
+    something else without yielding.
+    """
+
+    def __init__(self, interval: float = 0.05, window: int = 12000):
+        """Initialize the monitor; call start() from a running loop"""
+        self.interval = interval
+        self._samples: Deque[Tuple[float, float]] = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start sampling on the running loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        """Record the wake-up delay of each sleep"""
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            self._samples.append((now, max(0.0, now - expected)))
+
+    def peak_since(self, since: float) -> float:
+        """Return the longest stall (seconds) observed after the perf_counter() time since"""
+        peak = 0.0
+        for timestamp, lag in reversed(self._samples):
+            if timestamp < since:
+                break
+            peak = max(peak, lag)
+        return peak
+
+    async def stop(self):
+        """Stop sampling"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
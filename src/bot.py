@@ -1,14 +1,37 @@
 import logging
 import os
+import math
+import functools
+import hashlib
 import io
 import asyncio
-import wave
+import time
+import resource
 import base64
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.error import BadRequest
+from telegram.ext import (
+    Application, ApplicationHandlerStop, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes
+)
 import google.generativeai as genai
 from dotenv import load_dotenv
-from pydub import AudioSegment
+from database import AsyncBotDatabase
+from conversation_memory import ConversationMemory
+from conversation_store import ConversationPersistence
+from metrics import LatencyStats
+from streaming_reply import StreamingReply, ttft_stats
+from audio_encoder import LoopLagMonitor, OpusEncoder
+from gemini_scheduler import GeminiScheduler, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+from resilience import CircuitBreaker, CircuitOpenError, Resilience, get_all_stats as get_resilience_stats
+from model_client import GeminiClient
+from webhook_server import WebhookServer
+from update_processor import PerUserUpdateProcessor
+from response_cache import ResponseCache, load_allowlist
+from image_store import ImageStore
+from content_filter import ContentFilter, FilterVerdict
+from rate_limiter import ActionLimit, RateLimiter, parse_action_limit
+from intent_router import INTENT_IMAGE, IntentRouter
+from speech_pipeline import AudioCache, SpeechPipeline
 
 # -----------------------------
 # تحميل المتغيرات من .env
@@ -16,6 +39,58 @@ from pydub import AudioSegment
 load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+DATABASE_PATH = os.getenv("DATABASE_PATH", "bot_database.db")
+ADMIN_USER_ID = int(os.getenv("ADMIN_USER_ID", "0"))
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "90"))
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "2000"))
+CONVERSATION_IDLE_SECONDS = int(os.getenv("CONVERSATION_IDLE_SECONDS", "1800"))
+TTS_VOICE = os.getenv("TTS_VOICE", "Kore")
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "audio_cache")
+TTS_CACHE_MEMORY_MB = int(os.getenv("TTS_CACHE_MEMORY_MB", "32"))
+TTS_CACHE_DISK_MB = int(os.getenv("TTS_CACHE_DISK_MB", "256"))
+AUDIO_ENCODER_WORKERS = int(os.getenv("AUDIO_ENCODER_WORKERS", "2"))
+AUDIO_ENCODER_MAX_PENDING = int(os.getenv("AUDIO_ENCODER_MAX_PENDING", "8"))
+# الرسائل الصوتية الأكبر من هذا الحد تُرفع عبر File API بدلًا من إرسالها داخل الطلب
+VOICE_INLINE_LIMIT_BYTES = int(os.getenv("VOICE_INLINE_LIMIT_BYTES", str(10 * 1024 * 1024)))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+# مهلة أول جزء من الرد النصي، ثم المهلة القصوى بين الأجزاء
+GEMINI_TEXT_TIMEOUT = float(os.getenv("GEMINI_TEXT_TIMEOUT", "30"))
+GEMINI_STREAM_IDLE_TIMEOUT = float(os.getenv("GEMINI_STREAM_IDLE_TIMEOUT", "30"))
+GEMINI_MEDIA_TIMEOUT = float(os.getenv("GEMINI_MEDIA_TIMEOUT", "90"))
+# وضع التشغيل: polling (افتراضي) أو webhook بعدة عمليات
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", str(os.cpu_count() or 1)))
+# عدد التحديثات التي تُعالج في نفس الوقت (لمستخدمين مختلفين)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))
+# ذاكرة الردود اختيارية: تُعيد استخدام إجابات الأسئلة العامة المتكررة في أول المحادثة
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0") == "1"
+RESPONSE_CACHE_MB = int(os.getenv("RESPONSE_CACHE_MB", "8"))
+RESPONSE_CACHE_TTL_HOURS = float(os.getenv("RESPONSE_CACHE_TTL_HOURS", "24"))
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB", "")
+RESPONSE_CACHE_ALLOWLIST = os.getenv("RESPONSE_CACHE_ALLOWLIST", "")
+# الصور المولّدة تُعاد باستخدام file_id عند تكرار الوصف نفسه
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "image_cache")
+IMAGE_CACHE_MB = int(os.getenv("IMAGE_CACHE_MB", "512"))
+IMAGE_CACHE_MAX_AGE_DAYS = float(os.getenv("IMAGE_CACHE_MAX_AGE_DAYS", "30"))
+# أوصاف الصور تُفحص قبل أي استدعاء لنموذج الصور؛ الفحص الثاني بالنموذج النصي اختياري
+CONTENT_FILTER_MODEL_CHECK = os.getenv("CONTENT_FILTER_MODEL_CHECK", "0") == "1"
+CONTENT_FILTER_CACHE_SIZE = int(os.getenv("CONTENT_FILTER_CACHE_SIZE", "10000"))
+# أقل ثقة لاعتبار الرسالة النصية طلبًا لإنشاء صورة
+IMAGE_INTENT_THRESHOLD = float(os.getenv("IMAGE_INTENT_THRESHOLD", "0.6"))
+# حدود الاستخدام: "عدد في الدقيقة لكل مستخدم,الدفعة المسموحة,الحد العام في الدقيقة (0 بلا حد)"
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", "")
+RATE_LIMITS = {
+    "message": parse_action_limit(os.getenv("RATE_LIMIT_MESSAGE", ""), ActionLimit(20, 10, 0)),
+    "command": parse_action_limit(os.getenv("RATE_LIMIT_COMMAND", ""), ActionLimit(10, 5, 0)),
+    "voice": parse_action_limit(os.getenv("RATE_LIMIT_VOICE", ""), ActionLimit(6, 3, 240)),
+    "image": parse_action_limit(os.getenv("RATE_LIMIT_IMAGE", ""), ActionLimit(2, 3, 50)),
+    "tts": parse_action_limit(os.getenv("RATE_LIMIT_TTS", ""), ActionLimit(10, 5, 80)),
+}
 
 # التحقق من وجود المفاتيح
 if not TELEGRAM_BOT_TOKEN:
@@ -35,38 +110,168 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# -----------------------------
+# برومبت البوت الاحترافي
+# -----------------------------
+PROFESSIONAL_PROMPT = """
+أنت الآن تعمل كبوت مساعد ذكي للغاية، متعدد المجالات، وودي، يمكنه التحدث بالعربية بطلاقة.
+هدفك هو مساعدة المستخدمين بأفضل طريقة ممكنة، مع تقديم إجابات دقيقة وواضحة.
+"""
+
 # -----------------------------
 # إعداد Gemini
 # -----------------------------
 genai.configure(api_key=GEMINI_API_KEY)
 
-text_model = genai.GenerativeModel("gemini-1.5-flash")
-tts_model = genai.GenerativeModel(model_name="gemini-2.5-flash-preview-tts")
-image_model = genai.GenerativeModel(model_name="gemini-2.0-flash-preview-image-generation")
-transcription_model = genai.GenerativeModel("gemini-1.5-pro-latest")
+TEXT_MODEL = "gemini-1.5-flash"
+TTS_MODEL = "gemini-2.5-flash-preview-tts"
+IMAGE_MODEL = "gemini-2.0-flash-preview-image-generation"
+TRANSCRIPTION_MODEL = "gemini-1.5-pro-latest"
+
+# البرومبت الاحترافي مثبت كتعليمات نظام بدلًا من إرساله كرسالة مستخدم
+text_model = genai.GenerativeModel(TEXT_MODEL, system_instruction=PROFESSIONAL_PROMPT)
+summary_model = genai.GenerativeModel(TEXT_MODEL)
+tts_model = genai.GenerativeModel(model_name=TTS_MODEL)
+image_model = genai.GenerativeModel(model_name=IMAGE_MODEL)
+transcription_model = genai.GenerativeModel(TRANSCRIPTION_MODEL)
+
+# كل طلبات Gemini تمر عبر المجدول: حدود تزامن ومعدل لكل نموذج، أولوية للرد
+# النصي التفاعلي، وتوزيع عادل بين المستخدمين
+# The scheduler, clients, database, caches and encoder pool hold threads,
+# processes and connections; they are built by create_services() in the
+# process that runs the Application (a webhook worker, or the polling
+# process), never in the webhook front process
+gemini_scheduler = None
+
+# Limits are per process: in webhook mode each worker gets its share
+SCHEDULER_PROCESSES = WEBHOOK_WORKERS if BOT_MODE == "webhook" else 1
+
+def register_model_limits(model: str, env_name: str, concurrency: int, requests_per_minute: int):
+    concurrency = int(os.getenv(f"GEMINI_{env_name}_CONCURRENCY", str(concurrency)))
+    requests_per_minute = float(os.getenv(f"GEMINI_{env_name}_RPM", str(requests_per_minute)))
+    gemini_scheduler.add_model(
+        model,
+        math.ceil(concurrency / SCHEDULER_PROCESSES),
+        requests_per_minute / SCHEDULER_PROCESSES
+    )
+
+text_breaker = None
+text_client = summary_client = tts_client = image_client = transcription_client = None
+
+response_cache = None
+rate_limiter = None
+
+# ردود التقييد ثابتة ومُعدّة مسبقًا، ولا تُرسل للمستخدم أكثر من مرة كل 30 ثانية
+THROTTLE_REPLIES = {
+    "image": "⏳ وصلت إلى الحد المسموح لإنشاء الصور، حاول مرة أخرى بعد قليل.",
+    "voice": "⏳ أرسلت رسائل صوتية كثيرة، انتظر قليلًا ثم حاول مرة أخرى.",
+}
+DEFAULT_THROTTLE_REPLY = "⏳ أرسلت رسائل كثيرة بسرعة، انتظر قليلًا ثم حاول مرة أخرى."
+
+def rate_limit_action(update: Update):
+    """Return the rate-limited action an update triggers, or None"""
+    message = update.effective_message
+    if update.effective_user is None or message is None:
+        return None
+    if message.voice:
+        return "voice"
+    if message.text and message.text.startswith("/"):
+        return "command"
+    return "message"
+
+async def rate_limit_middleware(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Runs before every handler (group -1) and stops updates over the limits"""
+    action = rate_limit_action(update)
+    if action is None:
+        return
+    user_id = update.effective_user.id
+    retry_after = rate_limiter.try_acquire(user_id, action)
+    if not retry_after:
+        return
+    logger.info(f"Rate limited user {user_id} ({action}), retry in {retry_after:.0f}s")
+    if rate_limiter.should_notify(user_id):
+        await update.effective_message.reply_text(THROTTLE_REPLIES.get(action, DEFAULT_THROTTLE_REPLY))
+    raise ApplicationHandlerStop
+
+def queue_notice(message):
+    """Return an on_queued callback that shows the queue position in message"""
+    async def notify(position: int):
+        await message.edit_text(f"⏳ الطلبات كثيرة الآن، طلبك في قائمة الانتظار (الموقع {position})...")
+    return notify
 
 # -----------------------------
-# برومبت البوت الاحترافي
+# قاعدة البيانات
 # -----------------------------
-PROFESSIONAL_PROMPT = """
-أنت الآن تعمل كبوت مساعد ذكي للغاية، متعدد المجالات، وودي، يمكنه التحدث بالعربية بطلاقة.
-هدفك هو مساعدة المستخدمين بأفضل طريقة ممكنة، مع تقديم إجابات دقيقة وواضحة.
-"""
+db = None
+conversation_persistence = None
+update_processor = None
 
 # -----------------------------
 # دوال البوت
 # -----------------------------
+def get_memory(context: ContextTypes.DEFAULT_TYPE) -> ConversationMemory:
+    """Return the user's conversation memory, creating it on first use"""
+    memory = context.user_data.get('memory')
+    if memory is None:
+        memory = ConversationMemory(CHAT_HISTORY_TOKEN_BUDGET)
+        context.user_data['memory'] = memory
+    return memory
+
+async def summarize_turns(previous_summary: str, turns: list) -> str:
+    """Fold older turns into the running conversation summary"""
+    transcript = "\n".join(
+        f"{'المستخدم' if role == 'user' else 'المساعد'}: {text}" for role, text in turns
+    )
+    prompt = (
+        "لخّص المحادثة التالية في فقرة قصيرة تحتفظ بالحقائق والتفضيلات والأسئلة المفتوحة المهمة.\n"
+        f"الملخص السابق: {previous_summary or 'لا يوجد'}\n\n{transcript}"
+    )
+    response = await summary_client.generate(prompt, priority=PRIORITY_BACKGROUND)
+    if response.candidates and response.candidates[0].content.parts:
+        return response.candidates[0].content.parts[0].text.strip()
+    return ""
+
+MODERATION_PROMPT = (
+    "You review prompts for an image generator. Reply with exactly SAFE if the prompt below is "
+    "acceptable, or UNSAFE followed by one lowercase word naming the category "
+    "(nsfw, violence, hate, illegal, other) if it asks for sexual, violent, hateful or illegal content.\n\n"
+    "Prompt: "
+)
+
+async def moderate_with_model(prompt: str) -> FilterVerdict:
+    """Second-stage content check of an image prompt with the text model"""
+    response = await summary_client.generate(MODERATION_PROMPT + prompt, priority=PRIORITY_INTERACTIVE)
+    if not response.candidates or not response.candidates[0].content.parts:
+        # Gemini's own safety filters blocked the prompt
+        return FilterVerdict(False, "model")
+    answer = response.candidates[0].content.parts[0].text.strip().split()
+    if answer and answer[0].upper().startswith("UNSAFE"):
+        return FilterVerdict(False, answer[1].lower() if len(answer) > 1 else "model")
+    return FilterVerdict(True)
+
+content_filter = None
+
+async def register_user(update: Update):
+    """Create the user on first contact, otherwise refresh last_active"""
+    user = update.effective_user
+    if not user:
+        return
+    if await db.get_user(user.id):
+        await db.update_user_activity(user.id)
+    else:
+        await db.create_user(user.id, user.username, user.first_name, user.last_name)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # إضافة البرومبت الاحترافي كجزء من تاريخ المحادثة
-    context.user_data['chat_history'] = [{"role": "user", "parts": [{"text": PROFESSIONAL_PROMPT}]}]
-    await update.message.reply_text(
+    await register_user(update)
+    get_memory(context).clear()
+    await update.effective_message.reply_text(
         "👋 أهلاً بك! أنا بوت يعمل بالذكاء الاصطناعي (Gemini).\n"
         "أرسل لي أي رسالة نصية أو صوتية وسأرد عليك.\n"
         "يمكنك أيضًا استخدام الأمر /image لإنشاء صور أو /clear لمسح المحادثة."
     )
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
+    await update.effective_message.reply_text(
         "ℹ️ أوامر البوت:\n"
         "/start - بدء البوت\n"
         "/help - عرض الأوامر\n"
@@ -75,153 +280,385 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data['chat_history'] = []
-    await update.message.reply_text("✅ تم مسح سجل المحادثة.")
+    get_memory(context).clear()
+    await update.effective_message.reply_text("✅ تم مسح سجل المحادثة.")
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not ADMIN_USER_ID or update.effective_user.id != ADMIN_USER_ID:
+        return
+
+    stats = await db.get_user_stats()
+    hourly = await db.get_hourly_stats(24)
+    cache = db.get_cache_stats()
+
+    lines = [
+        "📊 إحصائيات البوت:",
+        f"👥 المستخدمون: {stats['total_users']}",
+        f"🌟 المشتركون النشطون: {stats['active_subscribers']}",
+        f"🎨 الصور المنشأة: {stats['total_images']}",
+        f"💰 الإيرادات: ${stats['total_revenue']:.2f}",
+        "",
+        "🕐 آخر 24 ساعة:",
+        f"🎨 صور: {sum(h['images'] for h in hourly)}",
+        f"👥 مستخدمون جدد: {sum(h['new_users'] for h in hourly)}",
+        f"💰 إيرادات: ${sum(h['revenue'] for h in hourly):.2f}",
+    ]
+    # آخر ست ساعات فيها نشاط، ساعة بساعة (UTC)
+    for h in hourly[-6:]:
+        lines.append(f"  {h['bucket'][11:]} — 🎨 {h['images']} | 👥 {h['new_users']} | 💰 ${h['revenue']:.2f}")
+
+    ttft = ttft_stats.summary()
+    if ttft['count']:
+        lines += [
+            "",
+            f"⚡ زمن أول رد (TTFT): p50 {ttft['p50']:.2f}s | p95 {ttft['p95']:.2f}s ({ttft['count']} رد)",
+        ]
+
+    lines += [
+        "",
+        f"🗄️ ذاكرة المستخدمين: {cache['size']} | إصابات {cache['hits']} | إخفاقات {cache['misses']} | إخلاء {cache['evictions']}",
+    ]
+    audio = audio_cache.get_stats()
+    lines.append(
+        f"🔊 ذاكرة الصوت: {audio['entries']} ({audio['bytes'] // 1024} KB) | "
+        f"إصابات {audio['hits']} + {audio['disk_hits']} من القرص | إخفاقات {audio['misses']} | "
+        f"القرص {audio['disk_bytes'] // (1024 * 1024)} MB، إخلاء {audio['disk_evictions']}"
+    )
+    if response_cache is not None:
+        answers = response_cache.get_stats()
+        lines.append(
+            f"💬 ذاكرة الردود: {answers['entries']} ({answers['bytes'] // 1024} KB) | "
+            f"إصابات {answers['hits']}/{answers['lookups']} ({answers['hit_rate']:.0%}, منها {answers['disk_hits']} من القرص) | "
+            f"وقت موفَّر {answers['saved_seconds']:.1f}s"
+        )
+    moderation = content_filter.get_stats()
+    rejections = ", ".join(f"{category} {count}" for category, count in sorted(moderation['rejections'].items()))
+    lines.append(
+        f"🚫 فلتر المحتوى: {moderation['classified']} فحص | من الذاكرة {moderation['cache_hits']} | "
+        f"فحص بالنموذج {moderation['second_stage_calls']} | مرفوض: {rejections or 'لا شيء'}"
+    )
+    limits = rate_limiter.get_stats()
+    throttled = ", ".join(
+        f"{action} {limits['throttled'].get(action, 0) + limits['global_throttled'].get(action, 0)}"
+        for action in RATE_LIMITS
+    )
+    lines.append(f"🚧 حدود الاستخدام: {limits['buckets']} مستخدم نشط | مرفوض: {throttled}")
+    intents = intent_router.get_stats()
+    lines.append(
+        f"🧭 توجيه الرسائل: صور {intents['image']} | محادثة {intents['chat']} "
+        f"(منها {intents['below_threshold']} دون حد الثقة)"
+    )
+    images = image_store.get_stats()
+    lines.append(
+        f"🖼️ ذاكرة الصور: إعادة إرسال {images['file_id_hits']}/{images['lookups']} | "
+        f"من القرص {images['disk_hits']} | محذوفة {images['evicted_files']}"
+    )
+    updates = update_processor.get_stats()
+    lines.append(
+        f"📥 التحديثات: عولج {updates['processed']} | في الانتظار {updates['updates_queued']} "
+        f"({updates['users_queued']} مستخدم) | تعديلات مدمجة {updates['merged_edits']} / مُهملة {updates['dropped_edits']} "
+        f"| مكررة {updates['duplicates']}"
+    )
+    queue = gemini_scheduler.get_stats()
+    lines.append(f"🚦 طلبات Gemini: جارية {queue['running']} | في الانتظار {queue['waiting']} | انتظرت {queue['queued']} من {queue['granted']}")
+    for name, call_stats in get_resilience_stats().items():
+        lines.append(
+            f"🛡️ {name}: {call_stats['state']} | طلبات {call_stats['calls']} | إعادة {call_stats['retries']} | "
+            f"مهلات {call_stats['timeouts']} | تحوّط {call_stats['hedges']}/{call_stats['hedge_wins']} | "
+            f"رُفضت فورًا {call_stats['short_circuits']}"
+        )
+    stall = voice_stall_stats.summary()
+    if stall['count']:
+        lines.append(f"⏱️ توقف حلقة الأحداث أثناء الرد الصوتي: p50 {stall['p50'] * 1000:.0f}ms | p95 {stall['p95'] * 1000:.0f}ms")
+    await update.effective_message.reply_text("\n".join(lines))
 
 # -----------------------------
-# تحويل النص إلى صوت WAV
+# تحويل النص إلى صوت OGG/Opus
 # -----------------------------
-async def convert_text_to_wav(text: str) -> io.BytesIO:
-    try:
-        generation_config = genai.types.GenerationConfig(
-            speech_config=genai.types.SpeechConfig(
-                voice_config=genai.types.VoiceConfig(
-                    prebuilt_voice_config=genai.types.PrebuiltVoiceConfig(
-                        voice_name="Kore"
-                    )
+# Gemini TTS output: 16-bit mono PCM at 24 kHz
+TTS_SAMPLE_RATE = 24000
+
+opus_encoder = None
+loop_monitor = LoopLagMonitor()
+# Longest event loop stall seen while each voice reply was produced and sent
+voice_stall_stats = LatencyStats()
+
+async def _synthesize_pcm(text: str, voice: str) -> bytes:
+    generation_config = genai.types.GenerationConfig(
+        speech_config=genai.types.SpeechConfig(
+            voice_config=genai.types.VoiceConfig(
+                prebuilt_voice_config=genai.types.PrebuiltVoiceConfig(
+                    voice_name=voice
                 )
             )
         )
-        response = await asyncio.to_thread(
-            tts_model.generate_content,
-            contents=[{"parts": [{"text": text}]}],
-            generation_config=generation_config
-        )
-        if not response.candidates:
-            logger.error("❌ Gemini TTS returned no candidates")
-            return None
-        
-        audio_part = next((p for p in response.candidates[0].content.parts if "inlineData" in p), None)
-        if not audio_part:
-            logger.error("❌ Gemini TTS returned no audio data")
-            return None
+    )
+    # Voice audio is shared between users through the cache and each
+    # user has at most one pending voice reply, so no per-user fairness
+    response = await tts_client.generate(
+        [{"parts": [{"text": text}]}],
+        priority=PRIORITY_BACKGROUND,
+        generation_config=generation_config
+    )
+    if not response.candidates:
+        logger.error("❌ Gemini TTS returned no candidates")
+        return None
+    
+    audio_part = next((p for p in response.candidates[0].content.parts if "inlineData" in p), None)
+    if not audio_part:
+        logger.error("❌ Gemini TTS returned no audio data")
+        return None
 
-        audio_data = base64.b64decode(audio_part.inlineData.data)
-        audio_segment = AudioSegment(
-            data=audio_data,
-            sample_width=2,
-            frame_rate=24000,
-            channels=1
+    return base64.b64decode(audio_part.inlineData.data)
+
+async def convert_text_to_voice(text: str, voice: str = TTS_VOICE) -> bytes:
+    try:
+        pcm = await _synthesize_pcm(text, voice)
+        if not pcm:
+            return None
+        started = time.perf_counter()
+        audio = await opus_encoder.encode(pcm, TTS_SAMPLE_RATE)
+        logger.info(
+            f"Encoded voice reply: {len(audio)} bytes OGG/Opus from {len(pcm)} bytes PCM "
+            f"in {(time.perf_counter() - started) * 1000:.0f} ms"
         )
-        audio_stream = io.BytesIO()
-        audio_segment.export(audio_stream, format="wav")
-        audio_stream.seek(0)
-        return audio_stream
+        return audio
+    except CircuitOpenError:
+        return None
     except Exception as e:
         logger.error(f"❌ TTS error: {e}")
         return None
 
+async def send_voice_reply(update: Update, started: float, audio: bytes):
+    await update.effective_message.reply_voice(voice=audio)
+    stall = loop_monitor.peak_since(started)
+    voice_stall_stats.add(stall)
+    logger.info(f"Sent voice reply: {len(audio)} bytes uploaded, peak event loop stall {stall * 1000:.0f} ms")
+
+audio_cache = None
+speech = None
+
 # -----------------------------
 # توليد الصور
 # -----------------------------
+image_store = None
+
 async def _generate_and_send_image(update: Update, context: ContextTypes.DEFAULT_TYPE, prompt: str):
     if not prompt:
-        await update.message.reply_text("🤔 من فضلك أرسل وصفًا للصورة.")
+        await update.effective_message.reply_text("🤔 من فضلك أرسل وصفًا للصورة.")
+        return
+
+    if not image_client.is_available():
+        await update.effective_message.reply_text("⚠️ خدمة إنشاء الصور غير متاحة مؤقتًا، حاول مرة أخرى بعد قليل.")
         return
-    try:
-        await update.message.reply_text("⏳ جاري إنشاء الصورة...")
-        full_prompt = f"generate a creative and imaginative image: {prompt}"
-        image_response = await asyncio.to_thread(
-            image_model.generate_content,
-            contents=[{"parts": [{"text": full_prompt}]}],
-            response_modalities=["IMAGE", "TEXT"]
-        )
-        if not image_response.candidates:
-            await update.message.reply_text("❌ لم أستطع توليد الصورة.")
-            return
 
-        image_part = next((p for p in image_response.candidates[0].content.parts if "inlineData" in p), None)
-        if not image_part:
-            await update.message.reply_text("❌ لم أستطع استخراج بيانات الصورة.")
+    # للصور حد خاص بها، سواء طُلبت بالأمر /image أو بكلمة في رسالة نصية
+    retry_after = rate_limiter.try_acquire(update.effective_user.id, "image")
+    if retry_after:
+        logger.info(f"Rate limited user {update.effective_user.id} (image), retry in {retry_after:.0f}s")
+        # كما في rate_limit_middleware: تنبيه واحد كل فترة لا ردّ على كل محاولة
+        if rate_limiter.should_notify(update.effective_user.id):
+            await update.effective_message.reply_text(THROTTLE_REPLIES["image"])
+        return
+
+    # يُرفض الوصف المخالف قبل حجز الرصيد أو استدعاء نموذج الصور
+    verdict = await content_filter.classify(prompt)
+    if not verdict.safe:
+        logger.info(f"Image prompt from {update.effective_user.id} rejected: {verdict.category}")
+        await update.effective_message.reply_text("🚫 لا يمكن إنشاء هذه الصورة لأن الوصف يخالف سياسة المحتوى.")
+        return
+
+    # المشتركون لا يدفعون، وغيرهم يُحجز لهم رصيد يُسترد عند الفشل
+    user_id = update.effective_user.id
+    charge_key = None
+    if not await db.is_user_subscribed(user_id):
+        charge_key = f"image:{update.update_id}"
+        if not await db.reserve_credit(user_id, charge_key):
+            await update.effective_message.reply_text("💳 رصيدك غير كافٍ لإنشاء صورة جديدة.")
             return
-        
-        image_data = base64.b64decode(image_part.inlineData.data)
-        await update.message.reply_photo(photo=io.BytesIO(image_data), caption="✅ تم إنشاء الصورة!")
+
+    succeeded = False
+    try:
+        # A prompt seen before is answered with the stored image, by file_id if possible
+        key = image_store.key_for(prompt, IMAGE_MODEL)
+        file_id, content_hash = await image_store.lookup(key)
+        photo_message = None
+        if file_id:
+            try:
+                photo_message = await update.effective_message.reply_photo(photo=file_id, caption="✅ تم إنشاء الصورة!")
+            except BadRequest as e:
+                logger.warning(f"Stored image file_id was rejected, uploading again: {e}")
+                await image_store.set_file_id(key, None)
+
+        if photo_message is None:
+            image_data = await image_store.read(content_hash) if content_hash else None
+            if image_data is None:
+                processing_message = await update.effective_message.reply_text("⏳ جاري إنشاء الصورة...")
+                full_prompt = f"generate a creative and imaginative image: {prompt}"
+                image_response = await image_client.generate(
+                    [{"parts": [{"text": full_prompt}]}],
+                    user_id, PRIORITY_BACKGROUND, queue_notice(processing_message),
+                    response_modalities=["IMAGE", "TEXT"]
+                )
+                if not image_response.candidates:
+                    await update.effective_message.reply_text("❌ لم أستطع توليد الصورة.")
+                    return
+
+                image_part = next((p for p in image_response.candidates[0].content.parts if "inlineData" in p), None)
+                if not image_part:
+                    await update.effective_message.reply_text("❌ لم أستطع استخراج بيانات الصورة.")
+                    return
+
+                image_data = base64.b64decode(image_part.inlineData.data)
+                await image_store.put(key, image_data)
+            photo_message = await update.effective_message.reply_photo(photo=io.BytesIO(image_data), caption="✅ تم إنشاء الصورة!")
+            await image_store.set_file_id(key, photo_message.photo[-1].file_id)
+
+        succeeded = True
+        await db.save_image_generation(user_id, prompt, photo_message.photo[-1].file_id)
+    except CircuitOpenError:
+        await update.effective_message.reply_text("⚠️ خدمة إنشاء الصور غير متاحة مؤقتًا، حاول مرة أخرى بعد قليل.")
     except Exception as e:
         logger.error(f"❌ Image generation error: {e}")
-        await update.message.reply_text("❌ حدث خطأ أثناء توليد الصورة.")
+        if not succeeded:
+            await update.effective_message.reply_text("❌ حدث خطأ أثناء توليد الصورة.")
+    finally:
+        if charge_key:
+            if succeeded:
+                await db.commit_credit(charge_key)
+            else:
+                await db.refund_credit(charge_key)
 
 async def handle_image_generation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await register_user(update)
     prompt = " ".join(context.args)
     await _generate_and_send_image(update, context, prompt)
 
 # -----------------------------
 # معالجة النصوص
 # -----------------------------
+def chunk_text(chunk) -> str:
+    """Extract the text of one streamed response chunk"""
+    if chunk.candidates and chunk.candidates[0].content.parts:
+        return "".join(part.text for part in chunk.candidates[0].content.parts)
+    return ""
+
 async def process_text_and_respond(update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str):
+    reply = StreamingReply(update.effective_message)
     try:
-        # Initialize chat_history if it doesn't exist
-        if 'chat_history' not in context.user_data:
-            context.user_data['chat_history'] = [{"role": "user", "parts": [{"text": PROFESSIONAL_PROMPT}]}]
+        memory = get_memory(context)
         
-        chat_history = context.user_data['chat_history']
+        # Context-free questions at the start of a conversation may be
+        # answered from the response cache
+        cache_key = None
+        context_fingerprint = memory.fingerprint()
+        if response_cache is not None and not context_fingerprint:
+            cache_key = response_cache.key_for(user_text, context_fingerprint)
+        cached_reply = await response_cache.get(cache_key) if cache_key else None
         
-        # Start a new chat session with the current history
-        chat_session = text_model.start_chat(history=chat_history)
-        
-        # Send the user's message to the model
-        text_response = await asyncio.to_thread(chat_session.send_message, user_text)
-        
-        if text_response.candidates and text_response.candidates[0].content.parts:
-            bot_reply = text_response.candidates[0].content.parts[0].text
-            # Append the user and model messages to the history for context
-            chat_history.append({"role": "user", "parts": [{"text": user_text}]})
-            chat_history.append({"role": "model", "parts": [{"text": bot_reply}]})
+        # Stream the reply into a placeholder message as it is generated
+        await reply.start()
+        if cached_reply:
+            # Not a generation, so not counted in the TTFT stats
+            await reply.show(cached_reply)
         else:
-            bot_reply = "🤖 لم أستطع توليد رد مناسب."
+            generation_started = time.perf_counter()
+            async with text_client.slot(update.effective_user.id, PRIORITY_INTERACTIVE, reply.status):
+                # Once text is on screen a failure can no longer be retried
+                first_chunk, chunks = await text_client.open_stream(memory.history(), user_text)
+                if first_chunk is not None:
+                    await reply.append(chunk_text(first_chunk))
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), GEMINI_STREAM_IDLE_TIMEOUT)
+                        except StopAsyncIteration:
+                            break
+                        await reply.append(chunk_text(chunk))
+            if cache_key and reply.text:
+                await response_cache.put(cache_key, reply.text, time.perf_counter() - generation_started)
+        
+        # Speech synthesis starts now and runs while the final text edit is
+        # sent; it is skipped while the TTS provider is failing
+        bot_reply = reply.text or "🤖 لم أستطع توليد رد مناسب."
+        # The voice version is skipped, silently, for users over their TTS limit
+        if tts_client.is_available() and not rate_limiter.try_acquire(update.effective_user.id, "tts"):
+            voice_started = time.perf_counter()
+            speech.submit(update.effective_user.id, bot_reply,
+                          lambda audio: send_voice_reply(update, voice_started, audio))
 
-        await update.message.reply_text(bot_reply)
-        audio_stream = await convert_text_to_wav(bot_reply)
-        if audio_stream:
-            await update.message.reply_voice(voice=audio_stream)
+        if await reply.finish(bot_reply):
+            # Append the user and model messages to the history for context
+            memory.add_exchange(user_text, bot_reply)
+            # Older turns are summarized in the background, off the reply path
+            memory.schedule_summary(summarize_turns)
     except Exception as e:
         logger.error(f"❌ Text processing error: {e}")
-        await update.message.reply_text("❌ حدث خطأ أثناء معالجة النص.")
+        if reply.started:
+            await reply.fail("❌ حدث خطأ أثناء معالجة النص.")
+        else:
+            await update.effective_message.reply_text("❌ حدث خطأ أثناء معالجة النص.")
+
+intent_router = IntentRouter(IMAGE_INTENT_THRESHOLD)
 
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_message = update.message.text
-    image_keywords = ["انشئ صورة", "ارسم", "صورة", "توليد صورة", "انشاء صورة"]
-    for keyword in image_keywords:
-        if keyword in user_message:
-            prompt = user_message.replace(keyword, "", 1).strip()
-            await _generate_and_send_image(update, context, prompt)
-            return
+    # A new message supersedes the voice version of the previous reply
+    speech.cancel(update.effective_user.id)
+    await register_user(update)
+    user_message = update.effective_message.text
+    # طلبات الصور تُعرف من عبارة الأمر في بداية الرسالة فقط
+    intent = intent_router.route(user_message)
+    if intent.intent == INTENT_IMAGE:
+        logger.info(f"Image request from {update.effective_user.id} (confidence {intent.confidence:.2f})")
+        await _generate_and_send_image(update, context, intent.prompt)
+        return
     await process_text_and_respond(update, context, user_message)
 
 # -----------------------------
 # معالجة الرسائل الصوتية
 # -----------------------------
+TRANSCRIPTION_PROMPT = "حوّل هذا المقطع الصوتي إلى نص مكتوب كما قيل تمامًا، دون أي إضافة."
+
+async def upload_voice(audio: bytes):
+    """Upload a large voice note through the File API and wait until it is usable"""
+    uploaded = await asyncio.to_thread(genai.upload_file, io.BytesIO(audio), mime_type="audio/ogg")
+    while uploaded.state.name == "PROCESSING":
+        await asyncio.sleep(0.5)
+        uploaded = await asyncio.to_thread(genai.get_file, uploaded.name)
+    if uploaded.state.name != "ACTIVE":
+        raise RuntimeError(f"Voice upload failed with state {uploaded.state.name}")
+    return uploaded
+
 async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    speech.cancel(update.effective_user.id)
+    await register_user(update)
+    timings = {}
+    started = time.perf_counter()
+    uploaded = None
     try:
-        processing_message = await update.message.reply_text("⏳ جاري تحويل الرسالة الصوتية إلى نص...")
+        processing_message = await update.effective_message.reply_text("⏳ جاري تحويل الرسالة الصوتية إلى نص...")
         
-        file_id = update.message.voice.file_id
+        file_id = update.effective_message.voice.file_id
         voice_file = await context.bot.get_file(file_id)
-        voice_data = await voice_file.download_as_bytearray()
-        voice_stream = io.BytesIO(voice_data)
-        
-        audio_segment = AudioSegment.from_file(voice_stream, format="ogg")
-        wav_stream = io.BytesIO()
-        audio_segment.export(wav_stream, format="wav")
-        wav_stream.seek(0)
+        # Telegram voice notes are already OGG/Opus, which Gemini accepts as
+        # is: no decoding or transcoding, and a single copy of the bytes
+        voice_data = bytes(await voice_file.download_as_bytearray())
+        timings['download'] = time.perf_counter() - started
         
-        audio_part = {
-            "mime_type": "audio/wav",
-            "data": base64.b64encode(wav_stream.read()).decode('utf-8')
-        }
+        if len(voice_data) <= VOICE_INLINE_LIMIT_BYTES:
+            audio_part = {"mime_type": "audio/ogg", "data": voice_data}
+        else:
+            stage_started = time.perf_counter()
+            uploaded = await upload_voice(voice_data)
+            audio_part = uploaded
+            timings['upload'] = time.perf_counter() - stage_started
         
-        transcription_prompt = [{"audio": audio_part}]
-        transcription_response = await asyncio.to_thread(transcription_model.generate_content, transcription_prompt)
+        stage_started = time.perf_counter()
+        transcription_prompt = [TRANSCRIPTION_PROMPT, audio_part]
+        transcription_response = await transcription_client.generate(
+            transcription_prompt, update.effective_user.id, PRIORITY_INTERACTIVE, queue_notice(processing_message)
+        )
+        timings['transcribe'] = time.perf_counter() - stage_started
+        del voice_data, audio_part
         
         if transcription_response.candidates and transcription_response.candidates[0].content.parts:
             transcribed_text = transcription_response.candidates[0].content.parts[0].text
@@ -233,7 +670,9 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
                 text=f"✅ تم تحويل الصوت إلى نص: {transcribed_text}"
             )
             
+            stage_started = time.perf_counter()
             await process_text_and_respond(update, context, transcribed_text)
+            timings['reply'] = time.perf_counter() - stage_started
         else:
             await context.bot.edit_message_text(
                 chat_id=processing_message.chat_id,
@@ -243,24 +682,196 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
             
     except Exception as e:
         logger.error(f"❌ Voice processing error: {e}")
-        await update.message.reply_text("❌ حدث خطأ أثناء معالجة الرسالة الصوتية.")
+        await update.effective_message.reply_text("❌ حدث خطأ أثناء معالجة الرسالة الصوتية.")
+    finally:
+        if uploaded is not None:
+            try:
+                await asyncio.to_thread(genai.delete_file, uploaded.name)
+            except Exception as e:
+                logger.error(f"❌ Could not delete uploaded voice file {uploaded.name}: {e}")
+        # ru_maxrss is in kilobytes on Linux
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        stages = ", ".join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in timings.items())
+        logger.info(
+            f"Voice message: {update.effective_message.voice.file_size or 0} bytes, {stages}, "
+            f"total {(time.perf_counter() - started) * 1000:.0f} ms, peak RSS {peak_rss_mb:.0f} MB"
+        )
 
 # -----------------------------
 # تشغيل البوت
 # -----------------------------
+# مهام الخلفية الدورية، تُلغى عند إيقاف البوت
+background_tasks = []
+
+async def run_periodically(interval: float, func, delay: float = 0):
+    await asyncio.sleep(delay)
+    while True:
+        try:
+            await func()
+        except Exception as e:
+            logger.error(f"❌ Background task error: {e}")
+        await asyncio.sleep(interval)
+
+async def archive_old_history():
+    await db.archive_image_history(HISTORY_RETENTION_DAYS)
+
+async def on_startup(app: Application):
+    loop_monitor.start()
+    background_tasks.append(asyncio.create_task(run_periodically(60 * 60, image_store.evict)))
+    await rate_limiter.load()
+    background_tasks.append(asyncio.create_task(run_periodically(60, rate_limiter.save)))
+    if HISTORY_RETENTION_DAYS > 0:
+        # Not on the startup path: the first pass waits an hour
+        background_tasks.append(asyncio.create_task(
+            run_periodically(24 * 60 * 60, archive_old_history, delay=60 * 60)
+        ))
+
+    # المحادثات الخاملة تُحفظ وتُحذف من الذاكرة، وتُحمّل مجددًا عند أول رسالة
+    async def evict_idle_conversations():
+        await conversation_persistence.evict_idle(app, CONVERSATION_IDLE_SECONDS)
+    background_tasks.append(asyncio.create_task(run_periodically(60, evict_idle_conversations)))
+
+async def on_shutdown(app: Application):
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await speech.close()
+    await rate_limiter.save()
+    rate_limiter.close()
+    image_store.close()
+    if response_cache is not None:
+        response_cache.close()
+    await loop_monitor.stop()
+    opus_encoder.close()
+    await db.close()
+
+def create_services():
+    """Build the objects that hold connections, threads or processes, once per process"""
+    global gemini_scheduler, text_breaker, text_client, summary_client, tts_client, image_client
+    global transcription_client, response_cache, rate_limiter, db, conversation_persistence
+    global update_processor, content_filter, opus_encoder, audio_cache, speech, image_store
+    if gemini_scheduler is not None:
+        return
+
+    gemini_scheduler = GeminiScheduler(math.ceil(GEMINI_MAX_CONCURRENCY / SCHEDULER_PROCESSES))
+    register_model_limits(TEXT_MODEL, "TEXT", 8, 1000)
+    register_model_limits(TTS_MODEL, "TTS", 4, 100)
+    register_model_limits(IMAGE_MODEL, "IMAGE", 2, 60)
+    register_model_limits(TRANSCRIPTION_MODEL, "TRANSCRIPTION", 4, 300)
+
+    # مهلات وإعادة محاولة وقاطع دائرة لكل نوع من الطلبات؛ عند تعطل الخدمة يتوقف
+    # الصوت والصور مؤقتًا بدلًا من انتظار مهلات متكررة
+    # كل الاستدعاءات تستخدم دوال المكتبة غير المتزامنة، فلا يحجز أي طلب خيطًا
+    text_breaker = CircuitBreaker()
+    text_client = GeminiClient(
+        text_model, TEXT_MODEL,
+        Resilience("gemini-text", GEMINI_TEXT_TIMEOUT, hedge=True, breaker=text_breaker), gemini_scheduler
+    )
+    summary_client = GeminiClient(
+        summary_model, TEXT_MODEL,
+        Resilience("gemini-summary", GEMINI_MEDIA_TIMEOUT, attempts=2, breaker=text_breaker), gemini_scheduler
+    )
+    tts_client = GeminiClient(
+        tts_model, TTS_MODEL, Resilience("gemini-tts", GEMINI_MEDIA_TIMEOUT, attempts=2), gemini_scheduler
+    )
+    image_client = GeminiClient(
+        image_model, IMAGE_MODEL, Resilience("gemini-image", GEMINI_MEDIA_TIMEOUT), gemini_scheduler
+    )
+    transcription_client = GeminiClient(
+        transcription_model, TRANSCRIPTION_MODEL, Resilience("gemini-transcription", GEMINI_MEDIA_TIMEOUT),
+        gemini_scheduler
+    )
+
+    if RESPONSE_CACHE_ENABLED:
+        # The namespace changes with the model or the system prompt, which invalidates old answers
+        response_cache = ResponseCache(
+            hashlib.sha256(f"{TEXT_MODEL}\0{PROFESSIONAL_PROMPT}".encode("utf-8")).hexdigest()[:16],
+            load_allowlist(RESPONSE_CACHE_ALLOWLIST),
+            max_bytes=RESPONSE_CACHE_MB * 1024 * 1024,
+            ttl=RESPONSE_CACHE_TTL_HOURS * 60 * 60,
+            db_path=RESPONSE_CACHE_DB or None
+        )
+
+    # Global budgets are per process: in webhook mode each worker gets its share
+    rate_limiter = RateLimiter(
+        {
+            action: limit._replace(global_per_minute=limit.global_per_minute / SCHEDULER_PROCESSES)
+            for action, limit in RATE_LIMITS.items()
+        },
+        RATE_LIMIT_DB or None
+    )
+
+    db = AsyncBotDatabase(DATABASE_PATH)
+    conversation_persistence = ConversationPersistence(db, CHAT_HISTORY_TOKEN_BUDGET)
+    # رسائل المستخدم الواحد تُعالج بالترتيب، والمستخدمون المختلفون بالتوازي
+    update_processor = PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES)
+
+    content_filter = ContentFilter(
+        second_stage=moderate_with_model if CONTENT_FILTER_MODEL_CHECK else None,
+        cache_size=CONTENT_FILTER_CACHE_SIZE
+    )
+
+    opus_encoder = OpusEncoder(AUDIO_ENCODER_WORKERS, AUDIO_ENCODER_MAX_PENDING)
+    # الردود الصوتية تُولّد في الخلفية وتُخزَّن حسب محتواها لتجنّب إعادة توليدها
+    audio_cache = AudioCache(
+        TTS_CACHE_MEMORY_MB * 1024 * 1024, TTS_CACHE_DIR or None, extension="ogg",
+        disk_max_bytes=TTS_CACHE_DISK_MB * 1024 * 1024
+    )
+    speech = SpeechPipeline(convert_text_to_voice, audio_cache, TTS_VOICE)
+
+    image_store = ImageStore(
+        IMAGE_CACHE_DIR,
+        max_bytes=IMAGE_CACHE_MB * 1024 * 1024,
+        max_age=IMAGE_CACHE_MAX_AGE_DAYS * 24 * 60 * 60
+    )
+
+def build_application(webhook: bool = False) -> Application:
+    create_services()
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .persistence(conversation_persistence)
+        .concurrent_updates(update_processor)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if webhook:
+        # Updates arrive from the webhook front process, not from getUpdates
+        builder = builder.updater(None)
+    app = builder.build()
+    app.add_handler(TypeHandler(Update, rate_limit_middleware), group=-1)
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("help", help_command))
+    app.add_handler(CommandHandler("clear", clear_command))
+    app.add_handler(CommandHandler("stats", stats_command))
+    app.add_handler(CommandHandler("image", handle_image_generation))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
+    app.add_handler(MessageHandler(filters.VOICE, handle_voice_message))
+    return app
+
 def main():
     try:
-        app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-        app.add_handler(CommandHandler("start", start))
-        app.add_handler(CommandHandler("help", help_command))
-        app.add_handler(CommandHandler("clear", clear_command))
-        app.add_handler(CommandHandler("image", handle_image_generation))
-        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
-        app.add_handler(MessageHandler(filters.VOICE, handle_voice_message))
-        logger.info("✅ البوت يعمل الآن ...")
-        app.run_polling()
+        if BOT_MODE == "webhook":
+            if not WEBHOOK_URL or not WEBHOOK_SECRET:
+                raise ValueError("❌ WEBHOOK_URL و WEBHOOK_SECRET مطلوبان في وضع webhook")
+            server = WebhookServer(
+                TELEGRAM_BOT_TOKEN,
+                functools.partial(build_application, webhook=True),
+                WEBHOOK_URL,
+                WEBHOOK_SECRET,
+                workers=WEBHOOK_WORKERS,
+                host=WEBHOOK_HOST,
+                port=WEBHOOK_PORT,
+                path=WEBHOOK_PATH
+            )
+            logger.info(f"✅ البوت يعمل الآن عبر webhook بـ {WEBHOOK_WORKERS} عمليات ...")
+            server.run()
+        else:
+            app = build_application()
+            logger.info("✅ البوت يعمل الآن ...")
+            app.run_polling()
     except Exception as e:
         logger.error(f"❌ Bot startup error: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
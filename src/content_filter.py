@@ -4,21 +4,367 @@ Content Filter module for Telegram AI Bot
 Filters inappropriate and harmful content from user prompts
 """
 
+import os
 import re
+import time
+import asyncio
+import hashlib
 import logging
-from typing import List, Set
+import unicodedata
+from collections import Counter, OrderedDict, deque
+from typing import Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from text_normalizer import ARABIC_TABLE
 
 logger = logging.getLogger(__name__)
 
+MAX_PROMPT_LENGTH = 1000
+MIN_PROMPT_LENGTH = 3
+
+class FilterVerdict(NamedTuple):
+    """Outcome of checking one prompt"""
+    safe: bool
+    category: Optional[str] = None  # e.g. "nsfw", "url", "too_long"
+    match: Optional[str] = None  # The term or text that matched
+
+SAFE = FilterVerdict(True)
+
+# Optional slower check (e.g. a model call) run on prompts the local filter passed
+SecondStage = Callable[[str], Awaitable[FilterVerdict]]
+
+# Terms and prompts are both split into words with this, so terms match whole words only
+_WORD = re.compile(r'\w+')
+
+# Arabic proclitics that attach to the front of a word: a conjunction
+# (و/ف), then a preposition (ب/ك/ل) and/or the article (ال, or لل for ل + ال).
+# Stripped longest first, so "وبال" is tried before "و".
+_ARABIC_PROCLITICS = frozenset(
+    conjunction + rest
+    for conjunction in ("", "و", "ف")
+    for rest in ("", "ب", "ك", "ل", "ال", "بال", "كال", "لل")
+) - {""}
+_LONGEST_PROCLITIC = max(map(len, _ARABIC_PROCLITICS))
+_ARABIC_LETTERS = re.compile(r'[\u0620-\u064A]')
+
+# Fragments up to this long may be glued back together ("nu de" -> "nude")
+MAX_FRAGMENT_LENGTH = 3
+MAX_FRAGMENTS = 4
+# Two short words in a row: the only place splitting tricks can hide
+_FRAGMENTS = re.compile(rf'(?<!\w)\w{{1,{MAX_FRAGMENT_LENGTH}}}\W+\w{{1,{MAX_FRAGMENT_LENGTH}}}(?!\w)')
+
+# Per-language term files: one term per line under [category] headers
+DEFAULT_TERMS_DIR = os.path.join(os.path.dirname(__file__), '..', 'config', 'filter_terms')
+# How often (seconds) the term files are checked for changes
+TERMS_RELOAD_INTERVAL = 5.0
+
+def _build_normalization_table() -> Dict[int, Optional[str]]:
+    """Build the str.translate table applied after NFKC and casefold"""
+    # Diacritics, invisible characters and Arabic letter variants
+    table: Dict[int, Optional[str]] = dict(ARABIC_TABLE)
+    
+    # Latin look-alikes from Cyrillic and Greek (after casefold, so lowercase only)
+    table.update(str.maketrans({
+        'а': 'a', 'в': 'b', 'е': 'e', 'ё': 'e', 'к': 'k', 'м': 'm', 'н': 'h', 'о': 'o',
+        'р': 'p', 'с': 'c', 'т': 't', 'у': 'y', 'х': 'x', 'ѕ': 's', 'і': 'i', 'ј': 'j',
+        'α': 'a', 'β': 'b', 'ε': 'e', 'η': 'n', 'ι': 'i', 'κ': 'k', 'ν': 'v', 'ο': 'o',
+        'ρ': 'p', 'τ': 't', 'υ': 'u', 'χ': 'x'
+    }))
+    
+    # Leetspeak; not '!' or '+', which mostly appear after or between words
+    table.update(str.maketrans({
+        '0': 'o', '1': 'i', '3': 'e', '4': 'a', '5': 's', '7': 't', '8': 'b',
+        '@': 'a', '$': 's', '|': 'l'
+    }))
+    return table
+
+_NORMALIZATION_TABLE = _build_normalization_table()
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize text so that spelling tricks do not hide banned terms
+    
+    The shared normalize_arabic() folding, with one precomputed translate
+    table that also maps confusables and leetspeak to a single form. All
+    three steps (NFKC, casefold, translate) run in C.
+    """
+    return unicodedata.normalize('NFKC', text).casefold().translate(_NORMALIZATION_TABLE)
+
+def load_term_files(directory: str) -> Dict[str, str]:
+    """
+    Read every *.txt term file in directory
+    
+    A file holds one term per line under [category] headers; # starts a
+    comment. Terms are normalized like prompts, so they can be written in
+    any spelling.
+    
+    Returns:
+        dict: Normalized term -> category
+    """
+    terms: Dict[str, str] = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.txt'):
+            continue
+        category = None
+        with open(os.path.join(directory, name), encoding='utf-8') as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+                if line.startswith('[') and line.endswith(']'):
+                    category = line[1:-1].strip()
+                elif category:
+                    terms[normalize_text(line)] = category
+                else:
+                    logger.warning(f"Ignoring term outside a [category] section in {name}: {line}")
+    return terms
+
+class TermMatcher:
+    """
+    Aho-Corasick automaton over a fixed set of terms
+    
+    The automaton runs over words rather than characters: the text is
+    split into words once (in C, by re), then each word is one
+    transition. Every occurrence of every term is found in that single
+    pass, so the cost depends on the length of the text, not on the
+    number of terms. Multi-word terms ("not safe for work", "self-harm")
+    match any run of those words, whatever separates them, and a term
+    never matches inside a longer word ("skill" does not contain "kill").
+    
+    Before matching, words are resolved against the terms' vocabulary:
+    runs of single characters are joined ("n.u.d.e"), short fragments
+    are glued together when that forms a term word ("nu de"), and Arabic
+    proclitics are stripped when what remains is a term word ("القنبلة",
+    "بالمخدرات", "للمخدرات"). Words outside the vocabulary are left as
+    they are, so none of this can turn an innocent word into a match.
+    """
+    
+    def __init__(self, terms: Dict[str, str]):
+        """
+        Build the automaton
+        
+        Args:
+            terms (dict): Lowercase term -> category it belongs to
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Per state: (length in words, category) of every term ending there, including via fail links
+        self._output: List[Tuple[Tuple[int, str], ...]] = [()]
+        
+        for term, category in terms.items():
+            words = _WORD.findall(term)
+            if not words:
+                continue
+            state = 0
+            for word in words:
+                next_state = self._goto[state].get(word)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][word] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                state = next_state
+            self._output[state] += ((len(words), category),)
+        
+        # Breadth-first, so a state's fail target is final before its children need it
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and word not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(word, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] += self._output[self._fail[child]]
+        
+        # Every word that occurs in some term
+        self._vocabulary: Set[str] = {word for state in self._goto for word in state}
+        # Every beginning of such a word, to stop joining spelled-out letters early
+        self._word_prefixes: Set[str] = {word[:end] for word in self._vocabulary for end in range(1, len(word))}
+        # Word -> what _resolve() made of it, filled in as words are seen
+        self._resolved: Dict[str, str] = {}
+    
+    def _resolve(self, word: str) -> str:
+        """Map a word to the term word it hides behind Arabic proclitics, if any"""
+        resolved = self._resolved.get(word)
+        if resolved is not None:
+            return resolved
+        resolved = word
+        if word not in self._vocabulary and _ARABIC_LETTERS.match(word):
+            # Longest proclitic first, leaving a stem of two letters or more
+            for length in range(min(len(word) - 2, _LONGEST_PROCLITIC), 0, -1):
+                if word[:length] in _ARABIC_PROCLITICS and word[length:] in self._vocabulary:
+                    resolved = word[length:]
+                    break
+        if len(self._resolved) < 50000:
+            self._resolved[word] = resolved
+        return resolved
+    
+    def _glue(self, tokens: List[str], start: int) -> Optional[Tuple[str, int]]:
+        """Join short fragments from tokens[start] on into a term word: (word, next index) or None"""
+        joined = tokens[start]
+        for end in range(start + 1, min(start + MAX_FRAGMENTS, len(tokens))):
+            if len(tokens[end]) > MAX_FRAGMENT_LENGTH:
+                return None
+            joined += tokens[end]
+            resolved = self._resolve(joined)
+            if resolved in self._vocabulary:
+                return resolved, end + 1
+        return None
+    
+    def _spelled(self, letters: List[str]) -> List[str]:
+        """Find the longest term words spelled out in a run of single characters"""
+        words = []
+        start = 0
+        while start < len(letters):
+            joined = letters[start]
+            found = 0
+            for end in range(start + 1, len(letters)):
+                joined += letters[end]
+                if joined in self._vocabulary:
+                    found = end + 1
+                elif joined not in self._word_prefixes:
+                    break
+            if found:
+                words.append("".join(letters[start:found]))
+                start = found
+            else:
+                words.append(letters[start])
+                start += 1
+        return words
+    
+    def _words(self, text: str) -> List[str]:
+        """Split text into words and undo splitting and clitic tricks"""
+        tokens = _WORD.findall(text)
+        if not _FRAGMENTS.search(text):
+            resolved = self._resolved
+            return [resolved.get(token) or self._resolve(token) for token in tokens]
+        words = []
+        index = 0
+        while index < len(tokens):
+            token = tokens[index]
+            
+            # A run of single characters may spell out term words
+            if len(token) == 1 and index + 1 < len(tokens) and len(tokens[index + 1]) == 1:
+                end = index
+                while end < len(tokens) and len(tokens[end]) == 1:
+                    end += 1
+                words.extend(self._spelled(tokens[index:end]))
+                index = end
+                continue
+            
+            # Short fragments that together form a term word
+            if token not in self._vocabulary and len(token) <= MAX_FRAGMENT_LENGTH:
+                glued = self._glue(tokens, index)
+                if glued is not None:
+                    words.append(glued[0])
+                    index = glued[1]
+                    continue
+            
+            words.append(self._resolve(token))
+            index += 1
+        return words
+    
+    def search(self, text: str) -> Optional[Tuple[str, str]]:
+        """
+        Find the first term in text
+        
+        Args:
+            text (str): Lowercase text
+            
+        Returns:
+            Optional[tuple]: (category, matched term) or None
+        """
+        goto, fail, output = self._goto, self._fail, self._output
+        words = self._words(text)
+        state = 0
+        for end, word in enumerate(words):
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+            if output[state]:
+                length, category = output[state][0]
+                return category, " ".join(words[end + 1 - length:end + 1])
+        return None
+
 class ContentFilter:
-    def __init__(self):
-        """Initialize content filter with banned words and patterns"""
-        self.banned_words = self._load_banned_words()
+    def __init__(self, terms_dir: Optional[str] = DEFAULT_TERMS_DIR,
+                 second_stage: Optional[SecondStage] = None, cache_size: int = 10000):
+        """
+        Initialize content filter with banned words and patterns
+        
+        Args:
+            terms_dir (str): Directory of per-language term files, watched for changes; None for built-in terms only
+            second_stage: Optional async check run by classify() on prompts the local filter passed
+            cache_size (int): Maximum number of verdicts classify() remembers
+        """
+        self.terms_dir = terms_dir
+        self.second_stage = second_stage
+        self.cache_size = cache_size
+        # sha256 of the normalized prompt -> verdict on its content
+        self._verdicts: "OrderedDict[bytes, FilterVerdict]" = OrderedDict()
+        self.classified = 0
+        self.cache_hits = 0
+        self.second_stage_calls = 0
+        self.second_stage_errors = 0
+        self.rejections: Counter = Counter()
+        self._terms_signature = None
+        self._next_reload_check = 0.0
+        self._term_matcher: Optional[TermMatcher] = None
         self.banned_patterns = self._load_banned_patterns()
+        
+        # All terms go into one automaton and all patterns into one
+        # alternation of named groups, so a prompt is scanned once by each
+        self._pattern_matcher = re.compile("|".join(
+            f"(?P<{category}>{pattern})" for category, pattern in self.banned_patterns.items()
+        ))
+        self.reload_terms()
         logger.info(f"Content filter initialized with {len(self.banned_words)} banned words")
     
-    def _load_banned_words(self) -> Set[str]:
-        """Load list of banned words and phrases"""
+    def reload_terms(self) -> bool:
+        """
+        Rebuild the term automaton if the term files changed
+        
+        The new automaton replaces the old one in a single assignment, so
+        checks running meanwhile use one or the other, never a mix. A
+        broken file is logged and the current terms are kept.
+        
+        Returns:
+            bool: True if the terms were (re)loaded
+        """
+        self._next_reload_check = time.monotonic() + TERMS_RELOAD_INTERVAL
+        signature = None
+        if self.terms_dir and os.path.isdir(self.terms_dir):
+            signature = tuple(sorted(
+                (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                for entry in os.scandir(self.terms_dir) if entry.name.endswith('.txt')
+            ))
+        if signature == self._terms_signature and self._term_matcher is not None:
+            return False
+        
+        terms = {normalize_text(term): category for term, category in self._load_banned_terms().items()}
+        if signature is not None:
+            try:
+                terms.update(load_term_files(self.terms_dir))
+            except (OSError, UnicodeDecodeError) as e:
+                logger.error(f"Could not load filter terms from {self.terms_dir}: {e}")
+                if self._term_matcher is not None:
+                    return False
+        
+        self._term_matcher = TermMatcher(terms)
+        # Verdicts were given under the old terms
+        self._verdicts.clear()
+        self.banned_terms = terms
+        self.banned_words = set(terms)
+        self._terms_signature = signature
+        if signature:
+            logger.info(f"Loaded {len(terms)} filter terms ({', '.join(name for name, _, _ in signature)})")
+        return True
+    
+    def _load_banned_terms(self) -> Dict[str, str]:
+        """Load banned words and phrases, mapped to their category"""
         # NSFW and inappropriate content
         nsfw_words = {
             'nude', 'naked', 'sex', 'porn', 'xxx', 'adult', 'erotic', 'sexual',
@@ -49,27 +395,33 @@ class ContentFilter:
             'illegal', 'criminal', 'theft', 'robbery', 'fraud', 'scam'
         }
         
-        # Combine all banned words
-        all_banned = nsfw_words | violence_words | hate_words | illegal_words
+        categories = {
+            'nsfw': nsfw_words,
+            'violence': violence_words,
+            'hate': hate_words,
+            'illegal': illegal_words
+        }
         
         # Convert to lowercase for case-insensitive matching
-        return {word.lower() for word in all_banned}
+        return {word.lower(): category for category, words in categories.items() for word in words}
     
-    def _load_banned_patterns(self) -> List[re.Pattern]:
-        """Load regex patterns for more complex filtering"""
-        patterns = [
+    def _load_banned_patterns(self) -> Dict[str, str]:
+        """Load regex patterns for more complex filtering, keyed by category"""
+        patterns = {
             # Email addresses (to prevent spam)
-            re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'),
+            'email': r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',
             
             # URLs (to prevent malicious links)
-            re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'),
+            'url': r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+',
             
             # Phone numbers (to prevent spam)
-            re.compile(r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b'),
+            'phone': r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b',
             
-            # Excessive repetition (spam detection)
-            re.compile(r'(.)\1{10,}'),  # Same character repeated 10+ times
-        ]
+            # Excessive repetition (spam detection); a named backreference,
+            # since group numbers shift once the patterns are merged, and a
+            # lookahead so most positions fail after one character
+            'repetition': r'(?P<repeated>.)(?=(?P=repeated))(?P=repeated){10,}',  # Same character repeated 10+ times
+        }
         
         return patterns
     
@@ -83,32 +435,135 @@ class ContentFilter:
         Returns:
             bool: True if prompt is safe, False otherwise
         """
-        if not prompt or not isinstance(prompt, str):
-            return False
+        return self.check_prompt(prompt).safe
+    
+    def check_prompt(self, prompt: str) -> FilterVerdict:
+        """
+        Check a prompt and report why it was rejected
+        
+        Args:
+            prompt (str): User input prompt
+            
+        Returns:
+            FilterVerdict: safe, plus the category and text that matched if not
+        """
+        return self.classify_many([prompt])[0]
+    
+    def classify_many(self, prompts: Iterable[str]) -> List[FilterVerdict]:
+        """
+        Check a batch of prompts with the local filter
+        
+        The term files are checked for changes once per batch, and
+        prompts that normalize to the same text are matched once.
         
-        # Normalize text for analysis
-        normalized_text = prompt.lower().strip()
+        Args:
+            prompts: User input prompts
+            
+        Returns:
+            List[FilterVerdict]: One verdict per prompt, in order
+        """
+        if time.monotonic() >= self._next_reload_check:
+            self.reload_terms()
         
-        # Check for banned words
-        words = re.findall(r'\b\w+\b', normalized_text)
-        for word in words:
-            if word in self.banned_words:
-                logger.warning(f"Banned word detected: {word}")
-                return False
+        verdicts = []
+        term_verdicts: Dict[str, FilterVerdict] = {}
+        for prompt in prompts:
+            verdict = self._check_form(prompt)
+            if verdict.safe:
+                normalized = normalize_text(prompt)
+                verdict = term_verdicts.get(normalized)
+                if verdict is None:
+                    verdict = term_verdicts[normalized] = self._check_terms(normalized)
+            verdicts.append(verdict)
+        return verdicts
+    
+    async def classify(self, prompt: str) -> FilterVerdict:
+        """
+        Check a prompt with the local filter, then the second stage if any
         
-        # Check for banned patterns
-        for pattern in self.banned_patterns:
-            if pattern.search(prompt):
-                logger.warning(f"Banned pattern detected in prompt")
-                return False
+        Verdicts on a prompt's content are cached by the hash of its
+        normalized text, so a prompt seen before (in any spelling the
+        normalization folds) is answered without matching or a second
+        stage call. Form checks (length, emails, links, ...) depend on the
+        raw text and always run. If the second stage fails, the local
+        verdict stands and is not cached.
         
-        # Check for excessive length
-        if len(prompt) > 1000:
-            return False
+        Args:
+            prompt (str): User input prompt
+            
+        Returns:
+            FilterVerdict: safe, plus the category and text that matched if not
+        """
+        self.classified += 1
+        verdict = self._check_form(prompt)
+        if not verdict.safe:
+            return self._count(verdict)
         
-        # Check for minimum length
-        if len(prompt.strip()) < 3:
-            return False
+        if time.monotonic() >= self._next_reload_check:
+            self.reload_terms()
+        normalized = normalize_text(prompt)
+        key = hashlib.sha256(normalized.encode('utf-8')).digest()
+        cached = self._verdicts.get(key)
+        if cached is not None:
+            self._verdicts.move_to_end(key)
+            self.cache_hits += 1
+            return self._count(cached)
         
-        return True
-
+        verdict = self._check_terms(normalized)
+        if verdict.safe and self.second_stage is not None:
+            self.second_stage_calls += 1
+            try:
+                verdict = await self.second_stage(prompt)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.second_stage_errors += 1
+                logger.error(f"Second-stage content check failed, using the local verdict: {e}")
+                return self._count(verdict)
+        
+        self._verdicts[key] = verdict
+        if len(self._verdicts) > self.cache_size:
+            self._verdicts.popitem(last=False)
+        return self._count(verdict)
+    
+    def _count(self, verdict: FilterVerdict) -> FilterVerdict:
+        """Record a classify() verdict in the stats and return it"""
+        if not verdict.safe:
+            self.rejections[verdict.category] += 1
+        return verdict
+    
+    def _check_form(self, prompt: str) -> FilterVerdict:
+        """Check the length and the banned patterns of a raw prompt"""
+        if not prompt or not isinstance(prompt, str):
+            return FilterVerdict(False, 'invalid')
+        
+        # Cheap checks first, so oversized input is never scanned
+        if len(prompt) > MAX_PROMPT_LENGTH:
+            return FilterVerdict(False, 'too_long')
+        if len(prompt.strip()) < MIN_PROMPT_LENGTH:
+            return FilterVerdict(False, 'too_short')
+        
+        pattern = self._pattern_matcher.search(prompt)
+        if pattern:
+            logger.warning(f"Banned {pattern.lastgroup} pattern detected in prompt")
+            return FilterVerdict(False, pattern.lastgroup, pattern.group())
+        return SAFE
+    
+    def _check_terms(self, normalized: str) -> FilterVerdict:
+        """Look for banned terms in a normalized prompt"""
+        term = self._term_matcher.search(normalized)
+        if term:
+            logger.warning(f"Banned {term[0]} term detected: {term[1]}")
+            return FilterVerdict(False, *term)
+        return SAFE
+    
+    def get_stats(self) -> Dict[str, object]:
+        """Return classify() counters and rejections by category"""
+        return {
+            'classified': self.classified,
+            'cache_hits': self.cache_hits,
+            'cached_verdicts': len(self._verdicts),
+            'second_stage_calls': self.second_stage_calls,
+            'second_stage_errors': self.second_stage_errors,
+            'rejections': dict(self.rejections)
+        }
@@ -0,0 +1,199 @@
+"""
+Conversation memory module for Telegram AI Bot
+Keeps per-user chat history within a token budget by summarizing old turns
+"""
+
+import asyncio
+import hashlib
+import logging
+import struct
+import time
+import zlib
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Rough characters-per-token ratio. Arabic text tokenizes denser than
+# English, so this errs on the side of overestimating.
+CHARS_PER_TOKEN = 3
+
+# (role, text) where role is "user" or "model"
+Turn = Tuple[str, str]
+
+# Binary format: a version byte and the summary, then one record per
+# turn (role byte + UTF-8 text), each text prefixed with a uint32 length;
+# the whole payload is zlib-compressed
+ENCODING_VERSION = 1
+ROLES = ("user", "model")
+_HEADER = struct.Struct(">BI")
+_TURN = struct.Struct(">BI")
+
+# Receives the previous summary and the turns to fold into it
+SummarizeFn = Callable[[str, List[Turn]], Awaitable[Optional[str]]]
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate used for budgeting"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def _read_text(data: bytes, offset: int, length: int) -> str:
+    """Decode length bytes of UTF-8 at offset, which must all be present"""
+    if offset + length > len(data):
+        raise ValueError("Conversation data is truncated")
+    return data[offset:offset + length].decode("utf-8")
+
+class ConversationMemory:
+    """
+    Token-budgeted chat history with a rolling summary
+
+    Recent turns are kept verbatim. Once they exceed token_budget, the
+    oldest ones are folded into a summary by a background task, so the
+    summarization call never delays a reply. If summarization falls behind
+    or fails, turns beyond hard_limit tokens are dropped outright to keep
+    the request size bounded.
+    """
+
+    def __init__(self, token_budget: int = 2000, hard_limit: Optional[int] = None):
+        """Initialize an empty conversation"""
+        self.token_budget = token_budget
+        self.hard_limit = hard_limit or token_budget * 2
+        self.turns: List[Turn] = []
+        self.summary = ""
+        self._tokens = 0
+        self._summary_task: Optional[asyncio.Task] = None
+        # Bumped on every change so persistence can skip unchanged memories
+        self.version = 0
+        self.last_used = time.monotonic()
+
+    @property
+    def tokens(self) -> int:
+        """Estimated tokens held in verbatim turns"""
+        return self._tokens
+
+    def add_exchange(self, user_text: str, model_text: str):
+        """Record one user message and the model's reply"""
+        self.turns.append(("user", user_text))
+        self.turns.append(("model", model_text))
+        self._tokens += estimate_tokens(user_text) + estimate_tokens(model_text)
+        self.version += 1
+        self.last_used = time.monotonic()
+
+        while self._tokens > self.hard_limit and len(self.turns) > 2:
+            self._pop_exchange()
+
+    def history(self) -> List[Dict]:
+        """Return the history in Gemini's start_chat format"""
+        self.last_used = time.monotonic()
+        history = []
+        if self.summary:
+            history.append({"role": "user", "parts": [{"text": f"ملخص ما سبق من المحادثة:\n{self.summary}"}]})
+            history.append({"role": "model", "parts": [{"text": "حسنًا، سأأخذ ذلك في الاعتبار."}]})
+        for role, text in self.turns:
+            history.append({"role": role, "parts": [{"text": text}]})
+        return history
+
+    def fingerprint(self) -> str:
+        """Digest of the summary and turns ("" for an empty conversation)"""
+        if not self.turns and not self.summary:
+            return ""
+        digest = hashlib.sha256(self.summary.encode("utf-8"))
+        for role, text in self.turns:
+            digest.update(f"\0{role}\0{text}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def clear(self):
+        """Forget the whole conversation"""
+        if self._summary_task:
+            self._summary_task.cancel()
+            self._summary_task = None
+        self.turns = []
+        self.summary = ""
+        self._tokens = 0
+        self.version += 1
+
+    def schedule_summary(self, summarize: SummarizeFn):
+        """Start a background summarization if over budget and none is running"""
+        if self._tokens <= self.token_budget or len(self.turns) <= 2:
+            return
+        if self._summary_task and not self._summary_task.done():
+            return
+        self._summary_task = asyncio.create_task(self._summarize(summarize))
+
+    async def _summarize(self, summarize: SummarizeFn):
+        """Fold the oldest turns into the summary until back under half the budget"""
+        target = self.token_budget // 2
+        folded: List[Turn] = []
+        remaining = self._tokens
+        for role, text in self.turns[:-2]:
+            if remaining <= target:
+                break
+            folded.append((role, text))
+            remaining -= estimate_tokens(text)
+        # Keep user/model pairs together
+        if len(folded) % 2:
+            folded.pop()
+        if not folded:
+            return
+
+        try:
+            summary = await summarize(self.summary, folded)
+        except Exception as e:
+            logger.error(f"Conversation summarization failed: {e}")
+            return
+        if not summary:
+            return
+
+        # New turns may have arrived meanwhile and the hard limit may have
+        # dropped some of the folded ones; remove whatever is still there
+        for start in range(0, len(folded), 2):
+            if self.turns[:len(folded) - start] == folded[start:]:
+                for _ in range((len(folded) - start) // 2):
+                    self._pop_exchange()
+                break
+        self.summary = summary
+        self.version += 1
+
+    def _pop_exchange(self):
+        """Drop the oldest user/model pair"""
+        for _ in range(2):
+            _, text = self.turns.pop(0)
+            self._tokens -= estimate_tokens(text)
+
+    def to_bytes(self) -> bytes:
+        """Encode the summary and turns in the compact binary format"""
+        summary = self.summary.encode("utf-8")
+        parts = [_HEADER.pack(ENCODING_VERSION, len(summary)), summary]
+        for role, text in self.turns:
+            data = text.encode("utf-8")
+            parts.append(_TURN.pack(ROLES.index(role), len(data)))
+            parts.append(data)
+        return zlib.compress(b"".join(parts))
+
+    @classmethod
+    def from_bytes(cls, blob: bytes, token_budget: int = 2000) -> "ConversationMemory":
+        """
+        Decode a memory produced by to_bytes()
+
+        Raises:
+            ValueError: If the blob is truncated, corrupt or of another version
+        """
+        try:
+            data = zlib.decompress(blob)
+            version, length = _HEADER.unpack_from(data, 0)
+            if version != ENCODING_VERSION:
+                raise ValueError(f"Unsupported conversation encoding version: {version}")
+
+            memory = cls(token_budget)
+            offset = _HEADER.size
+            memory.summary = _read_text(data, offset, length)
+            offset += length
+
+            while offset < len(data):
+                role, length = _TURN.unpack_from(data, offset)
+                offset += _TURN.size
+                text = _read_text(data, offset, length)
+                offset += length
+                memory.turns.append((ROLES[role], text))
+                memory._tokens += estimate_tokens(text)
+        except (zlib.error, struct.error, IndexError) as e:
+            raise ValueError(f"Corrupt conversation data: {e}") from e
+        return memory
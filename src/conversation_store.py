@@ -0,0 +1,141 @@
+"""
+Conversation store module for Telegram AI Bot
+Persists per-user chat memory in SQLite and keeps only active users in RAM
+"""
+
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from telegram.ext import Application, BasePersistence, PersistenceInput
+
+from conversation_memory import ConversationMemory
+from database import AsyncBotDatabase
+
+logger = logging.getLogger(__name__)
+
+class ConversationPersistence(BasePersistence):
+    """
+    python-telegram-bot persistence for user_data['memory']
+
+    Conversations are stored as compact binary blobs in the bot database.
+    Nothing is loaded at startup: a user's memory is read the first time
+    one of their updates is handled (refresh_user_data), and idle memories
+    are written back and dropped from RAM by evict_idle(). Only the
+    conversation memory is persisted; other user_data keys are transient.
+    """
+
+    def __init__(self, db: AsyncBotDatabase, token_budget: int = 2000, update_interval: float = 30):
+        """Initialize the persistence on top of the bot database"""
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.db = db
+        self.token_budget = token_budget
+        # Version of each in-RAM memory as last written, to skip unchanged ones
+        self._saved_versions: Dict[int, int] = {}
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        # Loaded lazily per user in refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        if 'memory' in user_data:
+            return
+
+        blob = await self.db.load_conversation(user_id)
+        memory = ConversationMemory(self.token_budget)
+        if blob:
+            try:
+                memory = ConversationMemory.from_bytes(blob, self.token_budget)
+            except ValueError as e:
+                logger.error(f"Discarding unreadable conversation for user {user_id}: {e}")
+                await self.db.delete_conversation(user_id)
+        user_data['memory'] = memory
+        self._saved_versions[user_id] = memory.version
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        await self._save(user_id, data.get('memory'))
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._saved_versions.pop(user_id, None)
+        await self.db.delete_conversation(user_id)
+
+    async def _save(self, user_id: int, memory: Optional[ConversationMemory]):
+        """Queue a memory for writing if it changed since it was last saved"""
+        if memory is None or self._saved_versions.get(user_id) == memory.version:
+            return
+        await self.db.save_conversation(user_id, memory.to_bytes())
+        self._saved_versions[user_id] = memory.version
+
+    async def evict_idle(self, application: Application, idle_seconds: float) -> int:
+        """
+        Write back and unload memories unused for idle_seconds
+
+        Only the memory is removed; the now-empty user_data dict stays in
+        the Application and the memory is reloaded on the next update.
+
+        Returns:
+            int: Number of conversations evicted
+        """
+        cutoff = time.monotonic() - idle_seconds
+        evicted = 0
+        for user_id, user_data in list(application.user_data.items()):
+            memory = user_data.get('memory')
+            if memory is None or memory.last_used > cutoff:
+                continue
+            # Always written durably, even if unchanged: an earlier
+            # fire-and-forget save may still be queued, and a returning user
+            # must not reload an older copy
+            await self.db.save_conversation(user_id, memory.to_bytes(), durable=True)
+            if memory.last_used > cutoff:
+                # Used again while we were saving
+                continue
+            del user_data['memory']
+            self._saved_versions.pop(user_id, None)
+            evicted += 1
+
+        if evicted:
+            logger.info(f"Evicted {evicted} idle conversations from memory")
+        return evicted
+
+    # Only user_data is persisted; everything else is a no-op
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        return {}
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        pass
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        pass
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def flush(self) -> None:
+        # Writes go through the database's group commit writer, which is
+        # flushed when the database is closed
+        pass
@@ -4,247 +4,1095 @@ Database module for Telegram AI Image Bot
 Handles user management, credits, and subscriptions
 """
 
+import os
+import gzip
+import json
 import sqlite3
+import asyncio
 import logging
+import threading
+import queue
+import time
+from itertools import groupby
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Callable, Iterator, TypeVar
+
+from user_cache import UserCache, UserRecord
+
+try:
+    import fcntl
+except ImportError:  # Windows: migrations are not serialized across processes
+    fcntl = None
+
+# Connection tuning applied to every pooled connection.
+# WAL lets readers run while a writer commits, and synchronous=NORMAL only
+# fsyncs at checkpoints instead of on every commit.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",      # ~16 MB page cache per connection
+    "PRAGMA mmap_size = 268435456",    # 256 MB memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+)
+
+# Size of sqlite3's per-connection prepared statement cache
+STATEMENT_CACHE_SIZE = 128
+
+T = TypeVar('T')
+
+# -----------------------------
+# Schema migrations
+# -----------------------------
+# Each migration runs once, in order, and its number is recorded in
+# PRAGMA user_version. Statements use IF NOT EXISTS so databases created
+# before versioning was introduced upgrade cleanly.
+
+def _migrate_initial_schema(conn: sqlite3.Connection):
+    """Users, image history and payment transactions"""
+    # Users table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            credits INTEGER DEFAULT 1,
+            is_subscribed BOOLEAN DEFAULT FALSE,
+            subscription_end_date TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            last_active TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Early databases have a users table with only user_id and credits.
+    # ALTER TABLE cannot add a CURRENT_TIMESTAMP default, so those
+    # timestamps start out NULL for existing rows, and create_user() sets
+    # them explicitly rather than relying on the default.
+    existing = {row['name'] for row in conn.execute("PRAGMA table_info(users)")}
+    for column, definition in (
+        ('username', 'TEXT'),
+        ('first_name', 'TEXT'),
+        ('last_name', 'TEXT'),
+        ('is_subscribed', 'BOOLEAN DEFAULT FALSE'),
+        ('subscription_end_date', 'TEXT'),
+        ('created_at', 'TEXT'),
+        ('last_active', 'TEXT'),
+    ):
+        if column not in existing:
+            conn.execute(f"ALTER TABLE users ADD COLUMN {column} {definition}")
+    
+    # Image generation history
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS image_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            prompt TEXT,
+            image_url TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+    
+    # Payment transactions
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount REAL,
+            currency TEXT,
+            payment_method TEXT,
+            transaction_id TEXT,
+            status TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+def _migrate_credit_ledger(conn: sqlite3.Connection):
+    """Credit ledger with idempotency keys"""
+    # One row per balance change, deduplicated by idempotency_key so
+    # retried charges and payments apply only once
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS credit_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            delta INTEGER,
+            reason TEXT,
+            idempotency_key TEXT UNIQUE,
+            status TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+def _migrate_statistics(conn: sqlite3.Connection):
+    """
+    Statistics tables and the triggers that maintain them
+    
+    stats holds running totals and stats_hourly holds per-hour rollups
+    (UTC buckets). Both are updated by triggers in the same transaction
+    as the row that changes them, so reading statistics never scans the
+    history tables. The totals are backfilled once from existing rows.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats (
+            name TEXT PRIMARY KEY,
+            value NUMERIC NOT NULL DEFAULT 0
+        )
+    ''')
+    
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_hourly (
+            bucket TEXT PRIMARY KEY,
+            images INTEGER NOT NULL DEFAULT 0,
+            new_users INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    
+    # Range scans for active subscribers instead of a full table scan
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_subscription_end
+        ON users (subscription_end_date)
+    ''')
+    
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_users_insert
+        AFTER INSERT ON users
+        BEGIN
+            UPDATE stats SET value = value + 1 WHERE name = 'total_users';
+            INSERT INTO stats_hourly (bucket, new_users)
+            VALUES (strftime('%Y-%m-%d %H:00', 'now'), 1)
+            ON CONFLICT (bucket) DO UPDATE SET new_users = new_users + 1;
+        END
+    ''')
+    
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_image_history_insert
+        AFTER INSERT ON image_history
+        BEGIN
+            UPDATE stats SET value = value + 1 WHERE name = 'total_images';
+            INSERT INTO stats_hourly (bucket, images)
+            VALUES (strftime('%Y-%m-%d %H:00', 'now'), 1)
+            ON CONFLICT (bucket) DO UPDATE SET images = images + 1;
+        END
+    ''')
+    
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_transactions_insert
+        AFTER INSERT ON transactions
+        WHEN NEW.status = 'completed'
+        BEGIN
+            UPDATE stats SET value = value + NEW.amount WHERE name = 'total_revenue';
+            INSERT INTO stats_hourly (bucket, revenue)
+            VALUES (strftime('%Y-%m-%d %H:00', 'now'), NEW.amount)
+            ON CONFLICT (bucket) DO UPDATE SET revenue = revenue + NEW.amount;
+        END
+    ''')
+    
+    if conn.execute("SELECT COUNT(*) FROM stats").fetchone()[0] == 0:
+        conn.execute('''
+            INSERT INTO stats (name, value)
+            SELECT 'total_users', COUNT(*) FROM users
+            UNION ALL
+            SELECT 'total_images', COUNT(*) FROM image_history
+            UNION ALL
+            SELECT 'total_revenue', COALESCE(SUM(amount), 0)
+            FROM transactions WHERE status = 'completed'
+        ''')
+
+def _migrate_history_indexes(conn: sqlite3.Connection):
+    """Secondary indexes for per-user lookups, date ranges and status filters"""
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_image_history_user_created
+        ON image_history (user_id, created_at)
+    ''')
+    
+    # Lets retention find expired rows without scanning the table
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_image_history_created
+        ON image_history (created_at)
+    ''')
+    
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_transactions_user_created
+        ON transactions (user_id, created_at)
+    ''')
+    
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_transactions_status
+        ON transactions (status)
+    ''')
+
+def _migrate_incremental_vacuum(conn: sqlite3.Connection):
+    """
+    Switch the file to incremental auto-vacuum
+    
+    Changing auto_vacuum on an existing database only takes effect after a
+    full VACUUM, which cannot run inside a transaction. This is a one-off
+    cost; afterwards archive_image_history() hands free pages back to the
+    filesystem a few at a time with PRAGMA incremental_vacuum.
+    """
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+def _migrate_conversations(conn: sqlite3.Connection):
+    """Persisted chat memory, one compact encoded blob per user"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS conversations (
+            user_id INTEGER PRIMARY KEY,
+            data BLOB NOT NULL,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+# (migration, runs inside a transaction)
+MIGRATIONS = [
+    (_migrate_initial_schema, True),
+    (_migrate_credit_ledger, True),
+    (_migrate_statistics, True),
+    (_migrate_history_indexes, True),
+    (_migrate_incremental_vacuum, False),
+    (_migrate_conversations, True),
+]
+
+INSERT_IMAGE_HISTORY_SQL = '''
+    INSERT INTO image_history (user_id, prompt, image_url)
+    VALUES (?, ?, ?)
+'''
+
+INSERT_TRANSACTION_SQL = '''
+    INSERT INTO transactions 
+    (user_id, amount, currency, payment_method, transaction_id, status)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+UPSERT_CONVERSATION_SQL = '''
+    INSERT INTO conversations (user_id, data, updated_at)
+    VALUES (?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT (user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+'''
+
+# Marks the end of the group commit queue
+_STOP = object()
+
+class GroupCommitWriter:
+    """
+    Background writer that batches inserts into group commits
+    
+    Rows are queued by any thread and written by a single writer thread,
+    which collects up to max_batch rows and inserts them with executemany
+    inside one transaction. Fire-and-forget rows wait up to max_delay
+    seconds for company; durable rows are committed with whatever else is
+    queued at that moment, so rows pile up behind an in-flight commit.
+    The writer's connection runs with synchronous=FULL, so one fsync covers
+    the whole batch and an acknowledged write survives a power loss.
+    """
+    
+    def __init__(self, db: "BotDatabase", max_batch: int = 500, max_delay: float = 0.05):
+        """Start the writer thread"""
+        self._db = db
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: "queue.Queue" = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="db-group-commit", daemon=True)
+        self._thread.start()
+    
+    def submit(self, sql: str, params: tuple, durable: bool = False) -> Optional[Future]:
+        """
+        Queue a row for insertion
+        
+        Returns:
+            Optional[Future]: For durable writes, a future resolved once the
+            row is committed to disk; None for fire-and-forget writes
+        """
+        if self._closed:
+            raise RuntimeError("Group commit writer is closed")
+        
+        future = Future() if durable else None
+        self._queue.put((sql, params, future))
+        return future
+    
+    def close(self):
+        """Flush every queued row and stop the writer thread"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+    
+    def _run(self):
+        """Collect batches from the queue and commit them"""
+        self._db._get_connection().execute("PRAGMA synchronous = FULL")
+        stopping = False
+        
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            
+            batch = [item]
+            durable = item[2] is not None
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                # Fire-and-forget rows linger to build a bigger batch; once a
+                # caller is waiting, only rows that are already queued join it
+                timeout = 0 if durable else deadline - time.monotonic()
+                try:
+                    if timeout > 0:
+                        item = self._queue.get(timeout=timeout)
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                durable = durable or item[2] is not None
+            
+            self._commit(batch)
+        
+        # Writes may still race in between close() and the thread exiting
+        remaining = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                remaining.append(item)
+        if remaining:
+            self._commit(remaining)
+    
+    def _commit(self, batch: list):
+        """Insert a batch in a single transaction and resolve its futures"""
+        conn = self._db._get_connection()
+        try:
+            with conn:
+                # Consecutive rows for the same statement share one executemany
+                for sql, items in groupby(batch, key=lambda item: item[0]):
+                    conn.executemany(sql, [params for _, params, _ in items])
+        except sqlite3.Error as e:
+            logging.error(f"Group commit of {len(batch)} rows failed: {e}")
+            for _, _, future in batch:
+                if future:
+                    future.set_exception(e)
+            return
+        
+        for _, _, future in batch:
+            if future:
+                future.set_result(None)
 
 class BotDatabase:
-    def __init__(self, db_path: str = "bot_database.db"):
-        """Initialize database connection and create tables"""
+    def __init__(self, db_path: str = "bot_database.db", cache_size: int = 10000,
+                 cache_ttl: float = 300.0, activity_flush_interval: float = 5.0):
+        """
+        Initialize database connection and create tables
+        
+        Args:
+            db_path (str): SQLite database file
+            cache_size (int): Maximum number of users kept in the hot cache
+            cache_ttl (float): Seconds before a cached user is re-read
+            activity_flush_interval (float): Seconds between batched
+                last_active flushes; 0 disables the background flusher
+        """
         self.db_path = db_path
-        self.init_database()
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
         
-    def init_database(self):
-        """Create database tables if they don't exist"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self.cache = UserCache(cache_size, cache_ttl)
+        self._pending_activity: Dict[int, str] = {}
+        self._pending_activity_lock = threading.Lock()
+        self._activity_flush_interval = activity_flush_interval
+        self._stop_flusher = threading.Event()
+        # Set on close() so a long archive pass stops between batches
+        self._closing = threading.Event()
+        self._flusher = None
         
-        # Users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                credits INTEGER DEFAULT 1,
-                is_subscribed BOOLEAN DEFAULT FALSE,
-                subscription_end_date TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                last_active TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        self.init_database()
+        self.writer = GroupCommitWriter(self)
         
-        # Image generation history
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS image_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                prompt TEXT,
-                image_url TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
+        if activity_flush_interval > 0:
+            self._flusher = threading.Thread(
+                target=self._run_activity_flusher, name="db-activity-flusher", daemon=True
             )
-        ''')
+            self._flusher.start()
+    
+    def _get_connection(self) -> sqlite3.Connection:
+        """
+        Return the long-lived connection owned by the calling thread
         
-        # Payment transactions
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                amount REAL,
-                currency TEXT,
-                payment_method TEXT,
-                transaction_id TEXT,
-                status TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
+        Connections are opened lazily, one per thread, and reused for every
+        call so that the schema, page cache and prepared statements survive
+        between queries.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=30,
+                cached_statements=STATEMENT_CACHE_SIZE,
+                # Each connection is only used by its owning thread; this
+                # just allows close() to shut the whole pool down
+                check_same_thread=False
             )
-        ''')
+            conn.row_factory = sqlite3.Row
+            for pragma in CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+    
+    def interrupt_maintenance(self):
+        """Make a running archive_image_history() return after its current batch"""
+        self._closing.set()
+    
+    def close(self):
+        """Flush pending activity and close every pooled connection"""
+        self._closing.set()
+        if self._flusher:
+            self._stop_flusher.set()
+            self._flusher.join()
+            self._flusher = None
+        self.flush_activity()
+        self.writer.close()
+        
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+    
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Run a block inside BEGIN IMMEDIATE on this thread's connection
+        
+        The write lock is taken up front, so read-then-write sequences cannot
+        interleave with another writer. The block may call conn.rollback()
+        itself to abandon its changes.
+        """
+        conn = self._get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+        
+    @contextmanager
+    def _migration_lock(self) -> Iterator[None]:
+        """Hold an exclusive lock on a file next to the database, across processes"""
+        if fcntl is None or self.db_path == ":memory:":
+            yield
+            return
+        with open(f"{self.db_path}.migrate-lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def init_database(self):
+        """Create the schema or upgrade it by applying pending migrations"""
+        conn = self._get_connection()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        
+        for number, (migration, transactional) in enumerate(MIGRATIONS, start=1):
+            if number <= version:
+                continue
+            
+            if transactional:
+                with self._transaction() as conn:
+                    # Another process may have migrated while we waited for the lock
+                    if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+                        continue
+                    migration(conn)
+                    conn.execute(f"PRAGMA user_version = {number}")
+            else:
+                # No transaction to lock with (VACUUM cannot run in one), so
+                # other processes are held off by a lock file instead
+                with self._migration_lock():
+                    if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+                        continue
+                    migration(conn)
+                    conn.execute(f"PRAGMA user_version = {number}")
+            
+            logging.info(f"Applied database migration {number}: {migration.__name__}")
         
-        conn.commit()
-        conn.close()
         logging.info("Database initialized successfully")
     
-    def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
-        """Get user information by user_id"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+    def _get_record(self, user_id: int) -> Optional[UserRecord]:
+        """Return the user's cached record, loading it from SQLite on a miss"""
+        record = self.cache.get(user_id)
+        if record is not None:
+            return record
         
-        cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+        generation = self.cache.generation()
+        conn = self._get_connection()
+        cursor = conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
         user = cursor.fetchone()
-        conn.close()
+        if not user:
+            return None
         
-        if user:
-            return dict(user)
+        record = UserRecord(user)
+        with self._pending_activity_lock:
+            pending = self._pending_activity.get(user_id)
+        if pending:
+            record.last_active = pending
+        self.cache.put(record, generation)
+        return record
+    
+    def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Get user information by user_id"""
+        record = self._get_record(user_id)
+        if record:
+            return record.to_dict()
         return None
     
     def create_user(self, user_id: int, username: str = None, 
                    first_name: str = None, last_name: str = None) -> bool:
         """Create a new user with free credits"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        conn = self._get_connection()
         
         try:
-            cursor.execute('''
-                INSERT INTO users (user_id, username, first_name, last_name, credits)
-                VALUES (?, ?, ?, ?, 1)
-            ''', (user_id, username, first_name, last_name))
-            conn.commit()
-            conn.close()
+            with conn:
+                conn.execute('''
+                    INSERT INTO users (user_id, username, first_name, last_name, credits, created_at, last_active)
+                    VALUES (?, ?, ?, ?, 1, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                ''', (user_id, username, first_name, last_name))
+            self.cache.invalidate(user_id)
             logging.info(f"New user created: {user_id}")
             return True
         except sqlite3.IntegrityError:
-            conn.close()
             logging.warning(f"User {user_id} already exists")
             return False
     
     def update_user_activity(self, user_id: int):
-        """Update user's last activity timestamp"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """
+        Update user's last activity timestamp
         
-        cursor.execute('''
-            UPDATE users SET last_active = CURRENT_TIMESTAMP 
-            WHERE user_id = ?
-        ''', (user_id,))
-        conn.commit()
-        conn.close()
+        The write is deferred: repeated updates for the same user are
+        coalesced in memory and written in one batch by flush_activity().
+        """
+        # Same format as SQLite's CURRENT_TIMESTAMP
+        now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        with self._pending_activity_lock:
+            self._pending_activity[user_id] = now
+        self.cache.update_last_active(user_id, now)
+    
+    def flush_activity(self) -> int:
+        """Write pending last_active updates in a single transaction"""
+        with self._pending_activity_lock:
+            pending, self._pending_activity = self._pending_activity, {}
+        if not pending:
+            return 0
+        
+        conn = self._get_connection()
+        with conn:
+            conn.executemany('''
+                UPDATE users SET last_active = ? 
+                WHERE user_id = ?
+            ''', [(last_active, user_id) for user_id, last_active in pending.items()])
+        return len(pending)
+    
+    def _run_activity_flusher(self):
+        """Background loop flushing last_active updates every interval"""
+        while not self._stop_flusher.wait(self._activity_flush_interval):
+            try:
+                self.flush_activity()
+            except sqlite3.Error as e:
+                logging.error(f"Failed to flush user activity: {e}")
     
     def get_user_credits(self, user_id: int) -> int:
         """Get user's current credit balance"""
-        user = self.get_user(user_id)
-        if user:
-            return user['credits']
+        record = self._get_record(user_id)
+        if record:
+            return record.credits
         return 0
     
     def deduct_credit(self, user_id: int) -> bool:
         """Deduct one credit from user's balance"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        conn = self._get_connection()
         
-        # Check if user has credits
-        cursor.execute("SELECT credits FROM users WHERE user_id = ?", (user_id,))
-        result = cursor.fetchone()
+        # Check and decrement in a single statement so concurrent charges
+        # can never take the balance below zero
+        with conn:
+            cursor = conn.execute('''
+                UPDATE users SET credits = credits - 1 
+                WHERE user_id = ? AND credits > 0
+                RETURNING credits
+            ''', (user_id,))
+            result = cursor.fetchone()
         
-        if result and result[0] > 0:
-            cursor.execute('''
+        if result is None:
+            return False
+        self.cache.update_credits(user_id, result['credits'])
+        return True
+    
+    def reserve_credit(self, user_id: int, idempotency_key: str,
+                       reason: str = "image_generation") -> bool:
+        """
+        Reserve one credit ahead of a paid operation
+        
+        The credit is deducted immediately and recorded in the ledger as
+        'reserved'. Call commit_credit() once the operation succeeded or
+        refund_credit() to give the credit back. Reserving the same key
+        twice charges only once.
+        
+        Args:
+            user_id (int): Telegram user ID
+            idempotency_key (str): Unique key of the operation being paid for
+            reason (str): Ledger reason for the charge
+            
+        Returns:
+            bool: True if the credit is reserved, False if the balance is empty
+        """
+        with self._transaction() as conn:
+            cursor = conn.execute('''
+                INSERT INTO credit_ledger (user_id, delta, reason, idempotency_key, status)
+                VALUES (?, -1, ?, ?, 'reserved')
+                ON CONFLICT (idempotency_key) DO NOTHING
+            ''', (user_id, reason, idempotency_key))
+            
+            if cursor.rowcount == 0:
+                # Retried operation: report the outcome of the original charge
+                cursor = conn.execute(
+                    "SELECT status FROM credit_ledger WHERE idempotency_key = ?",
+                    (idempotency_key,)
+                )
+                return cursor.fetchone()['status'] != 'refunded'
+            
+            cursor = conn.execute('''
                 UPDATE users SET credits = credits - 1 
-                WHERE user_id = ?
+                WHERE user_id = ? AND credits > 0
+                RETURNING credits
             ''', (user_id,))
-            conn.commit()
-            conn.close()
-            return True
+            result = cursor.fetchone()
+            
+            if result is None:
+                conn.rollback()
+                return False
         
-        conn.close()
-        return False
+        self.cache.update_credits(user_id, result['credits'])
+        return True
     
-    def add_credits(self, user_id: int, credits: int) -> bool:
-        """Add credits to user's balance"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def commit_credit(self, idempotency_key: str) -> bool:
+        """Mark a reserved credit as spent"""
+        conn = self._get_connection()
         
-        cursor.execute('''
-            UPDATE users SET credits = credits + ? 
-            WHERE user_id = ?
-        ''', (credits, user_id))
+        with conn:
+            cursor = conn.execute('''
+                UPDATE credit_ledger SET status = 'committed'
+                WHERE idempotency_key = ? AND status = 'reserved'
+            ''', (idempotency_key,))
         
-        affected_rows = cursor.rowcount
-        conn.commit()
-        conn.close()
+        return cursor.rowcount > 0
+    
+    def refund_credit(self, idempotency_key: str) -> bool:
+        """Return a reserved credit to the user's balance"""
+        with self._transaction() as conn:
+            cursor = conn.execute('''
+                UPDATE credit_ledger SET status = 'refunded'
+                WHERE idempotency_key = ? AND status = 'reserved'
+                RETURNING user_id, delta
+            ''', (idempotency_key,))
+            entry = cursor.fetchone()
+            
+            if entry is None:
+                return False
+            
+            cursor = conn.execute('''
+                UPDATE users SET credits = credits - ? 
+                WHERE user_id = ?
+                RETURNING credits
+            ''', (entry['delta'], entry['user_id']))
+            result = cursor.fetchone()
         
-        return affected_rows > 0
+        if result is not None:
+            self.cache.update_credits(entry['user_id'], result['credits'])
+        logging.info(f"Credit refunded for user {entry['user_id']}: {idempotency_key}")
+        return True
     
-    def is_user_subscribed(self, user_id: int) -> bool:
-        """Check if user has active subscription"""
-        user = self.get_user(user_id)
-        if not user or not user['is_subscribed']:
-            return False
+    def _record_ledger_entry(self, conn: sqlite3.Connection, user_id: int, delta: int,
+                             reason: str, idempotency_key: str) -> bool:
+        """Insert a committed ledger row, returning False if the key was already used"""
+        cursor = conn.execute('''
+            INSERT INTO credit_ledger (user_id, delta, reason, idempotency_key, status)
+            VALUES (?, ?, ?, ?, 'committed')
+            ON CONFLICT (idempotency_key) DO NOTHING
+        ''', (user_id, delta, reason, idempotency_key))
+        return cursor.rowcount > 0
+    
+    def add_credits(self, user_id: int, credits: int,
+                    idempotency_key: Optional[str] = None) -> bool:
+        """
+        Add credits to user's balance
         
-        if user['subscription_end_date']:
-            end_date = datetime.fromisoformat(user['subscription_end_date'])
-            return datetime.now() < end_date
+        When an idempotency_key (e.g. the payment transaction ID) is given,
+        repeated calls with the same key add the credits only once.
+        """
+        with self._transaction() as conn:
+            if idempotency_key and not self._record_ledger_entry(
+                    conn, user_id, credits, "purchase", idempotency_key):
+                logging.info(f"Credits already applied for {idempotency_key}")
+                return True
+            
+            cursor = conn.execute('''
+                UPDATE users SET credits = credits + ? 
+                WHERE user_id = ?
+                RETURNING credits
+            ''', (credits, user_id))
+            result = cursor.fetchone()
+            
+            if result is None:
+                conn.rollback()
+                return False
         
-        return False
+        self.cache.update_credits(user_id, result['credits'])
+        return True
     
-    def activate_subscription(self, user_id: int, duration_days: int = 30) -> bool:
-        """Activate subscription for user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def is_user_subscribed(self, user_id: int) -> bool:
+        """Check if user has active subscription"""
+        record = self._get_record(user_id)
+        return record is not None and record.is_subscription_active()
+    
+    def activate_subscription(self, user_id: int, duration_days: int = 30,
+                              idempotency_key: Optional[str] = None) -> bool:
+        """
+        Activate subscription for user
         
+        When an idempotency_key is given, a retried payment does not extend
+        the subscription a second time.
+        """
         end_date = datetime.now() + timedelta(days=duration_days)
         
-        cursor.execute('''
-            UPDATE users 
-            SET is_subscribed = TRUE, subscription_end_date = ?
-            WHERE user_id = ?
-        ''', (end_date.isoformat(), user_id))
-        
-        affected_rows = cursor.rowcount
-        conn.commit()
-        conn.close()
+        with self._transaction() as conn:
+            if idempotency_key and not self._record_ledger_entry(
+                    conn, user_id, 0, "subscription", idempotency_key):
+                logging.info(f"Subscription already applied for {idempotency_key}")
+                return True
+            
+            cursor = conn.execute('''
+                UPDATE users 
+                SET is_subscribed = TRUE, subscription_end_date = ?
+                WHERE user_id = ?
+            ''', (end_date.isoformat(), user_id))
+            
+            if cursor.rowcount == 0:
+                conn.rollback()
+                return False
         
-        if affected_rows > 0:
-            logging.info(f"Subscription activated for user {user_id}")
-            return True
-        return False
+        self.cache.invalidate(user_id)
+        logging.info(f"Subscription activated for user {user_id}")
+        return True
     
     def save_image_generation(self, user_id: int, prompt: str, image_url: str):
-        """Save image generation history"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO image_history (user_id, prompt, image_url)
-            VALUES (?, ?, ?)
-        ''', (user_id, prompt, image_url))
-        
-        conn.commit()
-        conn.close()
-        logging.info(f"Image generation saved for user {user_id}")
+        """Save image generation history (fire-and-forget, written by the next group commit)"""
+        self.writer.submit(INSERT_IMAGE_HISTORY_SQL, (user_id, prompt, image_url))
+        logging.info(f"Image generation queued for user {user_id}")
+    
+    def queue_transaction(self, user_id: int, amount: float, currency: str,
+                          payment_method: str, transaction_id: str, status: str) -> Future:
+        """Queue a payment transaction, returning a future resolved once it is durable"""
+        return self.writer.submit(
+            INSERT_TRANSACTION_SQL,
+            (user_id, amount, currency, payment_method, transaction_id, status),
+            durable=True
+        )
     
     def save_transaction(self, user_id: int, amount: float, currency: str,
                         payment_method: str, transaction_id: str, status: str):
-        """Save payment transaction"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO transactions 
-            (user_id, amount, currency, payment_method, transaction_id, status)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, amount, currency, payment_method, transaction_id, status))
-        
-        conn.commit()
-        conn.close()
+        """Save payment transaction, returning once it is committed to disk"""
+        self.queue_transaction(user_id, amount, currency, payment_method,
+                               transaction_id, status).result()
         logging.info(f"Transaction saved for user {user_id}: {status}")
     
-    def get_user_stats(self) -> Dict[str, int]:
+    def get_user_stats(self) -> Dict[str, Any]:
         """Get general statistics about users"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._get_connection()
         cursor = conn.cursor()
         
-        # Total users
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0]
+        # Running totals maintained by triggers
+        cursor.execute("SELECT name, value FROM stats")
+        totals = {row['name']: row['value'] for row in cursor.fetchall()}
         
-        # Active subscribers
+        # Active subscribers: subscriptions expire with time, so they are
+        # counted with an index range scan rather than kept as a counter.
+        # subscription_end_date is stored as a local ISO timestamp.
         cursor.execute('''
             SELECT COUNT(*) FROM users 
-            WHERE is_subscribed = TRUE AND subscription_end_date > datetime('now')
-        ''')
+            WHERE subscription_end_date > ? AND is_subscribed = TRUE
+        ''', (datetime.now().isoformat(),))
         active_subscribers = cursor.fetchone()[0]
         
-        # Total images generated
-        cursor.execute("SELECT COUNT(*) FROM image_history")
-        total_images = cursor.fetchone()[0]
-        
-        conn.close()
-        
         return {
-            'total_users': total_users,
+            'total_users': totals.get('total_users', 0),
             'active_subscribers': active_subscribers,
-            'total_images': total_images
+            'total_images': totals.get('total_images', 0),
+            'total_revenue': totals.get('total_revenue', 0)
         }
+    
+    def get_hourly_stats(self, hours: int = 24) -> List[Dict[str, Any]]:
+        """
+        Get per-hour rollups for the last `hours` hours
+        
+        Returns:
+            List[Dict[str, Any]]: One entry per hour with activity, oldest
+            first, with bucket (UTC 'YYYY-MM-DD HH:00'), images, new_users
+            and revenue
+        """
+        conn = self._get_connection()
+        cursor = conn.execute('''
+            SELECT bucket, images, new_users, revenue FROM stats_hourly
+            WHERE bucket >= strftime('%Y-%m-%d %H:00', 'now', ?)
+            ORDER BY bucket
+        ''', (f"-{hours - 1} hours",))
+        return [dict(row) for row in cursor.fetchall()]
+    
+    def get_cache_stats(self) -> Dict[str, int]:
+        """Get user cache hit/miss/eviction counters"""
+        return self.cache.get_stats()
+    
+    def load_conversation(self, user_id: int) -> Optional[bytes]:
+        """Get the user's encoded conversation, if one was saved"""
+        conn = self._get_connection()
+        cursor = conn.execute("SELECT data FROM conversations WHERE user_id = ?", (user_id,))
+        row = cursor.fetchone()
+        return row['data'] if row else None
+    
+    def queue_conversation(self, user_id: int, data: bytes, durable: bool = False) -> Optional[Future]:
+        """Queue an encoded conversation for the next group commit"""
+        return self.writer.submit(UPSERT_CONVERSATION_SQL, (user_id, data), durable=durable)
+    
+    def delete_conversation(self, user_id: int):
+        """Forget the user's saved conversation"""
+        conn = self._get_connection()
+        with conn:
+            conn.execute("DELETE FROM conversations WHERE user_id = ?", (user_id,))
+    
+    def archive_image_history(self, older_than_days: int = 90, archive_dir: Optional[str] = None,
+                              batch_size: int = 2000, vacuum_pages: int = 500, pause: float = 0.05) -> int:
+        """
+        Move old image history out of the live database
+        
+        Rows older than `older_than_days` are appended to monthly
+        gzip-compressed JSON Lines files (image_history-YYYY-MM.jsonl.gz)
+        and then deleted in batches. Each archive append is fsynced before
+        its rows are deleted, so a crash can at worst duplicate rows in an
+        archive, never lose them. After every batch the freed pages are
+        returned to the filesystem with PRAGMA incremental_vacuum, and the
+        write lock is released for `pause` seconds so other writers get in
+        between batches. A pass stops early once interrupt_maintenance()
+        or close() is called. Statistics totals are unaffected.
+        
+        Args:
+            older_than_days (int): Age in days after which rows are archived
+            archive_dir (Optional[str]): Archive directory, defaults to
+                "archive" next to the database file
+            batch_size (int): Rows archived and deleted per transaction
+            vacuum_pages (int): Free pages released after each batch
+            pause (float): Seconds the write lock is left free between batches
+            
+        Returns:
+            int: Number of rows archived
+        """
+        if archive_dir is None:
+            archive_dir = os.path.join(os.path.dirname(os.path.abspath(self.db_path)), "archive")
+        os.makedirs(archive_dir, exist_ok=True)
+        
+        conn = self._get_connection()
+        archived = 0
+        
+        while not self._closing.is_set():
+            rows = conn.execute('''
+                SELECT id, user_id, prompt, image_url, created_at FROM image_history
+                WHERE created_at < datetime('now', ?)
+                ORDER BY created_at
+                LIMIT ?
+            ''', (f"-{older_than_days} days", batch_size)).fetchall()
+            if not rows:
+                break
+            
+            by_month: Dict[str, list] = {}
+            for row in rows:
+                by_month.setdefault(row['created_at'][:7], []).append(row)
+            
+            for month, month_rows in by_month.items():
+                path = os.path.join(archive_dir, f"image_history-{month}.jsonl.gz")
+                lines = "".join(json.dumps(dict(row), ensure_ascii=False) + "\n" for row in month_rows)
+                # Each append adds a gzip member; gzip readers concatenate them
+                with open(path, "ab") as archive:
+                    archive.write(gzip.compress(lines.encode("utf-8")))
+                    archive.flush()
+                    os.fsync(archive.fileno())
+            
+            with conn:
+                conn.executemany("DELETE FROM image_history WHERE id = ?",
+                                 [(row['id'],) for row in rows])
+            archived += len(rows)
+            
+            # execute() steps a pragma only once, which frees a single page;
+            # executescript() runs it to completion
+            conn.executescript(f"PRAGMA incremental_vacuum({int(vacuum_pages)});")
+            if len(rows) == batch_size:
+                time.sleep(pause)
+        
+        if archived:
+            logging.info(f"Archived {archived} image history rows to {archive_dir}")
+        return archived
 
+
+class AsyncBotDatabase:
+    """
+    Asyncio front-end for BotDatabase
+    
+    Every query runs off the event loop. Writes are serialized on a single
+    dedicated writer thread (SQLite allows one writer at a time anyway, so
+    this avoids lock contention and busy waits), while reads are spread
+    over a small pool of reader threads that run concurrently thanks to WAL.
+    Each thread keeps its own pooled connection from BotDatabase.
+    """
+    
+    def __init__(self, db_path: str = "bot_database.db", reader_threads: int = 4):
+        """Create the underlying database and the writer/reader executors"""
+        self.db = BotDatabase(db_path)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=reader_threads, thread_name_prefix="db-reader")
+        # Long maintenance jobs get their own thread and connection, so
+        # they never hold up the writer queue
+        self._maintenance = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-maintenance")
+    
+    async def _read(self, func: Callable[..., T], *args) -> T:
+        """Run a read-only query on the reader pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, func, *args)
+    
+    async def _write(self, func: Callable[..., T], *args) -> T:
+        """Run a write on the dedicated writer thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, func, *args)
+    
+    async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Get user information by user_id"""
+        return await self._read(self.db.get_user, user_id)
+    
+    async def create_user(self, user_id: int, username: str = None,
+                          first_name: str = None, last_name: str = None) -> bool:
+        """Create a new user with free credits"""
+        return await self._write(self.db.create_user, user_id, username, first_name, last_name)
+    
+    async def update_user_activity(self, user_id: int):
+        """Update user's last activity timestamp"""
+        # Only queues an in-memory update, so there is no need to leave the loop
+        self.db.update_user_activity(user_id)
+    
+    async def get_user_credits(self, user_id: int) -> int:
+        """Get user's current credit balance"""
+        return await self._read(self.db.get_user_credits, user_id)
+    
+    async def deduct_credit(self, user_id: int) -> bool:
+        """Deduct one credit from user's balance"""
+        return await self._write(self.db.deduct_credit, user_id)
+    
+    async def reserve_credit(self, user_id: int, idempotency_key: str,
+                             reason: str = "image_generation") -> bool:
+        """Reserve one credit ahead of a paid operation"""
+        return await self._write(self.db.reserve_credit, user_id, idempotency_key, reason)
+    
+    async def commit_credit(self, idempotency_key: str) -> bool:
+        """Mark a reserved credit as spent"""
+        return await self._write(self.db.commit_credit, idempotency_key)
+    
+    async def refund_credit(self, idempotency_key: str) -> bool:
+        """Return a reserved credit to the user's balance"""
+        return await self._write(self.db.refund_credit, idempotency_key)
+    
+    async def add_credits(self, user_id: int, credits: int,
+                          idempotency_key: Optional[str] = None) -> bool:
+        """Add credits to user's balance"""
+        return await self._write(self.db.add_credits, user_id, credits, idempotency_key)
+    
+    async def is_user_subscribed(self, user_id: int) -> bool:
+        """Check if user has active subscription"""
+        return await self._read(self.db.is_user_subscribed, user_id)
+    
+    async def activate_subscription(self, user_id: int, duration_days: int = 30,
+                                    idempotency_key: Optional[str] = None) -> bool:
+        """Activate subscription for user"""
+        return await self._write(self.db.activate_subscription, user_id, duration_days,
+                                 idempotency_key)
+    
+    async def save_image_generation(self, user_id: int, prompt: str, image_url: str):
+        """Save image generation history"""
+        # Only enqueues the row for the group commit writer
+        self.db.save_image_generation(user_id, prompt, image_url)
+    
+    async def save_transaction(self, user_id: int, amount: float, currency: str,
+                               payment_method: str, transaction_id: str, status: str):
+        """Save payment transaction, returning once it is committed to disk"""
+        future = self.db.queue_transaction(user_id, amount, currency, payment_method,
+                                           transaction_id, status)
+        await asyncio.wrap_future(future)
+        logging.info(f"Transaction saved for user {user_id}: {status}")
+    
+    async def get_user_stats(self) -> Dict[str, Any]:
+        """Get general statistics about users"""
+        return await self._read(self.db.get_user_stats)
+    
+    async def get_hourly_stats(self, hours: int = 24) -> List[Dict[str, Any]]:
+        """Get per-hour rollups for the last `hours` hours"""
+        return await self._read(self.db.get_hourly_stats, hours)
+    
+    def get_cache_stats(self) -> Dict[str, int]:
+        """Get user cache hit/miss/eviction counters"""
+        return self.db.get_cache_stats()
+    
+    async def load_conversation(self, user_id: int) -> Optional[bytes]:
+        """Get the user's encoded conversation, if one was saved"""
+        return await self._read(self.db.load_conversation, user_id)
+    
+    async def save_conversation(self, user_id: int, data: bytes, durable: bool = False):
+        """
+        Save an encoded conversation
+        
+        Fire-and-forget by default; with durable=True, returns once the
+        conversation is committed to disk.
+        """
+        future = self.db.queue_conversation(user_id, data, durable)
+        if future:
+            await asyncio.wrap_future(future)
+    
+    async def delete_conversation(self, user_id: int):
+        """Forget the user's saved conversation"""
+        await self._write(self.db.delete_conversation, user_id)
+    
+    async def archive_image_history(self, older_than_days: int = 90,
+                                    archive_dir: Optional[str] = None) -> int:
+        """
+        Move old image history out of the live database
+        
+        Runs on the maintenance thread in short batches, so writes queued
+        on the writer thread meanwhile wait for one batch at most.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._maintenance, self.db.archive_image_history, older_than_days, archive_dir
+        )
+    
+    async def close(self):
+        """Drain pending queries, then flush queued writes and close the connections"""
+        loop = asyncio.get_running_loop()
+        self.db.interrupt_maintenance()
+        await loop.run_in_executor(None, self._maintenance.shutdown)
+        await loop.run_in_executor(None, self._writer.shutdown)
+        await loop.run_in_executor(None, self._readers.shutdown)
+        await loop.run_in_executor(None, self.db.close)
@@ -0,0 +1,274 @@
+"""
+Gemini scheduler module for Telegram AI Bot
+Admits Gemini requests under concurrency and rate limits, by priority and fairly per user
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes, served in this order
+PRIORITY_INTERACTIVE = 0  # text replies and transcriptions the user is waiting on
+PRIORITY_BACKGROUND = 1   # voice replies, images, summaries
+
+# Receives the request's 1-based queue position
+QueuedFn = Callable[[int], Awaitable[object]]
+
+class TokenBucket:
+    """Request rate limiter refilling at rate tokens per second up to capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        """Initialize a full bucket"""
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        """Add the tokens accrued since the last update"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 if one is available now)"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        """Consume one token; call only when delay() is 0"""
+        self.tokens -= 1
+
+class ModelLimits:
+    """Concurrency limit, rate limit and live usage of one Gemini model"""
+
+    def __init__(self, concurrency: int, requests_per_minute: float):
+        """Initialize limits; the bucket allows a burst of a few seconds' worth"""
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(requests_per_minute / 60, max(1.0, min(concurrency, requests_per_minute / 10)))
+        self.running = 0
+
+class _Waiter:
+    """One queued request"""
+
+    __slots__ = ('model', 'user_id', 'future')
+
+    def __init__(self, model: str, user_id: int, future: asyncio.Future):
+        self.model = model
+        self.user_id = user_id
+        self.future = future
+
+class GeminiScheduler:
+    """
+    Central admission control for Gemini API calls
+
+    Every call holds a slot for its model (see slot()) while it runs.
+    A slot is granted when the model is under its concurrency limit, its
+    token bucket has a token and the global concurrency limit allows it.
+    Waiting requests are served interactive lane first; within a lane,
+    users are served round-robin, one request at a time, so a user with
+    many queued requests cannot starve the others.
+
+    Limits are keyed by Gemini model name, so model objects that share a
+    model (and therefore an API quota) share limits.
+    """
+
+    def __init__(self, max_concurrency: int = 16, notice_delay: float = 1.0):
+        """
+        Initialize the scheduler
+
+        Args:
+            max_concurrency: Gemini calls in flight across all models
+            notice_delay: How long a request waits before on_queued is called
+        """
+        self.max_concurrency = max_concurrency
+        self.notice_delay = notice_delay
+        self.models: Dict[str, ModelLimits] = {}
+        self.running = 0
+        # lane -> user_id -> that user's waiters in arrival order
+        self._lanes: List["OrderedDict[int, Deque[_Waiter]]"] = [
+            OrderedDict() for _ in (PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND)
+        ]
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        self.granted = 0
+        self.queued = 0
+
+    def add_model(self, model: str, concurrency: int, requests_per_minute: float):
+        """Register the limits of a Gemini model"""
+        self.models[model] = ModelLimits(concurrency, requests_per_minute)
+
+    @asynccontextmanager
+    async def slot(self, model: str, user_id: int = 0, priority: int = PRIORITY_INTERACTIVE,
+                   on_queued: Optional[QueuedFn] = None) -> AsyncIterator[None]:
+        """
+        Hold a slot for one call to model for the duration of the block
+
+        Args:
+            model: Gemini model name, as registered with add_model()
+            user_id: Telegram user the call is made for (0 for system work)
+            priority: PRIORITY_INTERACTIVE or PRIORITY_BACKGROUND
+            on_queued: Called with the queue position if the request is
+                still waiting after notice_delay seconds
+        """
+        await self._acquire(model, user_id, priority, on_queued)
+        try:
+            yield
+        finally:
+            self._release(model)
+
+    async def _acquire(self, model: str, user_id: int, priority: int, on_queued: Optional[QueuedFn]):
+        """Wait until a slot is granted"""
+        if model not in self.models:
+            raise KeyError(f"Unknown Gemini model: {model}")
+
+        waiter = _Waiter(model, user_id, asyncio.get_running_loop().create_future())
+        self._lanes[priority].setdefault(user_id, deque()).append(waiter)
+        self._dispatch()
+        if waiter.future.done():
+            return
+
+        self.queued += 1
+        try:
+            if on_queued is not None:
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter.future), self.notice_delay)
+                    return
+                except asyncio.TimeoutError:
+                    position = self.position(waiter, priority)
+                    if position:
+                        try:
+                            await on_queued(position)
+                        except Exception as e:
+                            logger.error(f"❌ Queue notice failed: {e}")
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as we were cancelled: give the slot back
+                self._release(model)
+            else:
+                waiter.future.cancel()
+                self._remove(waiter, priority)
+                self._dispatch()
+            raise
+
+    def _release(self, model: str):
+        """Free a slot and admit the next waiters"""
+        self.models[model].running -= 1
+        self.running -= 1
+        self._dispatch()
+
+    def _remove(self, waiter: _Waiter, priority: int):
+        """Drop a cancelled waiter from its lane"""
+        lane = self._lanes[priority]
+        queue = lane.get(waiter.user_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        if not queue:
+            del lane[waiter.user_id]
+
+    def _dispatch(self):
+        """Grant slots to as many waiters as the limits allow"""
+        retry_in = None
+        while self.running < self.max_concurrency:
+            waiter, delay = self._next_waiter()
+            if waiter is None:
+                if delay is not None:
+                    retry_in = delay
+                break
+            limits = self.models[waiter.model]
+            limits.bucket.take()
+            limits.running += 1
+            self.running += 1
+            self.granted += 1
+            waiter.future.set_result(None)
+
+        if retry_in is not None and self._timer is None:
+            # Only rate limits are in the way: look again once a token accrues
+            def wake():
+                self._timer = None
+                self._dispatch()
+            self._timer = asyncio.get_running_loop().call_later(retry_in, wake)
+
+    def _next_waiter(self):
+        """
+        Pick and dequeue the next waiter that can start now
+
+        Returns:
+            tuple: (waiter, None), or (None, seconds until a rate-limited
+            waiter could start), or (None, None) if nothing can start
+        """
+        soonest = None
+        for lane in self._lanes:
+            for user_id, queue in lane.items():
+                for waiter in queue:
+                    if waiter.future.done():
+                        continue
+                    limits = self.models[waiter.model]
+                    if limits.running >= limits.concurrency:
+                        continue
+                    delay = limits.bucket.delay()
+                    if delay > 0:
+                        soonest = delay if soonest is None else min(soonest, delay)
+                        continue
+
+                    queue.remove(waiter)
+                    if queue:
+                        # This user goes to the back of the round-robin order
+                        lane.move_to_end(user_id)
+                    else:
+                        del lane[user_id]
+                    return waiter, None
+        return None, soonest
+
+    def position(self, waiter: _Waiter, priority: int) -> int:
+        """
+        Estimate a waiter's 1-based place in the queue (0 if no longer queued)
+
+        Counts every request in higher-priority lanes, then simulates the
+        round-robin order of its own lane, ignoring per-model limits.
+        """
+        lane = self._lanes[priority]
+        queue = lane.get(waiter.user_id)
+        if queue is None or waiter not in queue:
+            return 0
+
+        ahead = sum(len(q) for higher in self._lanes[:priority] for q in higher.values())
+        index = queue.index(waiter)
+        before_user = True
+        for user_id, other in lane.items():
+            if user_id == waiter.user_id:
+                before_user = False
+                continue
+            # Users earlier in the rotation get one more turn before ours
+            ahead += min(len(other), index + (1 if before_user else 0))
+        return ahead + index + 1
+
+    def get_stats(self) -> Dict[str, object]:
+        """Return running and waiting counts per model plus totals"""
+        waiting: Dict[str, int] = {model: 0 for model in self.models}
+        for lane in self._lanes:
+            for queue in lane.values():
+                for waiter in queue:
+                    waiting[waiter.model] += 1
+        return {
+            'running': self.running,
+            'waiting': sum(waiting.values()),
+            'granted': self.granted,
+            'queued': self.queued,
+            'models': {
+                model: {'running': limits.running, 'waiting': waiting[model]}
+                for model, limits in self.models.items()
+            }
+        }
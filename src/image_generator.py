@@ -12,26 +12,42 @@ from typing import Optional
 from openai import AsyncOpenAI
 from dotenv import load_dotenv
 
+from content_filter import ContentFilter
+from image_store import ImageStore
+from model_client import ModelClient
+from resilience import CircuitOpenError, Resilience
+
 # Load environment variables
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
 class ImageGenerator:
-    def __init__(self):
-        """Initialize the image generator with OpenAI client"""
+    def __init__(self, store: Optional[ImageStore] = None, content_filter: Optional[ContentFilter] = None):
+        """
+        Initialize the image generator with OpenAI client
+        
+        Args:
+            store (ImageStore): Optional store that generated images are downloaded into
+            content_filter (ContentFilter): Checks prompts before any API call; a default one if not given
+        """
         self.api_key = os.getenv('OPENAI_API_KEY')
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY not found in environment variables")
         
-        # Initialize OpenAI client
-        self.client = AsyncOpenAI(api_key=self.api_key)
+        # Initialize OpenAI client; retries are handled by self.model_client
+        self.client = AsyncOpenAI(api_key=self.api_key, max_retries=0)
+        self.model_client = ModelClient(
+            Resilience("openai-images", timeout=float(os.getenv('OPENAI_IMAGE_TIMEOUT', '90')))
+        )
         
         # Configuration
         self.model = "dall-e-3"  # Use DALL-E 3 for best quality
         self.size = "1024x1024"  # Standard square format
         self.quality = "standard"  # Can be "standard" or "hd"
         self.style = "vivid"  # Can be "vivid" or "natural"
+        self.store = store
+        self.content_filter = content_filter or ContentFilter()
         
         logger.info("Image generator initialized successfully")
     
@@ -52,17 +68,22 @@ class ImageGenerator:
                 logger.error("Invalid or empty prompt provided")
                 return None
             
+            verdict = await self.content_filter.classify(prompt)
+            if not verdict.safe:
+                logger.warning(f"Image prompt rejected by content filter: {verdict.category}")
+                return None
+            
             logger.info(f"Generating image for prompt: {cleaned_prompt[:100]}...")
             
             # Call OpenAI DALL-E API
-            response = await self.client.images.generate(
+            response = await self.model_client.call(lambda: self.client.images.generate(
                 model=self.model,
                 prompt=cleaned_prompt,
                 size=self.size,
                 quality=self.quality,
                 style=self.style,
                 n=1  # Generate only one image
-            )
+            ))
             
             # Extract image URL from response
             if response.data and len(response.data) > 0:
@@ -73,10 +94,65 @@ class ImageGenerator:
                 logger.error("No image data received from OpenAI API")
                 return None
                 
+        except CircuitOpenError:
+            logger.warning("Image generation skipped: OpenAI circuit breaker is open")
+            return None
         except Exception as e:
             logger.error(f"Error generating image: {e}")
             return None
     
+    def store_key(self, prompt: str) -> str:
+        """Return the ImageStore key of a prompt with the current settings"""
+        return ImageStore.key_for(self._clean_prompt(prompt), self.model, f"{self.size}/{self.quality}/{self.style}")
+    
+    async def fetch_image(self, prompt: str) -> Optional[bytes]:
+        """
+        Return the image for a prompt, from the store or freshly generated
+        
+        DALL-E URLs expire after a while, so the image is downloaded right
+        away and, with a store, kept under store_key(prompt). Callers that
+        send the image should record its Telegram file_id with
+        store.set_file_id() and try that first next time.
+        
+        Args:
+            prompt (str): Text description for image generation
+            
+        Returns:
+            Optional[bytes]: Image bytes or None if failed
+        """
+        if not (await self.content_filter.classify(prompt)).safe:
+            return None
+        
+        key = self.store_key(prompt)
+        if self.store is not None:
+            _, content_hash = await self.store.lookup(key)
+            if content_hash:
+                image_data = await self.store.read(content_hash)
+                if image_data is not None:
+                    return image_data
+        
+        image_url = await self.generate_image(prompt)
+        if not image_url:
+            return None
+        
+        try:
+            timeout = aiohttp.ClientTimeout(total=60)
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async with session.get(image_url) as response:
+                    response.raise_for_status()
+                    image_data = await response.read()
+        except Exception as e:
+            logger.error(f"Error downloading generated image: {e}")
+            return None
+        
+        if self.store is not None:
+            await self.store.put(key, image_data)
+        return image_data
+    
+    def is_available(self) -> bool:
+        """Check whether image generation is currently accepting requests"""
+        return self.model_client.is_available()
+    
     def _clean_prompt(self, prompt: str) -> str:
         """
         Clean and validate the prompt for image generation
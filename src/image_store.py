@@ -0,0 +1,202 @@
+"""
+Image store module for Telegram AI Bot
+Reuses generated images by prompt, via Telegram file_ids and an on-disk cache
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from response_cache import normalize_prompt
+
+logger = logging.getLogger(__name__)
+
+class ImageStore:
+    """
+    Generated images keyed by prompt, model and size
+
+    Each key maps to the Telegram file_id the image got when it was first
+    sent, so a repeated prompt is answered by re-sending that file_id:
+    no generation and no upload. The image bytes are also kept on disk,
+    content-addressed by their sha256 (identical images share one file),
+    to re-upload if Telegram ever rejects a file_id.
+
+    The index lives in SQLite inside cache_dir, so it survives restarts
+    and is shared by webhook workers. evict() drops entries unused for
+    max_age seconds, then the least recently used files until the
+    directory fits in max_bytes.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 512 * 1024 * 1024,
+                 max_age: float = 30 * 24 * 60 * 60):
+        """Initialize the store, creating cache_dir and the index if needed"""
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, "index.db"), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS images (
+                key TEXT PRIMARY KEY,
+                content_hash TEXT,
+                file_id TEXT,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_images_last_used ON images (last_used)")
+        self._db.commit()
+
+        self.lookups = 0
+        self.file_id_hits = 0
+        self.disk_hits = 0
+        self.stores = 0
+        self.evicted_files = 0
+
+    @staticmethod
+    def key_for(prompt: str, model: str, size: str = "") -> str:
+        """Return the store key of a prompt rendered by model at size"""
+        return hashlib.sha256(f"{model}\0{size}\0{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+    def _path(self, content_hash: str) -> str:
+        """Return the file path of an image by its content hash"""
+        return os.path.join(self.cache_dir, content_hash[:2], content_hash)
+
+    async def lookup(self, key: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Find a stored image and mark it as used
+
+        Returns:
+            tuple: (file_id or None, content hash or None)
+        """
+        self.lookups += 1
+        row = await asyncio.to_thread(self._lookup, key)
+        if row is None:
+            return None, None
+        file_id, content_hash = row
+        if file_id:
+            self.file_id_hits += 1
+        return file_id, content_hash
+
+    def _lookup(self, key: str) -> Optional[Tuple[Optional[str], Optional[str]]]:
+        with self._db_lock:
+            row = self._db.execute("SELECT file_id, content_hash FROM images WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._db.execute("UPDATE images SET last_used = ? WHERE key = ?", (time.time(), key))
+                self._db.commit()
+        return row
+
+    async def read(self, content_hash: str) -> Optional[bytes]:
+        """Return the bytes of a stored image, or None if it was evicted"""
+        try:
+            data = await asyncio.to_thread(self._read, content_hash)
+        except FileNotFoundError:
+            return None
+        self.disk_hits += 1
+        return data
+
+    def _read(self, content_hash: str) -> bytes:
+        path = self._path(content_hash)
+        with open(path, "rb") as f:
+            data = f.read()
+        # The modification time doubles as the last use for size eviction
+        os.utime(path)
+        return data
+
+    async def put(self, key: str, data: bytes) -> str:
+        """Store the bytes of a freshly generated image, returning its content hash"""
+        content_hash = hashlib.sha256(data).hexdigest()
+        await asyncio.to_thread(self._put, key, content_hash, data)
+        self.stores += 1
+        return content_hash
+
+    def _put(self, key: str, content_hash: str, data: bytes):
+        path = self._path(content_hash)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so readers never see a partial file
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO images (key, content_hash, file_id, last_used) VALUES (?, ?, NULL, ?)",
+                (key, content_hash, time.time())
+            )
+            self._db.commit()
+
+    async def set_file_id(self, key: str, file_id: Optional[str]):
+        """Record the file_id Telegram assigned to an image, or clear a rejected one"""
+        await asyncio.to_thread(self._set_file_id, key, file_id)
+
+    def _set_file_id(self, key: str, file_id: Optional[str]):
+        with self._db_lock:
+            self._db.execute("UPDATE images SET file_id = ? WHERE key = ?", (file_id, key))
+            self._db.commit()
+
+    async def evict(self):
+        """Drop entries older than max_age, then trim the files to max_bytes"""
+        await asyncio.to_thread(self._evict)
+
+    def _evict(self):
+        with self._db_lock:
+            self._db.execute("DELETE FROM images WHERE last_used < ?", (time.time() - self.max_age,))
+            self._db.commit()
+            referenced = {row[0] for row in self._db.execute("SELECT DISTINCT content_hash FROM images")}
+
+        files = []
+        for directory in os.scandir(self.cache_dir):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                # Temporary files of writes in progress start with "tmp"
+                if entry.is_file() and not entry.name.startswith("tmp"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.name, entry.path))
+
+        # Unreferenced files go first, then the least recently used
+        files.sort(key=lambda file: (file[2] in referenced, file[0]))
+        total = sum(file[1] for file in files)
+        removed = 0
+        for _, size, content_hash, path in files:
+            if content_hash in referenced and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        self.evicted_files += removed
+        if removed:
+            logger.info(f"Image store evicted {removed} files, {total // (1024 * 1024)} MB left")
+
+    def close(self):
+        """Close the index"""
+        with self._db_lock:
+            self._db.close()
+
+    def get_stats(self) -> Dict[str, int]:
+        """Return lookup and eviction counters"""
+        return {
+            'lookups': self.lookups,
+            'file_id_hits': self.file_id_hits,
+            'disk_hits': self.disk_hits,
+            'stores': self.stores,
+            'evicted_files': self.evicted_files
+        }
@@ -0,0 +1,187 @@
+"""
+Intent router module for Telegram AI Bot
+Decides whether a text message asks for an image, and extracts its prompt
+"""
+
+import re
+import logging
+from collections import Counter
+from typing import Dict, List, NamedTuple, Tuple
+
+from text_normalizer import normalize_arabic
+
+logger = logging.getLogger(__name__)
+
+INTENT_IMAGE = "image"
+INTENT_CHAT = "chat"
+
+# Command phrases are only looked for at the start of a message
+PREFIX_LENGTH = 80
+
+_POLITE = r"(?:(?:من فضلك|لو سمحت|ممكن|رجاء|please|pls|can you|could you)\s+)?"
+_FOR_ME = r"(?:\s*(?:لي|لنا)(?=\s|$)|\s+(?:me|us)(?=\s|$))?"
+_IMAGE_NOUN = r"(?:صوره|رسمه|لوحه|image|picture|photo|drawing|illustration|painting)"
+_OBJECT = rf"(?:\s+(?:an?|the))?\s+{_IMAGE_NOUN}"
+# "عن", "لـ" or "of" as a word, or ل attached to the next word ("صورة لقطة");
+# "لل" is left alone, as dropping one ل of it would change the word
+_PREPOSITION_WORD = r"(?:(?:عن|ل|of|about|showing)(?=\s|$)|ل(?=[^\Wل]))"
+_PREPOSITION = rf"(?:\s+{_PREPOSITION_WORD})?"
+# "draw conclusions", "draw attention", "ارسم خطة": the verb without a picture
+_IDIOM = (
+    r"(?!\s+(?:conclusions?|attention|inspiration|comparisons?|parallels?|lessons?|a\s+blank"
+    r"|the\s+line|on|from|up|out|back|near|خطه|خطط|سياسه|مستقبل|طريق)(?=\s|$))"
+)
+
+# One alternation over all command phrases; the named group that matched
+# tells which kind of phrase it was
+_COMMAND = re.compile(
+    rf"\s*{_POLITE}(?:"
+    # ارسم لي صورة عن ... / draw me a picture of ...
+    rf"(?P<verb_object>(?:ارسم|ارسمي|انشي|اعمل|اعملي|سوي|صمم|ولد|اصنع|draw|generate|create|make|paint|design)"
+    rf"{_FOR_ME}{_OBJECT}{_PREPOSITION})"
+    # ارسم قطة / draw a cat ("paint" only with an image noun: "paint the town red")
+    rf"|(?P<verb>(?:ارسم|ارسمي|draw|sketch){_FOR_ME}{_IDIOM})"
+    # أريد صورة لـ ... / I want a picture of ...
+    rf"|(?P<request>(?:اريد|ابغي|ابي|عايز|عاوز|بدي|i want|i need|i'd like|give me|show me){_FOR_ME}{_OBJECT}{_PREPOSITION})"
+    # توليد صورة ... / إنشاء صورة ...
+    rf"|(?P<noun_verb>(?:توليد|انشاء|رسم|تصميم)\s+{_IMAGE_NOUN}{_PREPOSITION})"
+    # صورة عن ... / image of ...
+    rf"|(?P<noun_of>{_IMAGE_NOUN}\s+{_PREPOSITION_WORD})"
+    # صورة ... / image ...: as often the topic of a question as a request
+    rf"|(?P<noun>{_IMAGE_NOUN})"
+    # The phrase ends at a word boundary, or right after an attached ل
+    r")(?:(?=\s|$|[:،,.!؟?])|(?<=ل)(?=\w))"
+)
+
+# How sure each kind of phrase makes us, before the classifier adjusts it
+_BASE_CONFIDENCE = {
+    'verb_object': 0.95,
+    'request': 0.9,
+    'noun_verb': 0.9,
+    'verb': 0.85,
+    'noun_of': 0.7,
+    # Below the default threshold: "image processing in python" or
+    # "صورة جميلة جدا" are not requests
+    'noun': 0.5,
+}
+
+# Signs that the rest of the message is a question or a statement about
+# an image rather than a description of one
+_QUESTION = re.compile(r"[?؟]|^(?:هل|كيف|لماذا|ليش|متي|اين|ما|ماذا|لما|how|why|what|when|where|is|are|does|do|can)(?:\s|$)")
+_NEGATION = re.compile(r"(?:^|\s)(?:لا|لم|لن|ليس|ليست|مش|not|don't|doesn't|didn't|isn't|won't|can't)(?=\s|$)")
+_FIRST_PERSON = re.compile(r"(?:^|\s)(?:عندي|لدي|ارسلت|رفعت|حملت|my|i have|i sent|i uploaded)(?=\s|$)")
+
+# A prompt made only of these describes nothing ("ارسم لي شيء", "draw it")
+_STOPWORDS = frozenset((
+    "لي|لنا|عن|من|في|على|ل|شي|شيء|اي|هذا|هذه|ذلك|هو|هي|واحد|واحده|لو|سمحت|فضلك|رجاء|ممكن"
+    "|a|an|the|of|for|me|us|it|this|that|one|some|something|anything|please|pls|now"
+).split("|"))
+_WORD = re.compile(r"\w+")
+
+class Intent(NamedTuple):
+    """Routing decision for one message"""
+    intent: str  # INTENT_IMAGE or INTENT_CHAT
+    confidence: float  # 0..1, how sure the router is about an image request
+    prompt: str  # For images: the description, cut from the original text
+
+CHAT_INTENT = Intent(INTENT_CHAT, 0.0, "")
+
+# Character -> its normalized form, filled in as characters are seen
+_folded_chars: Dict[str, str] = {}
+
+def _fold(char: str) -> str:
+    """Normalize one character (possibly to zero or several characters)"""
+    folded = _folded_chars.get(char)
+    if folded is None:
+        folded = normalize_arabic(char)
+        if len(_folded_chars) < 10000:
+            _folded_chars[char] = folded
+    return folded
+
+def normalize_with_offsets(text: str, limit: int = PREFIX_LENGTH) -> Tuple[str, List[int]]:
+    """
+    Normalize the start of text for matching, keeping a map back to it
+
+    Only the first limit characters are normalized, since command
+    phrases are anchored at the start.
+
+    Returns:
+        tuple: (normalized text, offsets) where offsets[i] is the index in
+            text of normalized character i; one extra entry marks the end
+    """
+    normalized = []
+    offsets = []
+    prefix = text[:limit]
+    for index, char in enumerate(prefix):
+        for piece in _fold(char):
+            normalized.append(piece)
+            offsets.append(index)
+    offsets.append(len(prefix))
+    return "".join(normalized), offsets
+
+def _classifier_score(rest: str) -> float:
+    """Cheap local check of the text after the command phrase; returns a confidence multiplier"""
+    score = 1.0
+    if _QUESTION.search(rest):
+        score *= 0.5
+    if _NEGATION.search(rest):
+        score *= 0.6
+    if _FIRST_PERSON.search(rest):
+        score *= 0.6
+    return score
+
+class IntentRouter:
+    """
+    Routes text messages to image generation or chat
+
+    A message is an image request only if it starts with a command phrase
+    ("ارسم لي صورة عن ...", "أريد صورة لـ ...", "draw a cat"), matched by
+    one compiled regex over the normalized start of the message. The kind
+    of phrase gives a base confidence, which a small keyword classifier
+    lowers when the rest reads like a question, a negation or a remark
+    about the user's own picture. A bare image noun ("صورة جميلة",
+    "photo editing tips") starts below threshold, and a phrase followed by
+    nothing but stopwords scores zero. Below threshold the message goes to
+    chat. The prompt is everything after the phrase, cut from the
+    original text through the offset map, so it keeps its diacritics and
+    spelling.
+    """
+
+    def __init__(self, threshold: float = 0.6):
+        """Initialize the router; image requests need at least threshold confidence"""
+        self.threshold = threshold
+        self.routed: Counter = Counter()
+        self.below_threshold = 0
+
+    def route(self, text: str) -> Intent:
+        """Return the intent, confidence and extracted prompt of a message"""
+        if not text:
+            return CHAT_INTENT
+        normalized, offsets = normalize_with_offsets(text)
+        match = _COMMAND.match(normalized)
+        if match is None:
+            self.routed[INTENT_CHAT] += 1
+            return CHAT_INTENT
+
+        prompt = text[offsets[match.end()]:].lstrip(" \t\n:،,.-–—").strip()
+        normalized_prompt = normalize_with_offsets(prompt)[0]
+        if any(word not in _STOPWORDS for word in _WORD.findall(normalized_prompt)):
+            confidence = _BASE_CONFIDENCE[match.lastgroup] * _classifier_score(normalized_prompt)
+        else:
+            # A command phrase with nothing to draw
+            confidence = 0.0
+
+        if confidence < self.threshold:
+            self.below_threshold += 1
+            self.routed[INTENT_CHAT] += 1
+            return Intent(INTENT_CHAT, confidence, "")
+        self.routed[INTENT_IMAGE] += 1
+        return Intent(INTENT_IMAGE, confidence, prompt)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Return how many messages went each way"""
+        return {
+            'image': self.routed[INTENT_IMAGE],
+            'chat': self.routed[INTENT_CHAT],
+            'below_threshold': self.below_threshold
+        }
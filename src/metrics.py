@@ -0,0 +1,33 @@
+"""
+Metrics module for Telegram AI Bot
+Small in-process latency windows reported through /stats
+"""
+
+from collections import deque
+from typing import Deque, Dict, Optional
+
+class LatencyStats:
+    """Rolling window of latency samples with percentile summaries"""
+
+    def __init__(self, window: int = 500):
+        """Initialize an empty window"""
+        self.samples: Deque[float] = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        """Record one sample"""
+        self.samples.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Return the given percentile (0-1) of the window, or None if empty"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        """Return sample count, p50 and p95"""
+        return {
+            'count': len(self.samples),
+            'p50': self.percentile(0.50),
+            'p95': self.percentile(0.95)
+        }
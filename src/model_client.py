@@ -0,0 +1,98 @@
+"""
+Model client module for Telegram AI Bot
+Thin async wrapper shared by every model API the bot calls
+"""
+
+import logging
+from typing import Any, AsyncContextManager, AsyncIterator, Awaitable, Callable, List, Optional, Tuple, TypeVar
+
+from gemini_scheduler import GeminiScheduler, PRIORITY_INTERACTIVE, QueuedFn
+from resilience import Resilience
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class ModelClient:
+    """
+    One model endpoint called through native async SDK methods
+
+    Calls are plain coroutines on the event loop, so an in-flight request
+    costs a socket and a few objects rather than an OS thread. Every call
+    goes through the endpoint's Resilience wrapper and, when a scheduler
+    is given, holds one of its slots per attempt.
+    """
+
+    def __init__(self, resilience: Resilience, scheduler: Optional[GeminiScheduler] = None,
+                 model_name: Optional[str] = None):
+        """
+        Initialize the client
+
+        Args:
+            resilience: Timeout, retry and circuit breaker policy
+            scheduler: Optional admission control for the calls
+            model_name: Name the model is registered under in the scheduler
+        """
+        self.resilience = resilience
+        self.scheduler = scheduler
+        self.model_name = model_name
+
+    def is_available(self) -> bool:
+        """Check whether calls are currently accepted (circuit breaker not open)"""
+        return self.resilience.breaker.is_available()
+
+    def slot(self, user_id: int = 0, priority: int = PRIORITY_INTERACTIVE,
+             on_queued: Optional[QueuedFn] = None) -> Optional[AsyncContextManager]:
+        """Return a scheduler slot for one call, or None without a scheduler"""
+        if self.scheduler is None:
+            return None
+        return self.scheduler.slot(self.model_name, user_id, priority, on_queued)
+
+    async def call(self, request: Callable[[], Awaitable[T]], user_id: int = 0,
+                   priority: int = PRIORITY_INTERACTIVE, on_queued: Optional[QueuedFn] = None) -> T:
+        """Run request (an async SDK call) with resilience and scheduling"""
+        slot = None
+        if self.scheduler is not None:
+            slot = lambda: self.slot(user_id, priority, on_queued)
+        return await self.resilience.call(request, slot=slot)
+
+class GeminiClient(ModelClient):
+    """ModelClient for a google-generativeai GenerativeModel"""
+
+    def __init__(self, model: Any, model_name: str, resilience: Resilience,
+                 scheduler: Optional[GeminiScheduler] = None):
+        """Initialize the client around a GenerativeModel"""
+        super().__init__(resilience, scheduler, model_name)
+        self.model = model
+
+    async def generate(self, contents: Any, user_id: int = 0, priority: int = PRIORITY_INTERACTIVE,
+                       on_queued: Optional[QueuedFn] = None, **kwargs) -> Any:
+        """Call generate_content_async; kwargs are passed through to the SDK"""
+        return await self.call(
+            lambda: self.model.generate_content_async(contents, **kwargs),
+            user_id, priority, on_queued
+        )
+
+    async def open_stream(self, history: List[dict], message: str) -> Tuple[Any, AsyncIterator]:
+        """
+        Start a streamed chat reply and wait for its first chunk
+
+        Timeouts, retries and hedging cover the wait for the first chunk;
+        each attempt uses a fresh chat session, so attempts share no
+        state. The caller iterates the returned iterator for the rest and
+        is expected to hold slot() for the whole stream.
+
+        Returns:
+            tuple: (first chunk or None for an empty reply, iterator of the rest)
+        """
+        async def start():
+            chat_session = self.model.start_chat(history=history)
+            response = await chat_session.send_message_async(message, stream=True)
+            chunks = response.__aiter__()
+            try:
+                first_chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                first_chunk = None
+            return first_chunk, chunks
+
+        return await self.resilience.call(start)
@@ -0,0 +1,239 @@
+"""
+Rate limiter module for Telegram AI Bot
+Per-user token buckets and global budgets per action type
+"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class ActionLimit(NamedTuple):
+    """Limits of one action type"""
+    per_minute: float  # Sustained rate per user
+    burst: float  # Requests a user may make at once after being idle
+    global_per_minute: float = 0  # Budget shared by all users; 0 for none
+
+def parse_action_limit(value: str, default: ActionLimit) -> ActionLimit:
+    """
+    Parse "per_minute,burst[,global_per_minute]" as used in the environment
+
+    Raises:
+        ValueError: If a field is not a number, per_minute or burst is not
+            positive, or global_per_minute is negative
+    """
+    if not value:
+        return default
+    fields = [float(field) for field in value.split(",")]
+    if not 2 <= len(fields) <= 3:
+        raise ValueError(f"Expected per_minute,burst[,global_per_minute], got {value!r}")
+    limit = ActionLimit(*fields)
+    if limit.per_minute <= 0 or limit.burst <= 0 or limit.global_per_minute < 0:
+        raise ValueError(f"Rate limits must be positive (global_per_minute may be 0), got {value!r}")
+    return limit
+
+class SlidingWindowCounter:
+    """
+    Approximate sliding-window counter in constant memory
+
+    Keeps only the counts of the current and the previous fixed window
+    and weighs the previous one by how much of it still overlaps the
+    sliding window, instead of a timestamp per request.
+    """
+
+    def __init__(self, limit: float, window: float = 60.0):
+        """Allow up to limit events per window seconds"""
+        self.limit = limit
+        self.window = window
+        self._start = time.time()
+        self._current = 0
+        self._previous = 0
+
+    def _estimate(self, now: float) -> float:
+        """Roll the windows forward and return the events in the last window"""
+        elapsed = now - self._start
+        if elapsed >= self.window:
+            windows = int(elapsed // self.window)
+            self._previous = self._current if windows == 1 else 0
+            self._current = 0
+            self._start += windows * self.window
+            elapsed = now - self._start
+        return self._previous * (1 - elapsed / self.window) + self._current
+
+    def retry_after(self, now: float) -> float:
+        """Seconds until one more event fits (0 if it fits now)"""
+        excess = self._estimate(now) + 1 - self.limit
+        if excess <= 0:
+            return 0.0
+        if not self._previous:
+            return self._start + self.window - now
+        # The previous window's weight shrinks linearly
+        return min(excess / self._previous * self.window, self._start + self.window - now)
+
+    def add(self):
+        """Count one event; call right after retry_after() returned 0"""
+        self._current += 1
+
+class RateLimiter:
+    """
+    Token buckets per (user, action) plus a global budget per action
+
+    A user's bucket for an action holds up to burst tokens and refills at
+    per_minute / 60 per second; each request takes one token. The state
+    is two floats per bucket (tokens and when they were counted), and a
+    bucket that has refilled is the same as no bucket, so prune() drops
+    those and memory follows the number of recently active users. The
+    global budget is a SlidingWindowCounter per action.
+
+    With db_path, non-full buckets are saved to SQLite by save() and read
+    back by load(), so a restart does not hand everyone a fresh burst.
+    """
+
+    def __init__(self, limits: Dict[str, ActionLimit], db_path: Optional[str] = None,
+                 notice_interval: float = 30.0):
+        """
+        Initialize the limiter
+
+        Args:
+            limits: Limits by action name
+            db_path: Optional SQLite file to persist buckets in
+            notice_interval: Minimum seconds between throttle notices to one user
+        """
+        self.limits = limits
+        self.notice_interval = notice_interval
+        # (user_id, action) -> (tokens, updated)
+        self._buckets: Dict[Tuple[int, str], Tuple[float, float]] = {}
+        self._global = {
+            action: SlidingWindowCounter(limit.global_per_minute)
+            for action, limit in limits.items() if limit.global_per_minute > 0
+        }
+        self._notified: Dict[int, float] = {}
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    user_id INTEGER NOT NULL,
+                    action TEXT NOT NULL,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    PRIMARY KEY (user_id, action)
+                )
+            """)
+            self._db.commit()
+
+        self.allowed: Counter = Counter()
+        self.throttled: Counter = Counter()
+        self.global_throttled: Counter = Counter()
+
+    def try_acquire(self, user_id: int, action: str) -> float:
+        """
+        Take one request of action for user_id if the limits allow it
+
+        Returns:
+            float: 0 if allowed, otherwise seconds until it would be
+        """
+        limit = self.limits.get(action)
+        if limit is None:
+            return 0.0
+        now = time.time()
+
+        key = (user_id, action)
+        tokens, updated = self._buckets.get(key, (limit.burst, now))
+        tokens = min(limit.burst, tokens + (now - updated) * limit.per_minute / 60)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            self.throttled[action] += 1
+            return (1 - tokens) * 60 / limit.per_minute
+
+        budget = self._global.get(action)
+        if budget is not None:
+            retry_after = budget.retry_after(now)
+            if retry_after:
+                self._buckets[key] = (tokens, now)
+                self.global_throttled[action] += 1
+                return retry_after
+            budget.add()
+
+        self._buckets[key] = (tokens - 1, now)
+        self.allowed[action] += 1
+        return 0.0
+
+    def should_notify(self, user_id: int) -> bool:
+        """Whether a throttled user should be told, at most once per notice_interval"""
+        now = time.time()
+        if now - self._notified.get(user_id, 0.0) < self.notice_interval:
+            return False
+        self._notified[user_id] = now
+        return True
+
+    def prune(self):
+        """Forget buckets that have refilled and notices that have expired"""
+        now = time.time()
+        self._buckets = {
+            key: (tokens, updated) for key, (tokens, updated) in self._buckets.items()
+            if tokens + (now - updated) * self.limits[key[1]].per_minute / 60 < self.limits[key[1]].burst
+        }
+        self._notified = {
+            user_id: notified for user_id, notified in self._notified.items()
+            if now - notified < self.notice_interval
+        }
+
+    async def load(self):
+        """Restore the buckets saved in SQLite"""
+        if self._db is None:
+            return
+        rows = await asyncio.to_thread(self._load)
+        for user_id, action, tokens, updated in rows:
+            if action in self.limits:
+                self._buckets[(user_id, action)] = (tokens, updated)
+        self.prune()
+        logger.info(f"Restored {len(self._buckets)} rate limit buckets")
+
+    def _load(self) -> List[Tuple[int, str, float, float]]:
+        with self._db_lock:
+            return self._db.execute("SELECT user_id, action, tokens, updated FROM rate_limits").fetchall()
+
+    async def save(self):
+        """Prune, then write the non-full buckets to SQLite"""
+        self.prune()
+        if self._db is None:
+            return
+        rows = [(user_id, action, tokens, updated) for (user_id, action), (tokens, updated) in self._buckets.items()]
+        await asyncio.to_thread(self._save, rows)
+
+    def _save(self, rows: List[Tuple[int, str, float, float]]):
+        # A bucket refills completely within burst / per_minute minutes;
+        # older rows describe full buckets and can go
+        oldest = time.time() - max(limit.burst / limit.per_minute * 60 for limit in self.limits.values())
+        with self._db_lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO rate_limits (user_id, action, tokens, updated) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._db.execute("DELETE FROM rate_limits WHERE updated < ?", (oldest,))
+            self._db.commit()
+
+    def close(self):
+        """Close the SQLite connection"""
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+                self._db = None
+
+    def get_stats(self) -> Dict[str, object]:
+        """Return tracked buckets and allowed/throttled counts per action"""
+        return {
+            'buckets': len(self._buckets),
+            'allowed': dict(self.allowed),
+            'throttled': dict(self.throttled),
+            'global_throttled': dict(self.global_throttled)
+        }
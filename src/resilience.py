@@ -0,0 +1,272 @@
+"""
+Resilience module for Telegram AI Bot
+Timeouts, retries, hedging and circuit breaking for model API calls
+"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import Any, AsyncContextManager, Awaitable, Callable, Dict, Optional, TypeVar
+
+from metrics import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# HTTP statuses worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Transient errors that carry no status code
+RETRYABLE_ERROR_NAMES = {"APIConnectionError", "APITimeoutError", "DeadlineExceeded", "RetryError"}
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Check whether a failed call is worth retrying
+
+    Recognizes timeouts, connection errors, and errors carrying a
+    retryable HTTP status, from both google-api-core (code) and the
+    OpenAI SDK (status_code).
+    """
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in RETRYABLE_ERROR_NAMES:
+        return True
+    for attribute in ("status_code", "code"):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int):
+            return status in RETRYABLE_STATUS_CODES
+    return False
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open"""
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+
+    After failure_threshold consecutive failures the breaker opens and
+    calls fail fast for reset_timeout seconds. Then a single trial call
+    is let through (half-open): success closes the breaker, failure opens
+    it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """Initialize a closed breaker"""
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._trial_running = False
+
+    def allow(self):
+        """Raise CircuitOpenError unless a call may go through now"""
+        if self.state == self.CLOSED:
+            return
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return
+        raise CircuitOpenError("Provider is temporarily unavailable")
+
+    def is_available(self) -> bool:
+        """Whether a call would currently be let through, without claiming the trial"""
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+        return not (self.state == self.HALF_OPEN and self._trial_running)
+
+    def release_trial(self):
+        """Give up a half-open trial without a verdict (e.g. the call was cancelled)"""
+        self._trial_running = False
+
+    def record_success(self):
+        """Close the breaker after a healthy response"""
+        self._trial_running = False
+        self.failures = 0
+        self.state = self.CLOSED
+
+    def record_failure(self):
+        """Count a provider failure, opening the breaker at the threshold"""
+        self._trial_running = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+                logger.warning(f"Circuit breaker opened after {self.failures} consecutive failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+class Resilience:
+    """
+    Call wrapper for one provider endpoint
+
+    Each attempt runs under a timeout. Retryable failures are retried up
+    to attempts times with full-jitter exponential backoff; other errors
+    are raised at once. With hedging enabled, an attempt still running
+    after the p95 latency of recent calls gets a second, identical
+    request, and whichever finishes first wins. Hedges are capped at
+    hedge_budget of all calls so a provider-wide slowdown does not double
+    the load. A circuit breaker shared by all calls fails fast while the
+    provider keeps failing.
+    """
+
+    def __init__(self, name: str, timeout: float = 60.0, attempts: int = 3,
+                 base_delay: float = 0.5, max_delay: float = 8.0,
+                 hedge: bool = False, hedge_budget: float = 0.1,
+                 breaker: Optional[CircuitBreaker] = None):
+        """Initialize the wrapper; see the class docstring for the parameters"""
+        self.name = name
+        self.timeout = timeout
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.hedge_budget = hedge_budget
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyStats()
+
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.short_circuits = 0
+
+        registry[name] = self
+
+    async def call(self, fn: Callable[[], Awaitable[T]],
+                   slot: Optional[Callable[[], AsyncContextManager]] = None) -> T:
+        """
+        Call fn with timeouts, retries, hedging and the circuit breaker
+
+        Args:
+            fn: Starts one attempt; called again for every retry or hedge
+            slot: Optional scheduler slot factory, entered around each
+                attempt so that queueing time is not counted against the
+                timeout and every retry is rate limited again
+
+        Raises:
+            CircuitOpenError: If the breaker is open
+            Exception: The last error once retries are exhausted
+        """
+        try:
+            self.breaker.allow()
+        except CircuitOpenError:
+            self.short_circuits += 1
+            raise
+        self.calls += 1
+
+        try:
+            return await self._call(fn, slot)
+        except asyncio.CancelledError:
+            # Not the provider's fault: no verdict for a half-open trial
+            self.breaker.release_trial()
+            raise
+
+    async def _call(self, fn: Callable[[], Awaitable[T]],
+                    slot: Optional[Callable[[], AsyncContextManager]]) -> T:
+        """Run attempts until one succeeds or the error is final"""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = await self._attempt(fn, slot)
+            except Exception as e:
+                if not is_retryable(e):
+                    # The provider answered; the request itself was bad
+                    self.breaker.record_success()
+                    self.failures += 1
+                    raise
+                if isinstance(e, asyncio.TimeoutError):
+                    self.timeouts += 1
+                if attempt >= self.attempts:
+                    self.failures += 1
+                    self.breaker.record_failure()
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+                logger.warning(f"{self.name} call failed ({e!r}), retry {attempt} in {delay:.1f}s")
+                self.retries += 1
+                await asyncio.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            return result
+
+    async def _attempt(self, fn: Callable[[], Awaitable[T]],
+                       slot: Optional[Callable[[], AsyncContextManager]]) -> T:
+        """Run one attempt, hedged if enabled and the latency history allows"""
+        hedge_after = self._hedge_delay()
+        if hedge_after is None:
+            return await self._timed(fn, slot)
+
+        primary = asyncio.ensure_future(self._timed(fn, slot))
+        done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+        if done:
+            return primary.result()
+
+        self.hedges += 1
+        backup = asyncio.ensure_future(self._timed(fn, slot))
+        pending = {primary, backup}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self.hedge_wins += 1
+                        return task.result()
+            # Both failed: report the primary's error
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _timed(self, fn: Callable[[], Awaitable[T]],
+                     slot: Optional[Callable[[], AsyncContextManager]]) -> T:
+        """Run fn once under the timeout, recording its latency on success"""
+        if slot is not None:
+            async with slot():
+                return await self._timed(fn, None)
+        started = time.perf_counter()
+        result = await asyncio.wait_for(fn(), self.timeout)
+        self.latency.add(time.perf_counter() - started)
+        return result
+
+    def _hedge_delay(self) -> Optional[float]:
+        """Return when to send a hedge for the next attempt, or None for no hedge"""
+        if not self.hedge or len(self.latency.samples) < 20:
+            return None
+        if self.hedges >= self.hedge_budget * self.calls:
+            return None
+        return self.latency.percentile(0.95)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return breaker state and call counters"""
+        return {
+            'state': self.breaker.state,
+            'times_opened': self.breaker.times_opened,
+            'calls': self.calls,
+            'failures': self.failures,
+            'retries': self.retries,
+            'timeouts': self.timeouts,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'short_circuits': self.short_circuits,
+            'p95': self.latency.percentile(0.95)
+        }
+
+# Every Resilience instance by name, for reporting
+registry: Dict[str, Resilience] = {}
+
+def get_all_stats() -> Dict[str, Dict[str, Any]]:
+    """Return get_stats() of every registered wrapper"""
+    return {name: resilience.get_stats() for name, resilience in registry.items()}
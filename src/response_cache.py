@@ -0,0 +1,196 @@
+"""
+Response cache module for Telegram AI Bot
+Reuses model answers to repeated, context-free questions
+"""
+
+import asyncio
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from text_normalizer import normalize_arabic
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+# Words that make an answer depend on when or by whom it is asked
+_VOLATILE_WORDS = (
+    r"today|tonight|tomorrow|yesterday|now|current|currently|latest|recent|news|date|time|day"
+    r"|price|prices|cost|rate|weather|score|stock|i|me|my|mine|we|our|your"
+    r"|اليوم|الليله|غدا|امس|الان|حاليا|الحالي|الحاليه|اخر|الاخبار|التاريخ|الوقت|الساعه|سعر|اسعار"
+    r"|الطقس|الجو|نتيجه|لي|عندي|انا|نحن|حسابي|رصيدي|اسمي|عمري|طلبي|اشتراكي"
+)
+
+# Questions whose answer does not depend on who asks or what was said before
+DEFAULT_ALLOWLIST = (
+    r"(مرحبا|اهلا|السلام عليكم|هلا|صباح الخير|مساء الخير|hi|hello|hey)( بك| بكم)?",
+    r"(من انت|ما اسمك|عرف بنفسك|who are you|what is your name)",
+    r"(ماذا تستطيع|ماذا يمكنك|ما الذي تستطيع|كيف استخدمك|what can you do|help)( ان تفعل| فعله)?",
+    # "what is photosynthesis", "ما معنى الديمقراطية": a term of up to
+    # three words, none of them about time, prices or the asker
+    rf"(ما هو|ما هي|ما معني|عرف|what is|what are|define)( an?| the)?"
+    rf"(?! .*\b(?:{_VOLATILE_WORDS})\b)( \w+){{1,3}}",
+)
+
+def normalize_prompt(text: str) -> str:
+    """Normalize a prompt so trivially different spellings share a cache entry"""
+    text = _PUNCTUATION.sub(" ", normalize_arabic(text))
+    return _WHITESPACE.sub(" ", text).strip()
+
+def load_allowlist(path: Optional[str]) -> List[str]:
+    """Read allowlist patterns (one regex per line, # for comments) or return the defaults"""
+    if not path:
+        return list(DEFAULT_ALLOWLIST)
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+class ResponseCache:
+    """
+    Two-tier cache of text replies keyed by prompt and conversation context
+
+    Only first-turn prompts that fully match an allowlist pattern (after
+    normalize_prompt) are cached, since only those are context-free
+    enough for one user's answer to be given to another. The key also
+    covers namespace (model and system prompt) and the conversation
+    fingerprint, so a change of either never serves a stale answer.
+
+    The memory tier is an LRU bounded by total bytes, with a time-to-live
+    per entry. The optional SQLite tier, in its own database file, keeps
+    entries across restarts and worker processes.
+    """
+
+    def __init__(self, namespace: str, allowlist: Iterable[str] = DEFAULT_ALLOWLIST,
+                 max_bytes: int = 8 * 1024 * 1024, ttl: float = 24 * 60 * 60,
+                 db_path: Optional[str] = None):
+        """Initialize the cache, creating the SQLite table if a path is given"""
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._allowlist = re.compile("|".join(f"(?:{pattern})" for pattern in allowlist))
+        # key -> (reply, expires_at, generation seconds)
+        self._entries: "OrderedDict[str, Tuple[str, float, float]]" = OrderedDict()
+        self._size = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    reply TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    generation_seconds REAL NOT NULL
+                )
+            """)
+            self._db.commit()
+
+        self.lookups = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.stores = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+
+    def key_for(self, prompt: str, context_fingerprint: str = "") -> Optional[str]:
+        """Return the cache key for a first-turn prompt, or None if it must not be cached"""
+        normalized = normalize_prompt(prompt)
+        if not normalized or not self._allowlist.fullmatch(normalized):
+            return None
+        return hashlib.sha256(f"{self.namespace}\0{context_fingerprint}\0{normalized}".encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        """Return the cached reply for key, checking memory then SQLite"""
+        self.lookups += 1
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] < time.time():
+            self._drop(key)
+            entry = None
+        if entry is None and self._db is not None:
+            entry = await asyncio.to_thread(self._load, key)
+            if entry is not None:
+                self.disk_hits += 1
+                self._remember(key, entry)
+        if entry is None:
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.saved_seconds += entry[2]
+        return entry[0]
+
+    async def put(self, key: str, reply: str, generation_seconds: float):
+        """Store a reply along with how long it took to generate"""
+        entry = (reply, time.time() + self.ttl, generation_seconds)
+        self._remember(key, entry)
+        self.stores += 1
+        if self._db is not None:
+            await asyncio.to_thread(self._save, key, entry)
+
+    def _remember(self, key: str, entry: Tuple[str, float, float]):
+        """Add an entry to the memory tier, evicting least recently used ones"""
+        size = len(entry[0].encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        self._drop(key)
+        self._entries[key] = entry
+        self._size += size
+        while self._size > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _drop(self, key: str):
+        """Remove an entry from the memory tier"""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[0].encode("utf-8"))
+
+    def _load(self, key: str) -> Optional[Tuple[str, float, float]]:
+        """Read an unexpired entry from SQLite"""
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT reply, expires_at, generation_seconds FROM response_cache WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def _save(self, key: str, entry: Tuple[str, float, float]):
+        """Write an entry to SQLite, purging expired ones now and then"""
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO response_cache (key, reply, expires_at, generation_seconds) VALUES (?, ?, ?, ?)",
+                (key, *entry)
+            )
+            if self.stores % 100 == 0:
+                self._db.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+
+    def close(self):
+        """Close the SQLite tier"""
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+                self._db = None
+
+    def get_stats(self) -> Dict[str, float]:
+        """Return size, hit rate and latency saved"""
+        return {
+            'entries': len(self._entries),
+            'bytes': self._size,
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'saved_seconds': self.saved_seconds
+        }
@@ -0,0 +1,251 @@
+"""
+Speech pipeline module for Telegram AI Bot
+Synthesizes voice replies in the background and caches finished audio
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Produces encoded audio for a text and voice name, or None on failure
+SynthesizeFn = Callable[[str, str], Awaitable[Optional[bytes]]]
+# Delivers finished audio to the user
+SendFn = Callable[[bytes], Awaitable[object]]
+
+def audio_key(text: str, voice: str) -> str:
+    """Content address of the audio for a text spoken in a voice"""
+    return hashlib.sha256(f"{voice}\0{text}".encode("utf-8")).hexdigest()
+
+class AudioCache:
+    """
+    Two-level cache of synthesized audio keyed by audio_key()
+
+    The memory level is an LRU bounded by total bytes. The optional disk
+    level keeps one file per key under cache_dir, so canned replies
+    survive restarts; files are written to a temporary name and renamed
+    into place, so a crash never leaves a truncated entry behind. A read
+    touches the file's modification time, and once the directory grows
+    past disk_max_bytes the least recently used files are removed until
+    it is back under three quarters of that.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, cache_dir: Optional[str] = None,
+                 extension: str = "wav", disk_max_bytes: int = 256 * 1024 * 1024):
+        """Initialize the cache, creating cache_dir if needed"""
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.extension = extension
+        self.disk_max_bytes = disk_max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_evictions = 0
+
+        # Bytes on disk as of the last scan plus what this process wrote since;
+        # other processes sharing the directory are caught up by the next scan
+        self._disk_size = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._disk_size = sum(size for _, size, _ in self._disk_files())
+
+    def _path(self, key: str) -> str:
+        """Return the disk path for a key"""
+        return os.path.join(self.cache_dir, f"{key}.{self.extension}")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return cached audio for key, checking memory then disk"""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+
+        if self.cache_dir:
+            path = self._path(key)
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                # The modification time doubles as the last use for eviction
+                os.utime(path)
+            except FileNotFoundError:
+                data = None
+            if data is not None:
+                self._remember(key, data)
+                with self._lock:
+                    self.disk_hits += 1
+                return data
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, data: bytes):
+        """Store audio in memory and on disk"""
+        self._remember(key, data)
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.error(f"❌ Could not write audio cache entry {key}: {e}")
+            return
+        with self._lock:
+            self._disk_size += len(data)
+            if self._disk_size <= self.disk_max_bytes:
+                return
+        self._trim_disk()
+
+    def _disk_files(self) -> List[Tuple[float, int, str]]:
+        """Return (modification time, size, path) of every finished entry on disk"""
+        files = []
+        suffix = f".{self.extension}"
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(suffix) and entry.is_file():
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def _trim_disk(self):
+        """Remove the least recently used files until the directory is under 3/4 of disk_max_bytes"""
+        files = sorted(self._disk_files())
+        total = sum(size for _, size, _ in files)
+        target = self.disk_max_bytes * 3 // 4
+        removed = 0
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        with self._lock:
+            self._disk_size = total
+            self.disk_evictions += removed
+        if removed:
+            logger.info(f"Audio cache evicted {removed} files, {total // (1024 * 1024)} MB left on disk")
+
+    def _remember(self, key: str, data: bytes):
+        """Add an entry to the memory level, evicting least recently used ones"""
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Return entry count, size and hit/miss counters"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'disk_bytes': self._disk_size,
+                'disk_evictions': self.disk_evictions
+            }
+
+class SpeechPipeline:
+    """
+    Background text-to-speech stage
+
+    submit() returns immediately; synthesis and delivery run in a task
+    so the handler that produced the text is not held for the TTS round
+    trip. Each user has at most one pending voice reply: a new submit()
+    or cancel() for the user cancels the previous one. Requests for the
+    same audio share one synthesis, and a synthesis whose requester was
+    cancelled still finishes and fills the cache.
+    """
+
+    def __init__(self, synthesize: SynthesizeFn, cache: AudioCache, voice: str):
+        """Initialize the pipeline around a synthesis function"""
+        self.synthesize = synthesize
+        self.cache = cache
+        self.voice = voice
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def submit(self, user_id: int, text: str, send: SendFn) -> asyncio.Task:
+        """Synthesize text and pass the audio to send, replacing the user's pending reply"""
+        self.cancel(user_id)
+        task = asyncio.create_task(self._speak(text, send))
+        self._tasks[user_id] = task
+        task.add_done_callback(lambda t: self._forget(user_id, t))
+        return task
+
+    def cancel(self, user_id: int):
+        """Cancel the user's pending voice reply, if any"""
+        task = self._tasks.pop(user_id, None)
+        if task and not task.done():
+            task.cancel()
+
+    def _forget(self, user_id: int, task: asyncio.Task):
+        """Drop a finished task unless it was already replaced"""
+        if self._tasks.get(user_id) is task:
+            del self._tasks[user_id]
+
+    async def audio_for(self, text: str) -> Optional[bytes]:
+        """Return audio for text from the cache, synthesizing it on a miss"""
+        key = audio_key(text, self.voice)
+        data = await asyncio.to_thread(self.cache.get, key)
+        if data is not None:
+            return data
+
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._synthesize(key, text))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded so that cancelling one requester does not waste the call
+        return await asyncio.shield(future)
+
+    async def _synthesize(self, key: str, text: str) -> Optional[bytes]:
+        """Run the synthesis function and cache a successful result"""
+        data = await self.synthesize(text, self.voice)
+        if data:
+            await asyncio.to_thread(self.cache.put, key, data)
+        return data
+
+    async def _speak(self, text: str, send: SendFn):
+        """Produce and deliver one voice reply"""
+        try:
+            data = await self.audio_for(text)
+            if data:
+                await send(data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Voice reply error: {e}")
+
+    async def close(self):
+        """Cancel pending replies and wait for in-flight syntheses"""
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), *self._inflight.values(), return_exceptions=True)
+        self._tasks.clear()
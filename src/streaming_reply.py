@@ -0,0 +1,149 @@
+"""
+Streaming reply module for Telegram AI Bot
+Shows a model reply progressively by editing Telegram messages as it streams
+"""
+
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter
+
+from metrics import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+# Telegram's maximum message length
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Time to first token and total generation time of streamed replies
+ttft_stats = LatencyStats()
+total_time_stats = LatencyStats()
+
+def _split_point(text: str, limit: int) -> int:
+    """Find where to cut text to fit in one message, preferring line or word breaks"""
+    if len(text) <= limit:
+        return len(text)
+    for separator in ("\n", " "):
+        cut = text.rfind(separator, limit // 2, limit)
+        if cut > 0:
+            return cut + 1
+    return limit
+
+class StreamingReply:
+    """
+    Progressive reply built from streamed chunks
+
+    A placeholder message is posted immediately and then edited as text
+    arrives, at most once per min_edit_interval seconds to stay within
+    Telegram's edit rate limits. When the text outgrows one message, the
+    current message is finalized at a line or word break and the rest
+    continues in a new message.
+    """
+
+    def __init__(self, message: Message, min_edit_interval: float = 1.0,
+                 placeholder: str = "⏳ ..."):
+        """Prepare a reply to the given user message"""
+        self.message = message
+        self.min_edit_interval = min_edit_interval
+        self.placeholder = placeholder
+
+        self.text = ""
+        self.ttft: Optional[float] = None
+        self._messages: List[Message] = []
+        # Offset in self.text where the last (still editable) message starts
+        self._offset = 0
+        self._shown = ""
+        self._started_at = 0.0
+        self._last_edit = 0.0
+        # False for replies that were not generated (see show())
+        self._timed = True
+
+    async def start(self):
+        """Post the placeholder and start the clock"""
+        self._started_at = time.perf_counter()
+        self._messages.append(await self.message.reply_text(self.placeholder))
+
+    @property
+    def started(self) -> bool:
+        """Whether the placeholder message has been posted"""
+        return bool(self._messages)
+
+    async def status(self, position: int):
+        """Show the request's queue position in the placeholder while nothing has streamed"""
+        if not self.text:
+            await self._edit(self._messages[-1], f"⏳ الطلبات كثيرة الآن، طلبك في قائمة الانتظار (الموقع {position})...")
+
+    async def append(self, chunk: str):
+        """Add a chunk of text, editing the visible message if the rate limit allows"""
+        if not chunk:
+            return
+        if self.ttft is None and self._timed:
+            self.ttft = time.perf_counter() - self._started_at
+            ttft_stats.add(self.ttft)
+
+        self.text += chunk
+        if time.monotonic() - self._last_edit >= self.min_edit_interval:
+            await self._flush()
+
+    async def show(self, text: str):
+        """Show a reply that is already complete (e.g. cached), leaving it out of the latency stats"""
+        self._timed = False
+        await self.append(text)
+
+    async def finish(self, fallback: str) -> str:
+        """
+        Show the complete text, or fallback if nothing was streamed
+
+        Returns:
+            str: The complete streamed text ("" if nothing was streamed)
+        """
+        if self.text:
+            await self._flush()
+            if self._timed:
+                total = time.perf_counter() - self._started_at
+                total_time_stats.add(total)
+                logger.info(f"Streamed reply: {len(self.text)} chars, TTFT {self.ttft:.2f}s, total {total:.2f}s")
+        else:
+            await self._edit(self._messages[-1], fallback)
+        return self.text
+
+    async def fail(self, text: str):
+        """Report an error in place of the placeholder, or after the partial reply"""
+        if self.text:
+            await self._flush()
+            await self.message.reply_text(text)
+        else:
+            await self._edit(self._messages[-1], text)
+
+    async def _flush(self):
+        """Bring the visible messages up to date with self.text"""
+        pending = self.text[self._offset:]
+        while len(pending) > TELEGRAM_MESSAGE_LIMIT:
+            cut = _split_point(pending, TELEGRAM_MESSAGE_LIMIT)
+            await self._edit(self._messages[-1], pending[:cut])
+            self._offset += cut
+            pending = self.text[self._offset:]
+            self._messages.append(await self.message.reply_text(pending[:TELEGRAM_MESSAGE_LIMIT]))
+            self._shown = pending[:TELEGRAM_MESSAGE_LIMIT]
+        await self._edit(self._messages[-1], pending)
+
+    async def _edit(self, message: Message, text: str):
+        """Edit a message, tolerating no-op edits and backing off on flood control"""
+        if not text or (message is self._messages[-1] and text == self._shown):
+            return
+        try:
+            await message.edit_text(text)
+        except RetryAfter as e:
+            # Slow down for the rest of this reply; the next flush catches up
+            self.min_edit_interval = max(self.min_edit_interval * 2, e.retry_after)
+            await asyncio.sleep(e.retry_after)
+            await message.edit_text(text)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        if message is self._messages[-1]:
+            self._shown = text
+        self._last_edit = time.monotonic()
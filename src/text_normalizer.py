@@ -0,0 +1,42 @@
+"""
+Text normalizer module for Telegram AI Bot
+One normalization of Arabic and mixed-script text, shared by every module
+that compares user text against words or patterns
+"""
+
+import unicodedata
+from typing import Dict, Optional
+
+def _build_arabic_table() -> Dict[int, Optional[str]]:
+    """Build the str.translate table applied after NFKC and casefold"""
+    table: Dict[int, Optional[str]] = {}
+
+    # Characters that only decorate or hide a word: Arabic harakat, tanween,
+    # shadda, sukun, dagger alef, Quranic marks and tatweel, plus
+    # zero-width and bidi controls and the soft hyphen
+    invisible = [*range(0x064B, 0x0660), 0x0670, *range(0x06D6, 0x06EE), 0x0640,
+                 *range(0x200B, 0x2010), *range(0x202A, 0x202F), *range(0x2060, 0x2065), 0xFEFF, 0x00AD]
+    table.update({code: None for code in invisible})
+
+    # Arabic letter variants, including Persian/Urdu forms of the same letters
+    table.update(str.maketrans({
+        'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ٲ': 'ا', 'ٳ': 'ا',
+        'ى': 'ي', 'ی': 'ي', 'ې': 'ي', 'ۍ': 'ي', 'ئ': 'ي',
+        'ة': 'ه', 'ۀ': 'ه', 'ہ': 'ه', 'ە': 'ه', 'ھ': 'ه',
+        'ؤ': 'و', 'ک': 'ك', 'ڪ': 'ك'
+    }))
+    return table
+
+# Modules with extra folding of their own (content_filter) extend a copy
+ARABIC_TABLE = _build_arabic_table()
+
+def normalize_arabic(text: str) -> str:
+    """
+    Fold text to the form used for matching
+
+    NFKC folds compatibility forms (fullwidth Latin, Arabic presentation
+    forms, ligatures) to plain letters; casefold lowercases; ARABIC_TABLE
+    then removes diacritics and invisible characters and unifies letter
+    variants, so "أَرْسِمْ" and "ارسم" compare equal.
+    """
+    return unicodedata.normalize('NFKC', text).casefold().translate(ARABIC_TABLE)
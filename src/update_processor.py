@@ -0,0 +1,151 @@
+"""
+Update processor module for Telegram AI Bot
+Processes updates concurrently across users while keeping each user's updates in order
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Deque, Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+class _Entry:
+    """One queued update of a user"""
+
+    __slots__ = ('update', 'coroutine', 'turn', 'started')
+
+    def __init__(self, update: Update, coroutine: Awaitable[Any]):
+        self.update = update
+        self.coroutine = coroutine
+        self.turn = asyncio.Event()
+        self.started = False
+
+def _message_key(update: Update) -> Optional[Tuple[int, int]]:
+    """Return (chat_id, message_id) of the message an update carries or edits"""
+    message = update.effective_message
+    if message is None:
+        return None
+    return message.chat_id, message.message_id
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Concurrent update processing with per-user ordering
+
+    Each user has a FIFO queue; only the update at its head runs, so a
+    user's messages are handled one at a time and in order, while other
+    users' updates run alongside. An update only takes one of the
+    max_in_flight global slots once it reaches the head of its user's
+    queue, so a user waiting on their own slow request never holds a slot
+    that another user could use.
+
+    Edits are merged rather than handled as new requests: an edit of a
+    message that is still waiting in the queue replaces it there (the
+    newest text is answered once, in the original's place), and any other
+    edit is dropped. Updates delivered twice (same update_id) are dropped.
+    """
+
+    def __init__(self, max_in_flight: int = 64, dedupe_window: int = 1000):
+        """Initialize the processor"""
+        # The base class semaphore is entered before do_process_update,
+        # i.e. before the per-user queue; it is set high enough to never
+        # block so that the global cap is applied after the queue instead
+        super().__init__(max_concurrent_updates=1_000_000)
+        self.max_in_flight = max_in_flight
+        self.dedupe_window = dedupe_window
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        self._queues: Dict[int, Deque[_Entry]] = {}
+        self._recent_updates: "OrderedDict[int, None]" = OrderedDict()
+
+        self.processed = 0
+        self.merged_edits = 0
+        self.dropped_edits = 0
+        self.duplicates = 0
+
+    async def initialize(self) -> None:
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        if not isinstance(update, Update):
+            async with self._in_flight:
+                await coroutine
+            return
+
+        if self._is_duplicate(update.update_id):
+            self.duplicates += 1
+            coroutine.close()
+            return
+
+        user = update.effective_user or update.effective_chat
+        key = user.id if user else 0
+        queue = self._queues.setdefault(key, deque())
+
+        if update.edited_message or update.edited_channel_post:
+            self._merge_edit(queue, update, coroutine)
+            if not queue:
+                del self._queues[key]
+            return
+
+        entry = _Entry(update, coroutine)
+        queue.append(entry)
+        if len(queue) == 1:
+            entry.turn.set()
+        try:
+            await entry.turn.wait()
+            entry.started = True
+            async with self._in_flight:
+                # entry.coroutine may have been replaced by a merged edit
+                await entry.coroutine
+            self.processed += 1
+        finally:
+            if not entry.started:
+                # Cancelled while waiting for its turn
+                entry.coroutine.close()
+            if queue[0] is entry:
+                queue.popleft()
+                if queue:
+                    queue[0].turn.set()
+            else:
+                queue.remove(entry)
+            if not queue and self._queues.get(key) is queue:
+                del self._queues[key]
+
+    def _merge_edit(self, queue: Deque[_Entry], update: Update, coroutine: Awaitable[Any]):
+        """Fold an edit into the waiting update it edits, or drop it"""
+        target = _message_key(update)
+        for entry in queue:
+            if not entry.started and _message_key(entry.update) == target:
+                entry.coroutine.close()
+                entry.update = update
+                entry.coroutine = coroutine
+                self.merged_edits += 1
+                return
+        # The original is already being answered (or long done)
+        coroutine.close()
+        self.dropped_edits += 1
+
+    def _is_duplicate(self, update_id: int) -> bool:
+        """Record update_id, reporting whether it was seen recently"""
+        if update_id in self._recent_updates:
+            return True
+        self._recent_updates[update_id] = None
+        if len(self._recent_updates) > self.dedupe_window:
+            self._recent_updates.popitem(last=False)
+        return False
+
+    def get_stats(self) -> Dict[str, int]:
+        """Return queue sizes and counters"""
+        return {
+            'users_queued': len(self._queues),
+            'updates_queued': sum(len(queue) for queue in self._queues.values()),
+            'processed': self.processed,
+            'merged_edits': self.merged_edits,
+            'dropped_edits': self.dropped_edits,
+            'duplicates': self.duplicates
+        }
@@ -0,0 +1,134 @@
+"""
+User cache module for Telegram AI Bot
+Keeps hot user rows in memory in front of the SQLite database
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Dict, Any
+
+# Columns of the users table, in the order UserRecord stores them
+USER_COLUMNS = (
+    'user_id', 'username', 'first_name', 'last_name', 'credits',
+    'is_subscribed', 'subscription_end_date', 'created_at', 'last_active'
+)
+
+class UserRecord:
+    """Compact in-memory copy of a users row"""
+
+    __slots__ = USER_COLUMNS + ('subscription_expires', 'loaded_at')
+
+    def __init__(self, row: Dict[str, Any]):
+        """Build a record from a users row, pre-parsing the subscription expiry"""
+        for column in USER_COLUMNS:
+            setattr(self, column, row[column])
+
+        self.subscription_expires = 0.0
+        if self.is_subscribed and self.subscription_end_date:
+            self.subscription_expires = datetime.fromisoformat(self.subscription_end_date).timestamp()
+        self.loaded_at = time.monotonic()
+
+    def is_subscription_active(self) -> bool:
+        """Check the subscription without touching the database"""
+        return time.time() < self.subscription_expires
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the record in the same shape as a users row"""
+        return {column: getattr(self, column) for column in USER_COLUMNS}
+
+class UserCache:
+    """
+    Bounded LRU cache of UserRecord objects with a time-to-live
+
+    The cache is shared by the database reader and writer threads, so every
+    operation takes a lock. Writers bump a generation counter; a record
+    loaded from the database is only stored if no write happened while it
+    was being read, which keeps a slow reader from caching a stale row.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0):
+        """Initialize an empty cache"""
+        self.max_size = max_size
+        self.ttl = ttl
+        self._records: "OrderedDict[int, UserRecord]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def generation(self) -> int:
+        """Return a token to pass to put() for a record about to be loaded"""
+        return self._generation
+
+    def get(self, user_id: int) -> Optional[UserRecord]:
+        """Return the cached record for user_id, or None on a miss"""
+        with self._lock:
+            record = self._records.get(user_id)
+            if record is None:
+                self.misses += 1
+                return None
+
+            if time.monotonic() - record.loaded_at > self.ttl:
+                del self._records[user_id]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._records.move_to_end(user_id)
+            self.hits += 1
+            return record
+
+    def put(self, record: UserRecord, generation: int):
+        """Store a freshly loaded record unless a write raced with the load"""
+        with self._lock:
+            if generation != self._generation:
+                return
+
+            self._records[record.user_id] = record
+            self._records.move_to_end(record.user_id)
+            while len(self._records) > self.max_size:
+                self._records.popitem(last=False)
+                self.evictions += 1
+
+    def update_credits(self, user_id: int, credits: int):
+        """Apply a committed credit balance to the cached record"""
+        with self._lock:
+            self._generation += 1
+            record = self._records.get(user_id)
+            if record is not None:
+                record.credits = credits
+
+    def update_last_active(self, user_id: int, last_active: str):
+        """Apply a pending last_active timestamp to the cached record"""
+        with self._lock:
+            record = self._records.get(user_id)
+            if record is not None:
+                record.last_active = last_active
+
+    def invalidate(self, user_id: int):
+        """Drop a record after a write the cache cannot apply in place"""
+        with self._lock:
+            self._generation += 1
+            self._records.pop(user_id, None)
+
+    def clear(self):
+        """Drop every record"""
+        with self._lock:
+            self._generation += 1
+            self._records.clear()
+
+    def get_stats(self) -> Dict[str, int]:
+        """Return hit/miss/eviction counters"""
+        with self._lock:
+            return {
+                'size': len(self._records),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
@@ -0,0 +1,225 @@
+"""
+Webhook server module for Telegram AI Bot
+Receives updates over HTTPS and shards them by user across worker processes
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import multiprocessing
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+from telegram import Bot, Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Update fields whose payload carries the user in "from"
+USER_UPDATE_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+    "shipping_query", "pre_checkout_query", "poll_answer", "my_chat_member", "chat_member",
+    "chat_join_request"
+)
+
+# A worker that died is restarted at most this often (seconds); updates
+# for its shard are answered with 503 in between, so Telegram retries them
+WORKER_RESTART_INTERVAL = 10.0
+
+def _as_id(value: Any) -> Optional[int]:
+    """Return value if it is a usable Telegram id, else None"""
+    if isinstance(value, int) and not isinstance(value, bool) and value:
+        return value
+    return None
+
+def extract_user_id(update: Dict[str, Any]) -> int:
+    """Return the id of the user an update is from, or 0 for updates without a valid one"""
+    for field in USER_UPDATE_FIELDS:
+        payload = update.get(field)
+        if payload:
+            user = payload.get("from") or payload.get("user") or {}
+            user_id = _as_id(user.get("id"))
+            if user_id is not None:
+                return user_id
+            chat = payload.get("chat") or {}
+            return _as_id(chat.get("id")) or 0
+    return 0
+
+def _run_worker(build_application: Callable[[], Application], updates: multiprocessing.Queue, index: int):
+    """Process entry point: run an Application fed from the updates queue"""
+    # Shutdown is coordinated by the front process through the queue
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve_updates(build_application(), updates, index))
+
+async def _serve_updates(app: Application, updates: multiprocessing.Queue, index: int):
+    """Feed updates from the front process into the Application until told to stop"""
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    logger.info(f"Webhook worker {index} started")
+
+    # One thread blocks on the queue so the event loop never does
+    reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"updates-{index}")
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            data = await loop.run_in_executor(reader, updates.get)
+            if data is None:
+                break
+            try:
+                update = Update.de_json(json.loads(data), app.bot)
+            except Exception as e:
+                logger.error(f"❌ Discarding malformed update: {e}")
+                continue
+            await app.update_queue.put(update)
+    finally:
+        reader.shutdown(wait=False)
+        # Application.run_polling's order: shutdown() still flushes the
+        # persistence, so post_shutdown may only close what it uses last
+        await app.stop()
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+        logger.info(f"Webhook worker {index} stopped")
+
+class WebhookServer:
+    """
+    aiohttp front end for webhook mode
+
+    Telegram posts updates to path; requests without the right secret
+    token are rejected. Each update is routed to worker user_id % workers,
+    so all of a user's updates are handled, in order, by the same
+    process, while different users are spread over all cores. Workers
+    are separate processes running their own Application built by
+    build_application (which must be picklable, i.e. a module-level
+    function), and share state only through the SQLite database. The
+    front process never calls build_application, so anything it creates
+    exists only in the workers.
+    """
+
+    def __init__(self, token: str, build_application: Callable[[], Application], url: str,
+                 secret_token: str, workers: int = 2, host: str = "0.0.0.0", port: int = 8080,
+                 path: str = "/telegram"):
+        """Initialize the server; call run() to start it"""
+        self.token = token
+        self.build_application = build_application
+        self.url = url
+        self.secret_token = secret_token
+        self.worker_count = workers
+        self.host = host
+        self.port = port
+        self.path = path
+
+        # Fresh interpreters: the workers must not inherit threads, locks
+        # or database connections from this process
+        self._context = multiprocessing.get_context("spawn")
+        self._queues: List[multiprocessing.Queue] = []
+        self._workers: List[multiprocessing.Process] = []
+        self._started_at: List[float] = []
+
+        self.received = 0
+        self.rejected = 0
+        self.unavailable = 0
+
+    def _start_workers(self):
+        """Spawn one worker process per shard"""
+        for index in range(self.worker_count):
+            queue, worker = self._spawn_worker(index)
+            self._queues.append(queue)
+            self._workers.append(worker)
+            self._started_at.append(time.monotonic())
+
+    def _spawn_worker(self, index: int) -> Tuple[multiprocessing.Queue, multiprocessing.Process]:
+        """Start the worker process for shard index, with a fresh queue"""
+        queue = self._context.Queue()
+        worker = self._context.Process(
+            target=_run_worker,
+            args=(self.build_application, queue, index),
+            name=f"bot-worker-{index}",
+            daemon=True
+        )
+        worker.start()
+        return queue, worker
+
+    def _ensure_worker(self, index: int) -> bool:
+        """
+        Make sure the worker for shard index is running
+
+        A dead worker is replaced, unless it was started less than
+        WORKER_RESTART_INTERVAL ago, so one that dies on startup is not
+        respawned for every request. Updates still queued for it are lost.
+
+        Returns:
+            bool: False if the shard has no live worker to take updates
+        """
+        worker = self._workers[index]
+        if worker.is_alive():
+            return True
+        if time.monotonic() - self._started_at[index] < WORKER_RESTART_INTERVAL:
+            return False
+        logger.error(f"❌ {worker.name} died (exit code {worker.exitcode}), restarting it")
+        self._queues[index].close()
+        self._queues[index], self._workers[index] = self._spawn_worker(index)
+        self._started_at[index] = time.monotonic()
+        return True
+
+    def _stop_workers(self, timeout: float = 30.0):
+        """Ask every worker to finish its queued updates and exit"""
+        for queue in self._queues:
+            queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                logger.warning(f"{worker.name} did not stop in time, terminating it")
+                worker.terminate()
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        """Validate a webhook request and queue the update for its shard"""
+        if not hmac.compare_digest(request.headers.get(SECRET_TOKEN_HEADER, ""), self.secret_token):
+            self.rejected += 1
+            return web.Response(status=403)
+
+        data = await request.read()
+        try:
+            user_id = extract_user_id(json.loads(data))
+        except (ValueError, AttributeError):
+            return web.Response(status=400)
+
+        index = user_id % self.worker_count
+        if not self._ensure_worker(index):
+            self.unavailable += 1
+            return web.Response(status=503)
+
+        self.received += 1
+        # The raw body is forwarded; the worker parses it into an Update
+        self._queues[index].put(data)
+        return web.Response()
+
+    async def _on_startup(self, app: web.Application):
+        """Register the webhook with Telegram"""
+        async with Bot(self.token) as bot:
+            await bot.set_webhook(
+                url=self.url,
+                secret_token=self.secret_token,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=100
+            )
+        logger.info(f"Webhook set to {self.url} with {self.worker_count} workers")
+
+    def run(self):
+        """Start the workers and serve webhook requests until interrupted"""
+        self._start_workers()
+        try:
+            app = web.Application(client_max_size=1024 * 1024)
+            app.router.add_post(self.path, self.handle_update)
+            app.on_startup.append(self._on_startup)
+            web.run_app(app, host=self.host, port=self.port, print=None)
+        finally:
+            self._stop_workers()
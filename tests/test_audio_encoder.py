@@ -0,0 +1,29 @@
+import asyncio
+import shutil
+
+import pytest
+
+from audio_encoder import OpusEncoder
+
+pytestmark = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+
+
+def test_encodes_pcm_to_ogg():
+    # Built outside any event loop, as bot.py does
+    encoder = OpusEncoder(workers=1, max_pending=2)
+    # One second of silence at 24 kHz
+    pcm = b"\0\0" * 24000
+    try:
+        audio = asyncio.run(encoder.encode(pcm))
+    finally:
+        encoder.close()
+    assert audio[:4] == b"OggS"
+
+
+def test_rejects_empty_audio():
+    encoder = OpusEncoder(workers=1)
+    try:
+        with pytest.raises(ValueError):
+            asyncio.run(encoder.encode(b""))
+    finally:
+        encoder.close()
@@ -0,0 +1,81 @@
+import pytest
+
+from content_filter import ContentFilter, TermMatcher, normalize_text
+
+
+@pytest.fixture(scope="module")
+def content_filter():
+    return ContentFilter()
+
+
+@pytest.mark.parametrize("prompt, category", [
+    # Arabic proclitics in front of a listed bare form
+    ("صورة القتل في الشارع", "violence"),
+    ("رجل مع القنبلة", "violence"),
+    ("صورة للمخدرات", "illegal"),
+    ("رجل يتاجر بالمخدرات", "illegal"),
+    ("وبالمخدرات أيضا", "illegal"),
+    # Diacritics, tatweel and letter variants
+    ("صورة قَتْــــل رجل", "violence"),
+    ("صوره اباحيه", "nsfw"),
+    # Everyday words only banned inside phrases
+    ("رجل وامرأة في ممارسة الجنس", "nsfw"),
+    ("مشهد جنسي صريح", "nsfw"),
+    ("شاب يدخن سيجارة حشيش", "illegal"),
+    ("طاولة عليها مخدر الحشيش", "illegal"),
+    # Spelled out or split words
+    ("a n.u.d.e woman", "nsfw"),
+    ("a n u d e woman", "nsfw"),
+    ("a nu de woman", "nsfw"),
+    ("k-i-l-l him", "violence"),
+    # Homoglyphs, leetspeak, fullwidth and zero-width characters
+    ("s3x on the beach", "nsfw"),
+    ("ѕех", "nsfw"),
+    ("ｎｕｄｅ woman", "nsfw"),
+    ("n​ude", "nsfw"),
+    # Multi-word terms
+    ("this is NOT SAFE FOR WORK!", "nsfw"),
+])
+def test_rejects_obfuscated_terms(content_filter, prompt, category):
+    verdict = content_filter.check_prompt(prompt)
+    assert not verdict.safe
+    assert verdict.category == category
+
+
+@pytest.mark.parametrize("prompt", [
+    "ارسم قطة جميلة على الشاطئ",
+    # جنس (breed, gender), جنسية (nationality) and حشيش (grass) on their own
+    "قطة من جنس سيامي",
+    "صورة جواز سفر بالجنسية المغربية",
+    "رجل يحمل الجنسية الفرنسية",
+    "ارسم حقل حشيش اخضر",
+    "بقرة تأكل الحشيش",
+    "الجنس البشري في المستقبل",
+    "ولد يلعب بالكرة في الحديقة",
+    "بيت كبير في الريف",
+    "a beautiful sunset over mountains",
+    "skill issue with a new game",
+    "a sunset with 3 birds",
+    "a b c",
+])
+def test_accepts_innocent_prompts(content_filter, prompt):
+    assert content_filter.check_prompt(prompt).safe
+
+
+def test_proclitics_only_stripped_into_term_words():
+    matcher = TermMatcher({normalize_text("قتل"): "violence"})
+    # "وقت" (time) and "لقتل" would only match if the prefix were stripped blindly
+    assert matcher.search(normalize_text("وقت الغروب")) is None
+    assert matcher.search(normalize_text("لقتل")) == ("violence", "قتل")
+
+
+@pytest.mark.parametrize("prompt, category", [
+    ("mail me a@b.com", "email"),
+    ("go to http://x.y", "url"),
+    ("call 555-123-4567", "phone"),
+    ("aaaaaaaaaaaaaaaa", "repetition"),
+    ("x" * 1001, "too_long"),
+    ("  a ", "too_short"),
+])
+def test_form_checks(content_filter, prompt, category):
+    assert content_filter.check_prompt(prompt).category == category
@@ -0,0 +1,66 @@
+import asyncio
+import zlib
+
+import pytest
+
+from conversation_memory import ConversationMemory
+from conversation_store import ConversationPersistence
+
+
+class FakeDatabase:
+    """The conversation methods of AsyncBotDatabase, in memory"""
+
+    def __init__(self, conversations):
+        self.conversations = dict(conversations)
+
+    async def load_conversation(self, user_id):
+        return self.conversations.get(user_id)
+
+    async def save_conversation(self, user_id, data, durable=False):
+        self.conversations[user_id] = data
+
+    async def delete_conversation(self, user_id):
+        self.conversations.pop(user_id, None)
+
+
+def _memory():
+    memory = ConversationMemory()
+    memory.summary = "likes cats"
+    memory.turns += [("user", "hello"), ("model", "hi there")]
+    return memory
+
+
+def _corruptions():
+    blob = _memory().to_bytes()
+    return [
+        blob[:len(blob) // 2],
+        b"not zlib at all",
+        # Valid zlib around a header that claims more text than follows
+        zlib.compress(b"\x01\x00\x00\x00\x50abc"),
+        # Valid zlib around a header cut short
+        zlib.compress(b"\x01\x00"),
+    ]
+
+
+@pytest.mark.parametrize("blob", _corruptions())
+def test_from_bytes_reports_corruption_as_value_error(blob):
+    with pytest.raises(ValueError):
+        ConversationMemory.from_bytes(blob)
+
+
+@pytest.mark.parametrize("blob", _corruptions())
+def test_unreadable_conversation_is_dropped_and_replaced(blob):
+    db = FakeDatabase({7: blob})
+    persistence = ConversationPersistence(db)
+    user_data = {}
+    asyncio.run(persistence.refresh_user_data(7, user_data))
+    assert user_data['memory'].turns == []
+    assert 7 not in db.conversations
+
+
+def test_saved_conversation_round_trips():
+    db = FakeDatabase({7: _memory().to_bytes()})
+    user_data = {}
+    asyncio.run(ConversationPersistence(db).refresh_user_data(7, user_data))
+    assert user_data['memory'].summary == "likes cats"
+    assert user_data['memory'].turns == [("user", "hello"), ("model", "hi there")]
@@ -0,0 +1,141 @@
+import asyncio
+import gzip
+import multiprocessing
+import sqlite3
+import threading
+import time
+
+from database import MIGRATIONS, AsyncBotDatabase, BotDatabase
+
+
+def _open_and_register(db_path, user_id):
+    db = BotDatabase(db_path, activity_flush_interval=0)
+    db.create_user(user_id)
+    db.close()
+
+
+def test_concurrent_processes_migrate_once(tmp_path):
+    db_path = str(tmp_path / "bot.db")
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=_open_and_register, args=(db_path, user_id)) for user_id in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+    assert [worker.exitcode for worker in workers] == [0] * len(workers)
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+    # 2 = incremental
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 4
+
+
+def test_new_users_get_timestamps_on_upgraded_databases(tmp_path):
+    db_path = str(tmp_path / "bot.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY, credits INTEGER DEFAULT 1)")
+    conn.execute("INSERT INTO users (user_id) VALUES (1)")
+    conn.commit()
+    conn.close()
+
+    db = BotDatabase(db_path, activity_flush_interval=0)
+    assert db.create_user(2, "new")
+    user = db.get_user(2)
+    db.close()
+    assert user["created_at"] is not None
+    assert user["last_active"] is not None
+
+
+def _add_old_history(db_path, rows):
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO image_history (user_id, prompt, image_url, created_at) VALUES (?, ?, ?, ?)",
+        [(1, f"prompt {index}", "url", "2020-01-15 12:00:00") for index in range(rows)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_archive_does_not_hold_up_writes(tmp_path):
+    db_path = str(tmp_path / "bot.db")
+    BotDatabase(db_path, activity_flush_interval=0).close()
+    _add_old_history(db_path, 20000)
+
+    async def archive_while_writing():
+        db = AsyncBotDatabase(db_path)
+        archive = asyncio.ensure_future(db.archive_image_history(30, str(tmp_path / "archive")))
+        await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        await db.create_user(42)
+        write_seconds = time.perf_counter() - started
+        archive_done_first = archive.done()
+        archived = await archive
+        await db.close()
+        return write_seconds, archive_done_first, archived
+
+    write_seconds, archive_done_first, archived = asyncio.run(archive_while_writing())
+    assert archived == 20000
+    assert not archive_done_first
+    assert write_seconds < 1
+
+    with gzip.open(tmp_path / "archive" / "image_history-2020-01.jsonl.gz", "rt", encoding="utf-8") as f:
+        assert sum(1 for _ in f) == 20000
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM image_history").fetchone()[0] == 0
+
+
+def _spend_concurrently(db_path, worker, threads=4, keys=60, deducts=5):
+    """Reserve, commit, refund and deduct credits from several threads; returns successful deducts"""
+    db = BotDatabase(db_path, activity_flush_interval=0)
+    deducted = []
+
+    def spend(thread):
+        count = 0
+        for index in range(keys):
+            # Every thread of every process pays for the same operations
+            key = f"image-{index}"
+            if db.reserve_credit(1, key):
+                if index % 3 == 0:
+                    db.refund_credit(key)
+                elif index % 3 == 1:
+                    db.commit_credit(key)
+            if index % 10 == 0:
+                db.add_credits(1, 10, f"payment-{index // 10}")
+            if index < deducts and (worker + thread) % 2 == 0:
+                count += db.deduct_credit(1)
+        deducted.append(count)
+
+    workers = [threading.Thread(target=spend, args=(thread,)) for thread in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    db.close()
+    return sum(deducted)
+
+
+def test_concurrent_charges_never_overdraw_or_double_charge(tmp_path):
+    db_path = str(tmp_path / "bot.db")
+    db = BotDatabase(db_path, activity_flush_interval=0)
+    db.create_user(1)
+    db.close()
+
+    with multiprocessing.get_context("spawn").Pool(3) as pool:
+        deducted = sum(pool.starmap(_spend_concurrently, [(db_path, worker) for worker in range(3)]))
+
+    conn = sqlite3.connect(db_path)
+    balance = conn.execute("SELECT credits FROM users WHERE user_id = 1").fetchone()[0]
+    ledger = conn.execute("SELECT idempotency_key, delta, status FROM credit_ledger").fetchall()
+    conn.close()
+
+    keys = [key for key, _, _ in ledger]
+    assert len(keys) == len(set(keys))
+    payments = sum(delta for key, delta, _ in ledger if key.startswith("payment-"))
+    charges = [(key, status) for key, delta, status in ledger if key.startswith("image-")]
+    # Six payments of 10, each applied once however many workers sent it
+    assert payments == 60
+    # Every refunded reservation gave its credit back, exactly once
+    spent = sum(1 for _, status in charges if status != "refunded")
+    assert balance >= 0
+    assert balance == 1 + payments - spent - deducted
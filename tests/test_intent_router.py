@@ -0,0 +1,62 @@
+import pytest
+
+from intent_router import INTENT_CHAT, INTENT_IMAGE, IntentRouter
+
+
+@pytest.fixture
+def router():
+    return IntentRouter()
+
+
+@pytest.mark.parametrize("text, prompt", [
+    ("ارسم لي صورة عن قطة تلعب", "قطة تلعب"),
+    ("ارسم قطة جميلة", "قطة جميلة"),
+    ("أريد صورة لـ غروب الشمس", "غروب الشمس"),
+    ("من فضلك صمم صورة: شعار لمقهى", "شعار لمقهى"),
+    ("توليد صورة عن مدينة مستقبلية", "مدينة مستقبلية"),
+    ("صورة عن قطة في الفضاء", "قطة في الفضاء"),
+    # ل attached to the described word
+    ("انشئ صورة لقطة", "قطة"),
+    ("اريد صورة لقطة نائمة", "قطة نائمة"),
+    ("صورة لقطة سوداء", "قطة سوداء"),
+    ("ارسم لي صورة للمدينة", "للمدينة"),
+    ("paint a picture of a lake", "a lake"),
+    ("draw me a picture of a red fox", "a red fox"),
+    ("Draw a cat wearing a hat", "a cat wearing a hat"),
+    ("please generate an image of mountains at dawn", "mountains at dawn"),
+    ("image of a lighthouse in a storm", "a lighthouse in a storm"),
+])
+def test_routes_image_requests(router, text, prompt):
+    intent = router.route(text)
+    assert intent.intent == INTENT_IMAGE
+    assert intent.prompt == prompt
+
+
+@pytest.mark.parametrize("text", [
+    # Image words that are the topic, not a request
+    "image processing in python",
+    "photo editing tips for beginners",
+    "صورة جميلة جدا",
+    "draw conclusions from the report",
+    "draw attention to the problem",
+    "ارسم خطة للمشروع",
+    "paint the town red",
+    "paint it black",
+    # A command phrase with nothing to draw
+    "صورة",
+    "ارسم",
+    "ارسم لي",
+    "draw",
+    "draw me something",
+    "ارسم لي صورة",
+    # Questions and remarks about a picture
+    "ارسم لي صورة؟ هل تستطيع",
+    "صورة عن قطة؟",
+    "picture of my cat, I have it here",
+    # No command phrase at the start
+    "what is the capital of France",
+    "can you explain how to draw a cat",
+    "",
+])
+def test_routes_everything_else_to_chat(router, text):
+    assert router.route(text).intent == INTENT_CHAT
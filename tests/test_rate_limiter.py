@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from rate_limiter import ActionLimit, RateLimiter, parse_action_limit
+
+DEFAULT = ActionLimit(20, 10, 0)
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("", DEFAULT),
+    ("6,3", ActionLimit(6, 3, 0)),
+    ("2,3,50", ActionLimit(2, 3, 50)),
+    ("0.5,1,0", ActionLimit(0.5, 1, 0)),
+])
+def test_parses_limits(value, expected):
+    assert parse_action_limit(value, DEFAULT) == expected
+
+
+@pytest.mark.parametrize("value", ["0,3", "6,0", "-1,3", "6,3,-5", "6", "6,3,1,1", "six,3"])
+def test_rejects_invalid_limits(value):
+    with pytest.raises(ValueError):
+        parse_action_limit(value, DEFAULT)
+
+
+def test_burst_then_throttle_and_persist(tmp_path):
+    db_path = str(tmp_path / "limits.db")
+    limiter = RateLimiter({"image": ActionLimit(1, 2)}, db_path)
+    assert limiter.try_acquire(1, "image") == 0
+    assert limiter.try_acquire(1, "image") == 0
+    assert limiter.try_acquire(1, "image") > 0
+    # Other users and unlimited actions are unaffected
+    assert limiter.try_acquire(2, "image") == 0
+    assert limiter.try_acquire(1, "message") == 0
+    asyncio.run(limiter.save())
+    limiter.close()
+
+    restored = RateLimiter({"image": ActionLimit(1, 2)}, db_path)
+    asyncio.run(restored.load())
+    assert restored.try_acquire(1, "image") > 0
+    restored.close()
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from response_cache import ResponseCache, normalize_prompt
+
+
+@pytest.fixture
+def cache():
+    cache = ResponseCache("test")
+    yield cache
+    cache.close()
+
+
+def cacheable(cache, prompt):
+    """Whether a first-turn prompt gets a cache key"""
+    return cache.key_for(prompt, "") is not None
+
+
+@pytest.mark.parametrize("prompt", [
+    "مرحبا",
+    "Hello!",
+    "ما اسمك؟",
+    "what is photosynthesis?",
+    "What is a black hole",
+    "define entropy",
+    "ما هي الديمقراطية؟",
+    "ما معنى كلمة سراب",
+])
+def test_caches_context_free_questions(cache, prompt):
+    assert cacheable(cache, prompt)
+
+
+@pytest.mark.parametrize("prompt", [
+    # Time-sensitive
+    "what is the date today",
+    "what is the time now",
+    "what is the latest iphone",
+    "what is the weather in cairo",
+    "ما هو سعر الذهب اليوم",
+    "ما هي اخر الاخبار",
+    "ما هو الطقس الان",
+    # About the asker
+    "what is my balance",
+    "what are my credits",
+    "ما هو رصيدي",
+    "ما هو اسمي",
+    # Too long to be a definition
+    "what is the best way to learn python quickly",
+    "ما هي افضل طريقة لتعلم البرمجة بسرعة",
+    # Not a question the allowlist covers
+    "tell me a joke",
+])
+def test_does_not_cache_personal_or_volatile_questions(cache, prompt):
+    assert not cacheable(cache, prompt)
+
+
+def test_normalized_spellings_share_an_entry(cache):
+    assert normalize_prompt("ما هِيَ الديمقراطيّة؟") == normalize_prompt("ما هي الديمقراطية")
+
+    async def round_trip():
+        await cache.put(cache.key_for("ما هِيَ الديمقراطيّة؟", ""), "answer", 1.0)
+        return await cache.get(cache.key_for("ما هي الديمقراطية", ""))
+
+    assert asyncio.run(round_trip()) == "answer"
@@ -0,0 +1,31 @@
+import os
+
+from speech_pipeline import AudioCache, audio_key
+
+
+def test_disk_level_evicts_least_recently_used(tmp_path):
+    cache = AudioCache(max_bytes=0, cache_dir=str(tmp_path), extension="ogg", disk_max_bytes=1000)
+    keys = [audio_key(f"reply {index}", "Kore") for index in range(4)]
+    for age, key in enumerate(keys[:3]):
+        cache.put(key, b"x" * 300)
+        # Oldest first, without sleeping between writes
+        os.utime(tmp_path / f"{key}.ogg", (1000 + age, 1000 + age))
+
+    # Reading the oldest entry makes it the most recently used
+    assert cache.get(keys[0]) == b"x" * 300
+    cache.put(keys[3], b"x" * 300)
+
+    remaining = {name[:-len(".ogg")] for name in os.listdir(tmp_path)}
+    assert remaining == {keys[0], keys[3]}
+    assert cache.get_stats()['disk_bytes'] == 600
+    assert cache.get_stats()['disk_evictions'] == 2
+
+
+def test_disk_level_survives_a_new_instance(tmp_path):
+    key = audio_key("canned reply", "Kore")
+    AudioCache(cache_dir=str(tmp_path), extension="ogg").put(key, b"audio")
+
+    cache = AudioCache(cache_dir=str(tmp_path), extension="ogg")
+    assert cache.get_stats()['disk_bytes'] == 5
+    assert cache.get(key) == b"audio"
+    assert cache.get_stats()['disk_hits'] == 1
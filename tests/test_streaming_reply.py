@@ -0,0 +1,41 @@
+import asyncio
+
+import streaming_reply
+from metrics import LatencyStats
+from streaming_reply import StreamingReply
+
+
+class FakeMessage:
+    def __init__(self):
+        self.text = ""
+
+    async def reply_text(self, text):
+        message = FakeMessage()
+        message.text = text
+        return message
+
+    async def edit_text(self, text):
+        self.text = text
+
+
+def run_reply(feed, monkeypatch):
+    ttft, total = LatencyStats(), LatencyStats()
+    monkeypatch.setattr(streaming_reply, "ttft_stats", ttft)
+    monkeypatch.setattr(streaming_reply, "total_time_stats", total)
+
+    async def reply_with(text):
+        reply = StreamingReply(FakeMessage(), min_edit_interval=0)
+        await reply.start()
+        await feed(reply, text)
+        return await reply.finish("fallback")
+
+    assert asyncio.run(reply_with("answer")) == "answer"
+    return ttft.summary()["count"], total.summary()["count"]
+
+
+def test_streamed_replies_are_timed(monkeypatch):
+    assert run_reply(StreamingReply.append, monkeypatch) == (1, 1)
+
+
+def test_cached_replies_are_not_timed(monkeypatch):
+    assert run_reply(StreamingReply.show, monkeypatch) == (0, 0)
@@ -0,0 +1,26 @@
+import pytest
+
+from content_filter import normalize_text
+from intent_router import normalize_with_offsets
+from response_cache import normalize_prompt
+from text_normalizer import normalize_arabic
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("أَرْسِمْ", "ارسم"),
+    ("إنشـــاء صورةٍ", "انشاء صوره"),
+    ("مستشفى", "مستشفي"),
+    ("انشئ لؤلؤة", "انشي لولوه"),
+    ("ی‌ک", "يك"),
+    ("ＨＥＬＬＯ", "hello"),
+])
+def test_normalize_arabic(text, expected):
+    assert normalize_arabic(text) == expected
+
+
+@pytest.mark.parametrize("text", ["أَرْسِمْ صورةً لقطّة", "إنشـاء لوحة", "انشئ رسمة مستشفى"])
+def test_modules_share_one_normalization(text):
+    folded = normalize_arabic(text)
+    assert normalize_text(text) == folded
+    assert normalize_prompt(text) == folded
+    assert normalize_with_offsets(text)[0] == folded
@@ -0,0 +1,86 @@
+import asyncio
+import json
+
+import pytest
+
+import webhook_server
+from webhook_server import SECRET_TOKEN_HEADER, WebhookServer, extract_user_id
+
+
+@pytest.mark.parametrize("update, user_id", [
+    ({"message": {"from": {"id": 42}, "chat": {"id": -100}}}, 42),
+    ({"message": {"chat": {"id": -100}}}, -100),
+    ({"callback_query": {"from": {"id": 7}}}, 7),
+    ({"message": {"from": {"id": "42"}, "chat": {"id": "x"}}}, 0),
+    ({"message": {"from": {"id": True}}}, 0),
+    ({"message": {"from": {"id": 4.2}, "chat": {"id": 9}}}, 9),
+    ({"update_id": 1}, 0),
+])
+def test_extract_user_id(update, user_id):
+    assert extract_user_id(update) == user_id
+
+
+class FakeQueue:
+    def __init__(self):
+        self.items = []
+
+    def put(self, item):
+        self.items.append(item)
+
+    def close(self):
+        pass
+
+
+class FakeProcess:
+    name = "bot-worker-0"
+    exitcode = 1
+
+    def __init__(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+
+class FakeRequest:
+    def __init__(self, update):
+        self.headers = {SECRET_TOKEN_HEADER: "secret"}
+        self._body = json.dumps(update).encode()
+
+    async def read(self):
+        return self._body
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = WebhookServer("token", None, "https://example.com", "secret", workers=1)
+    monkeypatch.setattr(server, "_spawn_worker", lambda index: (FakeQueue(), FakeProcess()))
+    server._start_workers()
+    return server
+
+
+def post(server, update):
+    return asyncio.run(server.handle_update(FakeRequest(update))).status
+
+
+def test_string_user_id_goes_to_first_shard(server):
+    assert post(server, {"message": {"from": {"id": "abc"}}}) == 200
+    assert len(server._queues[0].items) == 1
+
+
+def test_dead_worker_is_restarted(server, monkeypatch):
+    dead = server._workers[0]
+    dead.alive = False
+    monkeypatch.setattr(webhook_server, "WORKER_RESTART_INTERVAL", 0.0)
+
+    assert post(server, {"message": {"from": {"id": 1}}}) == 200
+    assert server._workers[0] is not dead
+    assert len(server._queues[0].items) == 1
+
+
+def test_worker_dying_on_startup_gets_503(server):
+    server._workers[0].alive = False
+
+    assert post(server, {"message": {"from": {"id": 1}}}) == 503
+    assert server.unavailable == 1
+    assert server._queues[0].items == []